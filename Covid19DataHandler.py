@@ -1,74 +1,712 @@
+import os
+import re
+import json
+import shutil
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
 import pandas as pd
 import numpy as np
-from typing import Type
-
-from tech_analysis_lib import calculate_macd, calculate_rsi
-
-def getCovidDataFrame(DATA_FILE_PATH: str = None, raw_dataframe: Type[pd.DataFrame] = None, country: str = 'Taiwan*', op_mode: int = 0) -> Type[pd.DataFrame]:
-    if op_mode == 0:
-        df = pd.read_csv(DATA_FILE_PATH, sep=',')
-    elif op_mode == 1:
-        df = raw_dataframe
-
-    # delete unused columns
-    df.drop(labels=['Lat', 'Long'], axis=1, inplace=True)
-
-    # merge Country/Region and Province/State.  ref:https://stackoverflow.com/questions/56771162/concatenating-two-columns-in-pandas-dataframe-without-adding-extra-spaces-at-the
-    df['Country/Region'] = np.where(df['Province/State'].isnull(), df['Country/Region'], df['Country/Region'] + ' ' + df['Province/State'])
-    
-    # delete unused columns
-    df.drop(labels=['Province/State'], axis=1, inplace=True)
-
-    # extract Taiwan dataset from DataFrame
-    filter = df['Country/Region'] == country
-    df_tw = df[filter]
-
-    # transpose DataFrame
-    df_tw_transpose = df_tw.transpose()
-    df_tw_transpose.reset_index(inplace=True)
-    
-    # delete first rows
-    df_tw_transpose.drop([0],inplace=True)
-
-    # modify index names
-    df_tw_transpose.columns=['date', 'accu_cases']
-
-    # calculate daily cases. ref:https://pandas.pydata.org/pandas-docs/stable/getting_started/intro_tutorials/05_add_columns.html
-    df_tw_transpose['daily_cases'] = df_tw_transpose['accu_cases'] - df_tw_transpose['accu_cases'].shift(1)
-    
-    # remove the NaN in daily_cases. ref: https://pandas.pydata.org/pandas-docs/stable/reference/api/pandas.DataFrame.iat.html
-    df_tw_transpose.iat[0, 2] = 0
-    
-    # replacing negative value in daily_cases. ref: https://stackoverflow.com/questions/49681363/replace-negative-values-in-single-dataframe-column
-    df_tw_transpose.daily_cases = df_tw_transpose.daily_cases.mask(df_tw_transpose.daily_cases.lt(0),0)
+from typing import Type, Dict, List, Tuple, Optional, Union
+
+from tech_analysis_lib import calculate_macd, calculate_rsi, calculate_sma_batch, calculate_ema_batch, calculate_macd_batch, calculate_rsi_batch, MACDState
+from data_loader import DataSource, open_data_source
+from perf_metrics import span
+from region_index import RegionIndex
+from region_groups import RegionGroups, build_region_groups
+from screener import LatestSnapshot
+from lod import LevelOfDetail
+from data_quality import DataQuality, QualityPolicy, clean_daily_cases
+
+try:
+    import fcntl
+except ImportError:  # windows: no snapshot lock, concurrent saves only write redundant generations
+    fcntl = None
+
+
+# MACD periods and RSI lengths precomputed for every region
+MACD_PERIODS = (26, 12, 9)
+RSI_LENGTHS = (6, 12)
+# moving average periods of the SMA/EMA charts
+MA_PERIODS = (7, 30, 90, 120)
+
+# parameters of every indicator that can be computed with user chosen values, the defaults match the
+# precomputed MACD/RSI. MACD periods are (long, short, signal), the others draw one series per period.
+INDICATOR_DEFAULTS = {
+    'SMA': {'periods': MA_PERIODS},
+    'EMA': {'periods': MA_PERIODS},
+    'MACD': {'periods': MACD_PERIODS},
+    'RSI': {'periods': RSI_LENGTHS, 'smoothing': 'sma'},
+}
+MAX_INDICATOR_PERIOD = 365
+MAX_INDICATOR_SERIES = 6
+# indicator series with non default parameters memoized per store
+INDICATOR_CACHE_ENTRIES = 512
+
+# bump when the snapshot layout changes, older snapshots are then ignored
+SNAPSHOT_FORMAT = 6
+# file in the snapshot directory naming the generation directory that holds the current snapshot
+SNAPSHOT_POINTER = 'CURRENT'
+# generation directories kept besides the current one, for readers still opening an older generation
+SNAPSHOT_KEEP_GENERATIONS = 2
+
+# JHU time series sharing the same wide layout: a few region columns, then one column per date.
+# region_columns are joined with spaces (missing parts skipped) into the region name. group_totals lists the key
+# columns of the aggregate rows added after the regions (country totals, US state totals) and who_column the
+# country column of the WHO region and world aggregates, see region_groups. every other non-date column
+# (Lat/Long, UID, FIPS, Population, ...) is never loaded.
+JHU_TIME_SERIES_URL = 'https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/csse_covid_19_data/csse_covid_19_time_series/'
+DATASETS = {
+    'confirmed_global': {'file_name': 'time_series_covid19_confirmed_global.csv', 'label': '全球確診 Confirmed (Global)',
+                         'region_columns': ['Country/Region', 'Province/State'],
+                         'group_totals': [['Country/Region']], 'who_column': 'Country/Region'},
+    'deaths_global': {'file_name': 'time_series_covid19_deaths_global.csv', 'label': '全球死亡 Deaths (Global)',
+                      'region_columns': ['Country/Region', 'Province/State'],
+                      'group_totals': [['Country/Region']], 'who_column': 'Country/Region'},
+    'recovered_global': {'file_name': 'time_series_covid19_recovered_global.csv', 'label': '全球康復 Recovered (Global)',
+                         'region_columns': ['Country/Region', 'Province/State'],
+                         'group_totals': [['Country/Region']], 'who_column': 'Country/Region'},
+    'confirmed_US': {'file_name': 'time_series_covid19_confirmed_US.csv', 'label': '美國各郡確診 Confirmed (US Counties)',
+                     'region_columns': ['Combined_Key'],
+                     'group_totals': [['Province_State', 'Country_Region'], ['Country_Region']], 'who_column': None},
+    'deaths_US': {'file_name': 'time_series_covid19_deaths_US.csv', 'label': '美國各郡死亡 Deaths (US Counties)',
+                  'region_columns': ['Combined_Key'],
+                  'group_totals': [['Province_State', 'Country_Region'], ['Country_Region']], 'who_column': None},
+}
+DEFAULT_DATASET = 'confirmed_global'
+
+# header dates look like 1/22/20
+DATE_COLUMN_PATTERN = re.compile(r'^\d{1,2}/\d{1,2}/\d{2}$')
+
+# rows (regions) parsed per csv chunk, bounds the parser's memory while the file grows a column a day
+CSV_CHUNK_ROWS = 512
+
+# getCovidDataFrame op_mode values
+OP_MODE_CSV = 0
+OP_MODE_DATAFRAME = 1
+OP_MODE_STORE = 2
+
+
+# all regions parsed once into a (regions x days) matrix of accumulated cases,
+# with daily cases (derived by the data quality pass, see data_quality) and indicators precomputed for every region.
+# the last len(groups) rows are aggregates (country totals, WHO regions, custom groups) summed from the
+# rows before them, they are charted like any other region.
+# a store is never modified after construction, refreshed data produces a new store.
+class CovidDataStore:
+    def __init__(self, regions: List[str], dates: Type[pd.DatetimeIndex], accu_cases: np.ndarray,
+                 daily_cases: np.ndarray = None, indicators: Dict[str, np.ndarray] = None, macd_state: MACDState = None,
+                 fingerprint: str = None, source_fingerprint: str = None, dataset: str = DEFAULT_DATASET,
+                 groups: RegionGroups = None, custom_groups: Dict[str, List[str]] = None, latest: LatestSnapshot = None,
+                 quality: DataQuality = None, quality_policy: QualityPolicy = None):
+        self.dataset = dataset
+        self.groups = RegionGroups([], []) if groups is None else groups
+        # user groups the aggregates were built with (name -> member regions), kept for rebuilds on refresh
+        self.custom_groups = _customGroups(custom_groups)
+        # rows before the aggregates
+        self.base_regions = len(regions) - len(self.groups)
+        self.regions = regions
+        self.dates = dates
+        self.accu_cases = accu_cases
+        # quality flags of every region and day, and the policy daily cases were derived with
+        if daily_cases is None:
+            daily_cases, quality = DataQuality.build(accu_cases, quality_policy)
+        elif quality is None:
+            _, quality = DataQuality.build(accu_cases, quality_policy)
+        self.daily_cases = daily_cases
+        self.quality = quality
+        self.fingerprint = _fingerprint(regions, dates, accu_cases, quality.policy) if fingerprint is None else fingerprint
+        # version of the source file this store was parsed from (see DataSource.fingerprint)
+        self.source_fingerprint = source_fingerprint
+        if indicators is None:
+            indicators, macd_state = calculateIndicators(self.daily_cases)
+        self.indicators = indicators
+        # EMA state of every region after the last day, lets appendDays continue MACD without replaying history
+        self.macd_state = macd_state
+        # latest-day values of every region for the screener, appendDays advances it with the new days only
+        self.latest = LatestSnapshot.build(regions, dates, self.base_regions, self.accu_cases, self.daily_cases, indicators) if latest is None else latest
+        # weekly/monthly means and LTTB picks of daily cases for coarse charts of long ranges
+        self.lod = LevelOfDetail(dates, self.daily_cases)
+        # region name -> row of accu_cases, first occurrence wins
+        self.region_index: Dict[str, int] = {}
+        for row, region in enumerate(regions):
+            self.region_index.setdefault(region, row)
+        # normalized names, aliases and search over the region names
+        self.region_search = RegionIndex(regions)
+        # (region, indicator, params) -> series, LRU bounded by INDICATOR_CACHE_ENTRIES
+        self._indicator_cache: "OrderedDict[Tuple, Dict[str, np.ndarray]]" = OrderedDict()
+        self._indicator_lock = threading.Lock()
+
+    # the stored name of a region given its exact name, normalized name or an alias ('Taiwan' for 'Taiwan*').
+    # raises KeyError for unknown regions
+    def resolveRegion(self, region: str) -> str:
+        if region in self.region_index:
+            return region
+        resolved = self.region_search.lookup(region)
+        if resolved is None:
+            raise KeyError(region)
+        return resolved
+
+    def _row(self, region: str) -> int:
+        row = self.region_index.get(region)
+        return self.region_index[self.resolveRegion(region)] if row is None else row
+
+    def getRegionRow(self, region: str) -> np.ndarray:
+        # a view into the matrix, nothing is copied
+        return self.accu_cases[self._row(region)]
+
+    # views of daily cases and every indicator row of one region, nothing is copied
+    def getRegionArrays(self, region: str) -> Dict[str, np.ndarray]:
+        row = self._row(region)
+        arrays = {'accu_cases': self.accu_cases[row], 'daily_cases': self.daily_cases[row]}
+        for name, values in self.indicators.items():
+            arrays[name] = values[row]
+        return arrays
+
+    # series of one indicator for one region, params as in INDICATOR_DEFAULTS (missing keys use the defaults).
+    # the precomputed MACD/RSI are returned as views, other parameter sets cost one pass over the region's
+    # daily cases and are memoized on this store, so they never outlive the data version they were computed on
+    def getIndicator(self, region: str, indicator: str, params: Dict = None) -> Dict[str, np.ndarray]:
+        region = self.resolveRegion(region)
+        return self.getIndicators([region], indicator, params)[region]
+
+    # getIndicator for several regions (resolved name -> series). the regions missing from the memo are
+    # computed together in one vectorized pass over their rows, so ten regions cost about as much as one
+    def getIndicators(self, regions: List[str], indicator: str, params: Dict = None) -> Dict[str, Dict[str, np.ndarray]]:
+        params = normalizeIndicatorParams(indicator, params)
+        regions = list(dict.fromkeys(self.resolveRegion(region) for region in regions))
+        if indicator in ('MACD', 'RSI') and params == normalizeIndicatorParams(indicator):
+            names = ['MACD', 'MACDs', 'MACDh'] if indicator == 'MACD' else [f'RSI_{length}' for length in RSI_LENGTHS]
+            return {region: {name: self.indicators[name][self.region_index[region]] for name in names} for region in regions}
+
+        found = {}
+        with self._indicator_lock:
+            for region in regions:
+                series = self._indicator_cache.get((region, indicator, params))
+                if series is not None:
+                    self._indicator_cache.move_to_end((region, indicator, params))
+                    found[region] = series
+        missing = [region for region in regions if region not in found]
+        if missing:
+            rows = [self.region_index[region] for region in missing]
+            batch = calculateIndicatorSeries(self.daily_cases[rows], indicator, params)
+            computed = {}
+            for position, region in enumerate(missing):
+                series = {name: values[position] for name, values in batch.items()}
+                for values in series.values():
+                    values.setflags(write=False)  # shared by every caller
+                computed[region] = series
+            with self._indicator_lock:
+                for region, series in computed.items():
+                    self._indicator_cache[(region, indicator, params)] = series
+                while len(self._indicator_cache) > INDICATOR_CACHE_ENTRIES:
+                    self._indicator_cache.popitem(last=False)
+            found.update(computed)
+        return {region: found[region] for region in regions}
+
+    # indicator_params maps indicator names to params (see getIndicator), MACD and RSI are always included
+    def getRegionFrame(self, region: str, indicator_params: Dict[str, Dict] = None) -> Type[pd.DataFrame]:
+        row = self._row(region)
+        columns = {'date': self.dates, 'accu_cases': self.accu_cases[row], 'daily_cases': self.daily_cases[row]}
+        indicator_params = dict({'MACD': None, 'RSI': None}, **(indicator_params or {}))
+        for indicator, params in indicator_params.items():
+            columns.update(self.getIndicator(region, indicator, params))
+        return pd.DataFrame(columns, index=pd.RangeIndex(1, len(self.dates)+1))
+
+    # new store with extra days appended. only the new days are computed: aggregates sum the new days of
+    # their members, daily cases continue from the last days of the quality pass, MACD from the stored EMA state,
+    # RSI from the last window of daily cases and the screener snapshot from its last MACD flips. rows whose
+    # known daily cases the quality pass revised (a correction on a new day reaching back) are recomputed in full.
+    # new_accu_cases holds the base regions or all rows.
+    def appendDays(self, new_dates: Type[pd.DatetimeIndex], new_accu_cases: np.ndarray, source_fingerprint: str = None) -> 'CovidDataStore':
+        new_days = len(new_dates)
+        if len(new_accu_cases) == self.base_regions:
+            new_accu_cases = _withAggregates(new_accu_cases, self.groups)
+        accu_cases = np.concatenate((self.accu_cases, new_accu_cases), axis=1)
+        daily_cases, quality, revised = self.quality.append(accu_cases, self.daily_cases)
+        daily_tail = daily_cases[:, -new_days:]
+        # continue from a copy, this store stays usable if anything below fails
+        indicators_tail, macd_state = calculateIndicators(daily_tail, MACDState.from_dict(self.macd_state.to_dict()))
+        for rsi_length in RSI_LENGTHS:
+            # the RSI window also needs the rsi_length days before the new ones
+            window = daily_cases[:, -(new_days + rsi_length + 1):]
+            indicators_tail[f'RSI_{rsi_length}'] = np.nan_to_num(calculate_rsi_batch(window, rsi_length=rsi_length), nan=50)[:, -new_days:]
+        indicators = {name: np.concatenate((values, indicators_tail[name]), axis=1) for name, values in self.indicators.items()}
+        dates = self.dates.append(new_dates)
+        latest = self.latest.append(dates, accu_cases, daily_cases, indicators, new_days)
+        if len(revised):
+            revised_indicators, revised_state = calculateIndicators(daily_cases[revised])
+            for name, values in indicators.items():
+                values[revised] = revised_indicators[name]
+            for ema in ('ema_long', 'ema_short', 'ema_signal'):
+                getattr(macd_state, ema).last[revised] = getattr(revised_state, ema).last
+            latest = latest.with_rows(revised, LatestSnapshot.build([self.regions[row] for row in revised], dates, len(revised),
+                                                                    accu_cases[revised], daily_cases[revised], revised_indicators))
+        return CovidDataStore(self.regions, dates, accu_cases, daily_cases, indicators, macd_state,
+                              source_fingerprint=source_fingerprint, dataset=self.dataset, groups=self.groups,
+                              custom_groups=self.custom_groups, latest=latest, quality=quality)
+
+
+# daily cases for accumulated cases (one region or a regions x days matrix): first day is 0, negative corrections,
+# reporting gaps and dumps are handled by quality_policy (the default QualityPolicy when None, see data_quality)
+def calculateDailyCases(accu_cases: np.ndarray, quality_policy: QualityPolicy = None) -> np.ndarray:
+    return clean_daily_cases(accu_cases, quality_policy)[0]
+
+
+# MACD, RSI_6 and RSI_12 for every region in one pass along the time axis.
+# with macd_state from a previous call MACD continues from it (the state is updated in place and returned).
+def calculateIndicators(daily_cases: np.ndarray, macd_state: MACDState = None) -> Tuple[Dict[str, np.ndarray], MACDState]:
+    if macd_state is None:
+        macd_state = MACDState(*MACD_PERIODS)
+    MACD_line, MACD_Signal_line, MACD_Histogram = macd_state.update_batch(daily_cases)
+    indicators = {'MACD': MACD_line, 'MACDs': MACD_Signal_line, 'MACDh': MACD_Histogram}
+    for rsi_length in RSI_LENGTHS:
+        # replace NaN with 50 like the single region path
+        indicators[f'RSI_{rsi_length}'] = np.nan_to_num(calculate_rsi_batch(daily_cases, rsi_length=rsi_length), nan=50)
+    return indicators, macd_state
+
+
+# canonical, hashable form of indicator parameters with the defaults filled in. raises ValueError for
+# unknown indicators or keys, and periods that are not whole numbers in 1..MAX_INDICATOR_PERIOD
+def normalizeIndicatorParams(indicator: str, params: Dict = None) -> Tuple:
+    if indicator not in INDICATOR_DEFAULTS:
+        raise ValueError(f"unknown indicator '{indicator}', expected one of {', '.join(INDICATOR_DEFAULTS)}")
+    params = dict(params or ())
+    unknown = params.keys() - INDICATOR_DEFAULTS[indicator].keys()
+    if unknown:
+        raise ValueError(f"unknown {indicator} parameters: {', '.join(sorted(map(str, unknown)))}")
+    params = dict(INDICATOR_DEFAULTS[indicator], **params)
+
+    periods = tuple(params['periods'])
+    if indicator == 'MACD':
+        if len(periods) != 3:
+            raise ValueError('MACD needs three periods: long, short, signal')
+    else:
+        periods = tuple(dict.fromkeys(periods))  # drop repeats, keep the order
+    if not 1 <= len(periods) <= MAX_INDICATOR_SERIES:
+        raise ValueError(f'{indicator} takes 1 to {MAX_INDICATOR_SERIES} periods')
+    for period in periods:
+        if isinstance(period, bool) or not isinstance(period, (int, np.integer)) or not 1 <= period <= MAX_INDICATOR_PERIOD:
+            raise ValueError(f'{indicator} periods must be whole numbers from 1 to {MAX_INDICATOR_PERIOD}, got {period!r}')
+    params['periods'] = tuple(int(period) for period in periods)
+    if params.get('smoothing', 'sma') not in ('sma', 'wilder'):
+        raise ValueError(f"unknown RSI smoothing '{params['smoothing']}', expected 'sma' or 'wilder'")
+    return tuple(sorted(params.items()))
+
+
+# one indicator along the last axis of daily_cases (one region or a regions x days matrix),
+# series named SMA_<period>, EMA_<period>, MACD/MACDs/MACDh or RSI_<period>
+def calculateIndicatorSeries(daily_cases: np.ndarray, indicator: str, params: Dict = None) -> Dict[str, np.ndarray]:
+    params = dict(normalizeIndicatorParams(indicator, params))
+    periods = params['periods']
+    if indicator == 'SMA':
+        return {f'SMA_{period}': calculate_sma_batch(daily_cases, period) for period in periods}
+    if indicator == 'EMA':
+        # pandas' default adjusted weighting, like the original EMA chart
+        return {f'EMA_{period}': calculate_ema_batch(daily_cases, period, adjust=True) for period in periods}
+    if indicator == 'MACD':
+        return dict(zip(('MACD', 'MACDs', 'MACDh'), calculate_macd_batch(daily_cases, *periods)))
+    return {f'RSI_{period}': np.nan_to_num(calculate_rsi_batch(daily_cases, rsi_length=period, smoothing=params['smoothing']), nan=50)
+            for period in periods}
+
+
+# identifies one version of the dataset, changes whenever a region, a date, a count or the quality policy changes
+def _fingerprint(regions: List[str], dates: Type[pd.DatetimeIndex], accu_cases: np.ndarray, quality_policy: QualityPolicy = None) -> str:
+    digest = hashlib.sha1()
+    if quality_policy is not None:
+        digest.update(json.dumps(quality_policy.to_dict(), sort_keys=True).encode('utf-8'))
+    digest.update('\n'.join(regions).encode('utf-8'))
+    digest.update(dates.asi8.tobytes())
+    digest.update(np.ascontiguousarray(accu_cases).tobytes())
+    return digest.hexdigest()
+
+
+# merge Country/Region and Province/State.  ref:https://stackoverflow.com/questions/56771162/concatenating-two-columns-in-pandas-dataframe-without-adding-extra-spaces-at-the
+def _mergeRegionNames(df: Type[pd.DataFrame], region_columns: List[str] = None) -> np.ndarray:
+    region_columns = region_columns or DATASETS[DEFAULT_DATASET]['region_columns']
+    names = df[region_columns[0]]
+    for column in region_columns[1:]:
+        names = np.where(df[column].isnull(), names, names + ' ' + df[column])
+    return np.asarray(names)
+
+
+def _dateColumns(columns: List[str]) -> List[str]:
+    return [c for c in columns if DATE_COLUMN_PATTERN.match(str(c))]
+
+
+# accumulated counts as int32. missing counts repeat the previous day's count (0 before the first one)
+def _caseMatrix(df: Type[pd.DataFrame], date_columns: List[str]) -> np.ndarray:
+    return _fillCounts(df[date_columns].to_numpy(dtype=np.float64))
+
+
+# float counts (regions x days, or one region) as int32 with missing counts filled like _caseMatrix
+def _fillCounts(counts: np.ndarray) -> np.ndarray:
+    if np.isnan(counts).any():
+        counts = pd.DataFrame(np.atleast_2d(counts)).ffill(axis=1).fillna(0).to_numpy().reshape(counts.shape)
+    return counts.astype(np.int32)
+
+
+# key columns of the dataset's aggregates (see DATASETS)
+def _groupColumns(dataset: str) -> List[str]:
+    config = DATASETS[dataset]
+    columns = [column for key_columns in config.get('group_totals', ()) for column in key_columns]
+    if config.get('who_column'):
+        columns.append(config['who_column'])
+    return list(dict.fromkeys(columns))
+
+
+# column -> value per region as strings, '' where missing
+def _groupKeys(df: Type[pd.DataFrame], columns: List[str]) -> Dict[str, List[str]]:
+    return {column: df[column].fillna('').astype(str).tolist() for column in columns}
+
+
+# regions, dates, the accumulated cases matrix and the aggregate key columns of the raw JHU wide table
+def _parseWideTable(raw_dataframe: Type[pd.DataFrame], dataset: str = DEFAULT_DATASET) -> Tuple[List[str], Type[pd.DatetimeIndex], np.ndarray, Dict[str, List[str]]]:
+    date_columns = _dateColumns(raw_dataframe.columns)
+    regions = [str(r) for r in _mergeRegionNames(raw_dataframe, DATASETS[dataset]['region_columns'])]
+    dates = pd.to_datetime(pd.Index(date_columns), format="%m/%d/%y")
+    accu_cases = np.ascontiguousarray(_caseMatrix(raw_dataframe, date_columns))
+    group_keys = _groupKeys(raw_dataframe, [c for c in _groupColumns(dataset) if c in raw_dataframe.columns])
+    return regions, dates, accu_cases, group_keys
+
+
+# same as _parseWideTable but straight from the csv: only region and date columns are parsed, the header
+# dates are parsed once and rows are read CSV_CHUNK_ROWS at a time into int32 blocks, so no full
+# object/float64 copy of the table is ever held in memory.
+def _readWideCsv(data_source: DataSource, dataset: str = DEFAULT_DATASET, chunksize: int = CSV_CHUNK_ROWS) -> Tuple[List[str], Type[pd.DatetimeIndex], np.ndarray, Dict[str, List[str]]]:
+    region_columns = DATASETS[dataset]['region_columns']
+    header = data_source.read_header()
+    date_columns = _dateColumns(header)
+    group_columns = [c for c in _groupColumns(dataset) if c in header]
+    dates = pd.to_datetime(pd.Index(date_columns), format="%m/%d/%y")
+    regions = []
+    blocks = []
+    group_keys = {column: [] for column in group_columns}
+    usecols = list(dict.fromkeys(region_columns + group_columns)) + date_columns
+    for chunk in data_source.read_chunks(chunksize, usecols=usecols):
+        regions.extend(str(r) for r in _mergeRegionNames(chunk, region_columns))
+        blocks.append(_caseMatrix(chunk, date_columns))
+        for column, values in _groupKeys(chunk, group_columns).items():
+            group_keys[column].extend(values)
+    accu_cases = np.concatenate(blocks) if blocks else np.zeros((0, len(dates)), dtype=np.int32)
+    return regions, dates, accu_cases, group_keys
+
+
+# custom groups in a canonical form (lists of names), so stores and snapshots compare equal
+def _customGroups(custom_groups: Dict[str, List[str]] = None) -> Dict[str, List[str]]:
+    return {str(name): [str(member) for member in members] for name, members in (custom_groups or {}).items()}
+
+
+# accumulated cases with the aggregate rows of groups appended. sums stay int32 unless they would overflow
+def _withAggregates(accu_cases: np.ndarray, groups: RegionGroups) -> np.ndarray:
+    if len(groups) == 0:
+        return accu_cases
+    sums = groups.sum(accu_cases)
+    dtype = accu_cases.dtype
+    if np.issubdtype(dtype, np.integer) and sums.size and sums.max() > np.iinfo(dtype).max:
+        dtype = sums.dtype
+    return np.concatenate((accu_cases, sums.astype(dtype)))
+
+
+# store from parsed regions with the dataset's aggregates added
+def _storeWithGroups(regions: List[str], dates: Type[pd.DatetimeIndex], accu_cases: np.ndarray, group_keys: Dict[str, List[str]],
+                     source_fingerprint: str, dataset: str, custom_groups: Dict[str, List[str]] = None, quality_policy: QualityPolicy = None) -> CovidDataStore:
+    groups = _datasetGroups(regions, group_keys, dataset, custom_groups)
+    return CovidDataStore(regions + groups.names, dates, _withAggregates(accu_cases, groups), source_fingerprint=source_fingerprint,
+                          dataset=dataset, groups=groups, custom_groups=custom_groups, quality_policy=quality_policy)
+
+
+def _datasetGroups(regions: List[str], group_keys: Dict[str, List[str]], dataset: str, custom_groups: Dict[str, List[str]] = None) -> RegionGroups:
+    config = DATASETS[dataset]
+    # a missing key column groups nothing
+    group_keys = dict({column: [''] * len(regions) for column in _groupColumns(dataset)}, **group_keys)
+    return build_region_groups(regions, group_keys, config.get('group_totals', ()), config.get('who_column'), custom_groups)
+
+
+# build the all-regions store from the raw JHU wide table (read-only, the input is not modified)
+# or straight from a DataSource with the chunked reader
+# custom_groups: extra aggregates, group name -> member regions (see region_groups.build_region_groups)
+# quality_policy: how daily cases are derived (see data_quality), refreshes keep the store's policy
+def buildCovidDataStore(raw_dataframe: Union[Type[pd.DataFrame], DataSource], source_fingerprint: str = None, dataset: str = DEFAULT_DATASET,
+                        custom_groups: Dict[str, List[str]] = None, quality_policy: QualityPolicy = None) -> CovidDataStore:
+    if isinstance(raw_dataframe, DataSource):
+        parsed = _readWideCsv(raw_dataframe, dataset)
+        return _storeWithGroups(*parsed, raw_dataframe.loaded_fingerprint(source_fingerprint), dataset, custom_groups, quality_policy)
+    return _storeWithGroups(*_parseWideTable(raw_dataframe, dataset), source_fingerprint, dataset, custom_groups, quality_policy)
+
+
+# store for a re-downloaded JHU table (a DataFrame or a DataSource). when the new table only adds days
+# to the end of the old one (same regions, known days unchanged) just those days are appended,
+# otherwise everything is rebuilt.
+def updateCovidDataStore(data_store: CovidDataStore, raw_dataframe: Union[Type[pd.DataFrame], DataSource], source_fingerprint: str = None) -> CovidDataStore:
+    if isinstance(raw_dataframe, DataSource):
+        regions, dates, accu_cases, group_keys = _readWideCsv(raw_dataframe, data_store.dataset)
+        source_fingerprint = raw_dataframe.loaded_fingerprint(source_fingerprint)
+    else:
+        regions, dates, accu_cases, group_keys = _parseWideTable(raw_dataframe, data_store.dataset)
+    groups = _datasetGroups(regions, group_keys, data_store.dataset, data_store.custom_groups)
+    known_days = len(data_store.dates)
+    base_regions = data_store.base_regions
+    max_rsi_length = max(RSI_LENGTHS)
+    if (regions == data_store.regions[:base_regions] and groups == data_store.groups
+            and len(dates) >= known_days and known_days > max_rsi_length
+            and dates[:known_days].equals(data_store.dates)
+            and np.array_equal(accu_cases[:, :known_days], data_store.accu_cases[:base_regions], equal_nan=True)):
+        if len(dates) == known_days:
+            return data_store
+        return data_store.appendDays(dates[known_days:], accu_cases[:, known_days:], source_fingerprint)
+    return CovidDataStore(regions + groups.names, dates, _withAggregates(accu_cases, groups), source_fingerprint=source_fingerprint,
+                          dataset=data_store.dataset, groups=groups, custom_groups=data_store.custom_groups,
+                          quality_policy=data_store.quality.policy)
+
+
+# write the store as .npy matrices plus a json index so it can be memory-mapped on the next start.
+# every snapshot goes into a new generation directory and SNAPSHOT_POINTER is renamed over to name it once
+# all files are written, so a reader only ever maps the files of one complete generation, even while
+# other workers save theirs. older generations are pruned, memory-mapped files stay valid after removal.
+def saveCovidDataSnapshot(data_store: CovidDataStore, snapshot_dir: str):
+    os.makedirs(snapshot_dir, exist_ok=True)
+    generation_dir = tempfile.mkdtemp(dir=snapshot_dir, prefix='generation-')
+    try:
+        arrays = {'accu_cases': data_store.accu_cases, 'daily_cases': data_store.daily_cases, 'quality_flags': data_store.quality.flags}
+        arrays.update(data_store.indicators)
+        for name, values in arrays.items():
+            np.save(os.path.join(generation_dir, f'{name}.npy'), np.ascontiguousarray(values))
+        meta = {
+            'format': SNAPSHOT_FORMAT,
+            'dataset': data_store.dataset,
+            'fingerprint': data_store.fingerprint,
+            'source_fingerprint': data_store.source_fingerprint,
+            'regions': data_store.regions,
+            'dates': [d.strftime('%Y-%m-%d') for d in data_store.dates],
+            'indicators': list(data_store.indicators),
+            'macd_state': data_store.macd_state.to_dict(),
+            'groups': data_store.groups.to_dict(),
+            'custom_groups': data_store.custom_groups,
+            'quality': data_store.quality.state_dict(),
+        }
+        with open(os.path.join(generation_dir, 'meta.json'), 'wb') as f:
+            f.write(json.dumps(meta).encode('utf-8'))
+    except BaseException:
+        shutil.rmtree(generation_dir, ignore_errors=True)
+        raise
+    _replaceFile(snapshot_dir, SNAPSHOT_POINTER, lambda f: f.write(os.path.basename(generation_dir).encode('utf-8')))
+    _pruneSnapshotGenerations(snapshot_dir)
+
+
+# generation directory SNAPSHOT_POINTER names, None when there is none yet
+def _currentSnapshotGeneration(snapshot_dir: str) -> Optional[str]:
+    try:
+        with open(os.path.join(snapshot_dir, SNAPSHOT_POINTER), 'r', encoding='utf-8') as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+
+# remove generations but the current one and the SNAPSHOT_KEEP_GENERATIONS newest others. a generation another
+# worker is still writing is among the newest, its files get written last
+def _pruneSnapshotGenerations(snapshot_dir: str):
+    current = _currentSnapshotGeneration(snapshot_dir)
+    try:
+        generations = [e for e in os.scandir(snapshot_dir) if e.is_dir() and e.name.startswith('generation-') and e.name != current]
+        generations.sort(key=lambda e: e.stat().st_mtime_ns, reverse=True)
+    except OSError:
+        return
+    for entry in generations[SNAPSHOT_KEEP_GENERATIONS:]:
+        shutil.rmtree(entry.path, ignore_errors=True)
+
+
+# memory-map a snapshot written by saveCovidDataSnapshot. the matrices are read-only and the
+# pages are shared by every process mapping the same files. None when there is no usable snapshot.
+def loadCovidDataSnapshot(snapshot_dir: str) -> Optional[CovidDataStore]:
+    generation = _currentSnapshotGeneration(snapshot_dir)
+    if generation is None:
+        return None
+    generation_dir = os.path.join(snapshot_dir, generation)
+    try:
+        with open(os.path.join(generation_dir, 'meta.json'), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        if meta.get('format') != SNAPSHOT_FORMAT:
+            return None
+        arrays = {name: np.load(os.path.join(generation_dir, f'{name}.npy'), mmap_mode='r')
+                  for name in ['accu_cases', 'daily_cases', 'quality_flags'] + meta['indicators']}
+    except (OSError, ValueError, KeyError):
+        return None
+    dates = pd.DatetimeIndex(pd.to_datetime(meta['dates'], format='%Y-%m-%d'))
+    if any(values.shape != (len(meta['regions']), len(dates)) for values in arrays.values()):
+        return None
+    indicators = {name: arrays[name] for name in meta['indicators']}
+    return CovidDataStore(meta['regions'], dates, arrays['accu_cases'], arrays['daily_cases'], indicators,
+                          MACDState.from_dict(meta['macd_state']), meta['fingerprint'], meta['source_fingerprint'], meta['dataset'],
+                          RegionGroups.from_dict(meta['groups']), meta['custom_groups'],
+                          quality=DataQuality.from_state(meta['quality'], arrays['quality_flags']))
+
+
+# store for data_src, memory-mapped from snapshot_dir when the snapshot was made from the current
+# version of the source with the same custom groups and quality policy, otherwise parsed from csv and written back
+# as a new snapshot. when the source cannot be reached at all an existing snapshot is used as is.
+# revalidate=False skips the source check (a HEAD request for URLs) whenever a snapshot with the same groups and
+# policy exists, for callers that check the source later themselves, e.g. with a DataRefresher
+def loadCovidDataStore(data_src: Union[str, DataSource], snapshot_dir: str = None, dataset: str = DEFAULT_DATASET,
+                       custom_groups: Dict[str, List[str]] = None, quality_policy: QualityPolicy = None,
+                       revalidate: bool = True) -> CovidDataStore:
+    if isinstance(data_src, str):
+        data_src = open_data_source(data_src)
+    snapshot = loadCovidDataSnapshot(snapshot_dir) if snapshot_dir is not None else None
+    if snapshot is not None and snapshot.dataset != dataset:
+        snapshot = None
+    same_settings = (snapshot is not None and snapshot.custom_groups == _customGroups(custom_groups)
+                     and snapshot.quality.policy == (quality_policy or QualityPolicy()))
+    if same_settings and not revalidate:
+        return snapshot
+    try:
+        source_fingerprint = data_src.fingerprint()
+    except Exception:
+        if snapshot is None:
+            raise
+        return snapshot
+    if same_settings and source_fingerprint is not None and snapshot.source_fingerprint == source_fingerprint:
+        return snapshot
+    data_store = buildCovidDataStore(data_src, source_fingerprint, dataset, custom_groups, quality_policy)
+    if snapshot_dir is not None:
+        return shareCovidDataStore(data_store, snapshot_dir)
+    return data_store
+
+
+# data_store memory-mapped from the current snapshot in snapshot_dir, so every worker serves the same pages
+# instead of a private copy. the snapshot is written first unless another worker already saved the same data;
+# a lock file lets only one worker at a time save. data_store itself when the snapshot cannot be read back
+def shareCovidDataStore(data_store: CovidDataStore, snapshot_dir: str) -> CovidDataStore:
+    def saved(snapshot):
+        return (snapshot is not None and snapshot.fingerprint == data_store.fingerprint
+                and snapshot.source_fingerprint == data_store.source_fingerprint)
+    with _snapshotLock(snapshot_dir):
+        snapshot = loadCovidDataSnapshot(snapshot_dir)
+        if not saved(snapshot):
+            saveCovidDataSnapshot(data_store, snapshot_dir)
+            snapshot = loadCovidDataSnapshot(snapshot_dir)
+    return snapshot if saved(snapshot) else data_store
+
+
+# exclusive lock on snapshot_dir between processes, a no-op where fcntl is missing
+@contextmanager
+def _snapshotLock(snapshot_dir: str):
+    os.makedirs(snapshot_dir, exist_ok=True)
+    if fcntl is None:
+        yield
+        return
+    with open(os.path.join(snapshot_dir, 'LOCK'), 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+# write a file through a temp file in the same directory and rename it over the target
+def _replaceFile(directory: str, name: str, write):
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            write(f)
+        os.replace(tmp_path, os.path.join(directory, name))
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+# daily cases and indicators for one region added to a frame holding its accu_cases, shared by every op_mode
+def _addIndicators(df: Type[pd.DataFrame], indicator_params: Dict[str, Dict] = None, quality_policy: QualityPolicy = None) -> Type[pd.DataFrame]:
+    # same derivation as the store, see data_quality
+    df['daily_cases'] = calculateDailyCases(df['accu_cases'].to_numpy(), quality_policy)
+
+    indicator_params = indicator_params or {}
 
     # insert MACD data to dataframe
-    MACD_line, MACD_Signal_line, MACD_Histogram = calculate_macd(df_tw_transpose, 'daily_cases', 26, 12, 9)
-    df_tw_transpose['MACD'] = MACD_line
-    df_tw_transpose['MACDs'] = MACD_Signal_line
-    df_tw_transpose['MACDh'] = MACD_Histogram
+    macd_params = dict(normalizeIndicatorParams('MACD', indicator_params.get('MACD')))
+    MACD_line, MACD_Signal_line, MACD_Histogram = calculate_macd(df, 'daily_cases', *macd_params['periods'])
+    df['MACD'] = MACD_line
+    df['MACDs'] = MACD_Signal_line
+    df['MACDh'] = MACD_Histogram
 
     # insert RSI data to data frame
-    rsi_series_6, _ = calculate_rsi(df_tw_transpose, rsi_length=6)
-    rsi_series_12, _ = calculate_rsi(df_tw_transpose, rsi_length=12)
-    df_tw_transpose['RSI_6'] = rsi_series_6
-    df_tw_transpose['RSI_12'] = rsi_series_12
+    rsi_params = dict(normalizeIndicatorParams('RSI', indicator_params.get('RSI')))
+    for rsi_length in rsi_params['periods']:
+        rsi_series, _ = calculate_rsi(df, rsi_length=rsi_length, smoothing=rsi_params['smoothing'])
+        # replace NaN with 50.  ref: https://stackoverflow.com/questions/26837998/pandas-replace-nan-with-blank-empty-string
+        df[f'RSI_{rsi_length}'] = rsi_series
+        df[f'RSI_{rsi_length}'] = df[f'RSI_{rsi_length}'].fillna(50)
+
+    # moving averages only when asked for
+    for indicator in ('SMA', 'EMA'):
+        if indicator in indicator_params:
+            daily_cases = df['daily_cases'].to_numpy(dtype=np.float64)
+            for name, values in calculateIndicatorSeries(daily_cases, indicator, indicator_params[indicator]).items():
+                df[name] = values
+    return df
+
+
+# position of the first row of a raw wide table whose merged region name is region, KeyError when there is none
+def _findRegionRow(raw_dataframe: Type[pd.DataFrame], region: str, region_columns: List[str]) -> int:
+    first = raw_dataframe[region_columns[0]].to_numpy()
+    if len(region_columns) == 1:
+        rows = np.flatnonzero(first == region)
+    else:
+        # only rows whose first column starts the name can match, the others are never merged
+        rows = np.flatnonzero([isinstance(name, str) and region.startswith(name) for name in first])
+        rows = rows[_mergeRegionNames(raw_dataframe[region_columns].iloc[rows], region_columns) == region]
+    if not len(rows):
+        raise KeyError(region)
+    return int(rows[0])
+
+
+# date, accu_cases and daily_cases of one region of a raw wide table with its indicators. the input is only
+# read (it may be shared, read-only or memory-mapped): the region's date cells are taken before anything
+# else and the frame is built once from typed columns, with the same dtypes and index as getRegionFrame
+def _regionFrame(raw_dataframe: Type[pd.DataFrame], region: str, dataset: str = DEFAULT_DATASET,
+                 indicator_params: Dict[str, Dict] = None, quality_policy: QualityPolicy = None) -> Type[pd.DataFrame]:
+    row = _findRegionRow(raw_dataframe, region, DATASETS[dataset]['region_columns'])
+    date_columns = _dateColumns(raw_dataframe.columns)
+    # the whole row first: selecting columns of a row costs one take per column block, and csv frames hold a block per column
+    counts = raw_dataframe.iloc[row].to_numpy()[raw_dataframe.columns.get_indexer(date_columns)].astype(np.float64)
+    df = pd.DataFrame({'date': pd.to_datetime(pd.Index(date_columns), format="%m/%d/%y"), 'accu_cases': _fillCounts(counts)},
+                      index=pd.RangeIndex(1, len(date_columns)+1))
+    return _addIndicators(df, indicator_params, quality_policy)
+
+
+# op_mode: OP_MODE_CSV = read csv from DATA_FILE_PATH (a path, URL or DataSource),
+#          OP_MODE_DATAFRAME = use raw_dataframe (never modified, no copy needed),
+#          OP_MODE_STORE = slice precomputed rows from data_store
+# dataset: layout of the raw table in the csv and dataframe modes (see DATASETS), region names are merged from its region_columns
+# indicator_params: {'MACD': {'periods': (26, 12, 9)}, 'RSI': {'periods': (6, 12), 'smoothing': 'sma'},
+#                    'SMA': {'periods': (7, 30)}, 'EMA': {...}}, see INDICATOR_DEFAULTS.
+#                    MACD and RSI columns are always added, SMA_<n>/EMA_<n> columns only when given
+# quality_policy: how daily cases are derived in the csv and dataframe modes (see data_quality), stores keep their own
+# raises KeyError for unknown regions
+def getCovidDataFrame(DATA_FILE_PATH: Union[str, DataSource] = None, raw_dataframe: Type[pd.DataFrame] = None, country: str = 'Taiwan*', op_mode: int = OP_MODE_CSV, data_store: CovidDataStore = None,
+                      indicator_params: Dict[str, Dict] = None, dataset: str = DEFAULT_DATASET, quality_policy: QualityPolicy = None) -> Type[pd.DataFrame]:
+    if op_mode == OP_MODE_STORE:
+        with span('handler.store_slice'):
+            return data_store.getRegionFrame(country, indicator_params)
 
-    # replace NaN with 50.  ref: https://stackoverflow.com/questions/26837998/pandas-replace-nan-with-blank-empty-string
-    df_tw_transpose.RSI_6.fillna(50,inplace=True)
-    df_tw_transpose.RSI_12.fillna(50,inplace=True)
+    with span('handler.load'):
+        if op_mode == OP_MODE_CSV:
+            if isinstance(DATA_FILE_PATH, str):
+                DATA_FILE_PATH = open_data_source(DATA_FILE_PATH)
+            df = DATA_FILE_PATH.read_frame()
+        elif op_mode == OP_MODE_DATAFRAME:
+            df = raw_dataframe
 
-    # transfer date format.  ref:https://www.delftstack.com/zh-tw/howto/python-pandas/how-to-convert-dataframe-column-to-datetime-in-pandas/
-    df_tw_transpose['date'] = pd.to_datetime(df_tw_transpose['date'], format="%m/%d/%y")
+    with span('handler.indicators'):
+        return _regionFrame(df, country, dataset, indicator_params, quality_policy)
 
-    return df_tw_transpose
 
-def getCountryList(df: Type[pd.DataFrame]):
-    # get country list
-    # merge Country/Region and Province/State.  ref:https://stackoverflow.com/questions/56771162/concatenating-two-columns-in-pandas-dataframe-without-adding-extra-spaces-at-the
-    df['Country/Region'] = np.where(df['Province/State'].isnull(), df['Country/Region'], df['Country/Region'] + ' ' + df['Province/State'])
-    temp_df = pd.Series(df['Country/Region'])
-    return temp_df.to_list()
+# merged region names of a raw wide table in row order, the table is not modified
+def getCountryList(df: Type[pd.DataFrame], dataset: str = DEFAULT_DATASET) -> List[str]:
+    return _mergeRegionNames(df, DATASETS[dataset]['region_columns']).tolist()
 
 
 # test function
@@ -76,7 +714,9 @@ if __name__ == '__main__':
     DATA_FILE_PATH = 'time_series_covid19_confirmed_global.csv'
     # DATA_FILE_PATH = 'https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/csse_covid_19_data/csse_covid_19_time_series/time_series_covid19_confirmed_global.csv'
     df = pd.read_csv(DATA_FILE_PATH, sep=',')
-    df_new = getCovidDataFrame(raw_dataframe=df.copy(deep=True), op_mode=1)
+    df_new = getCovidDataFrame(raw_dataframe=df, op_mode=OP_MODE_DATAFRAME)
     my_list = getCountryList(df)
+    data_store = buildCovidDataStore(pd.read_csv(DATA_FILE_PATH, sep=','))
+    df_store = getCovidDataFrame(country='Taiwan*', op_mode=OP_MODE_STORE, data_store=data_store)
     # df.to_csv('tw_case.csv', index=False)
     # print(df)
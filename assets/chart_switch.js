@@ -0,0 +1,238 @@
+// Client side chart switching. The server sends one payload per region (figure_builder.build_region_payload_json)
+// and the static chart config (figure_builder.chart_config); the charts are drawn here without a server round trip.
+// The traces match figure_builder.chart_traces, resolutions and zoomed windows match figure_builder.lod_traces.
+(function () {
+    function round(value, decimals) {
+        var scale = Math.pow(10, decimals);
+        return Math.round(value * scale) / scale;
+    }
+
+    // pandas rolling(window).mean(), null until the window is full
+    function rollingMean(values, window, decimals) {
+        var result = new Array(values.length);
+        var sum = 0;
+        for (var i = 0; i < values.length; i++) {
+            sum += values[i];
+            if (i >= window) {
+                sum -= values[i - window];
+            }
+            result[i] = i >= window - 1 ? round(sum / window, decimals) : null;
+        }
+        return result;
+    }
+
+    // pandas ewm(span=span).mean() with adjust=True
+    function ewmMean(values, span, decimals) {
+        var decay = 1 - 2 / (span + 1);
+        var result = new Array(values.length);
+        var numerator = 0;
+        var denominator = 0;
+        for (var i = 0; i < values.length; i++) {
+            numerator = values[i] + decay * numerator;
+            denominator = 1 + decay * denominator;
+            result[i] = round(numerator / denominator, decimals);
+        }
+        return result;
+    }
+
+    function chartTraces(payload, chart, config) {
+        var daily = payload.daily_cases;
+        switch (chart) {
+            case "Line":
+                return [{y: daily, fill: "tozeroy", name: "daily_cases"}];
+            case "SMA":
+                return payload.params.SMA.periods.map(function (period) {
+                    return {y: rollingMean(daily, period, config.decimals), name: period + " Days"};
+                });
+            case "EMA":
+                return payload.params.EMA.periods.map(function (period) {
+                    return {y: ewmMean(daily, period, config.decimals), name: period + " Days"};
+                });
+            case "MACD":
+                return [
+                    {y: payload.MACD, name: "MACD"},
+                    {y: payload.MACDs, name: "Signal"},
+                    {y: payload.MACDh, line: {color: "royalblue", width: 2, dash: "dot"}, name: "Hitogram"}
+                ];
+            case "RSI":
+                return payload.params.RSI.periods.map(function (period) {
+                    return {y: payload["RSI_" + period], name: "RSI " + period + " Day"};
+                });
+        }
+        return [];
+    }
+
+    // lod.lttb_indices for one series: indices of the points kept, first and last day included
+    function lttbIndices(values, points) {
+        var days = values.length;
+        var i;
+        if (points >= days || points < 3) {
+            var all = new Array(days);
+            for (i = 0; i < days; i++) {
+                all[i] = i;
+            }
+            return all;
+        }
+        var y = values.map(function (value) { return value === null ? 0 : value; });
+        var every = (days - 2) / (points - 2);
+        var starts = new Array(points - 1);
+        for (i = 0; i < points - 1; i++) {
+            starts[i] = Math.floor(i * every) + 1;
+        }
+        starts[points - 2] = days - 1;
+        var selected = [0];
+        var previous = 0;
+        for (var bucket = 0; bucket < points - 2; bucket++) {
+            // mean of the next bucket, the last day for the last one
+            var nextStart = starts[bucket + 1];
+            var nextStop = bucket + 2 < points - 1 ? starts[bucket + 2] : days;
+            var nextX = (nextStart + nextStop - 1) / 2;
+            var sum = 0;
+            for (i = nextStart; i < nextStop; i++) {
+                sum += y[i];
+            }
+            var nextY = sum / (nextStop - nextStart);
+            var previousY = y[previous];
+            var best = -1;
+            var pick = starts[bucket];
+            for (var day = starts[bucket]; day < starts[bucket + 1]; day++) {
+                var area = Math.abs((previous - nextX) * (y[day] - previousY) - (previous - day) * (nextY - previousY));
+                if (area > best) {
+                    best = area;
+                    pick = day;
+                }
+            }
+            selected.push(pick);
+            previous = pick;
+        }
+        selected.push(days - 1);
+        return selected;
+    }
+
+    // lod.bucket_means for one series, nulls are left out
+    function bucketMeans(values, starts, decimals) {
+        return starts.map(function (start, bucket) {
+            var stop = bucket + 1 < starts.length ? starts[bucket + 1] : values.length;
+            var sum = 0;
+            var count = 0;
+            for (var i = start; i < stop; i++) {
+                if (values[i] !== null) {
+                    sum += values[i];
+                    count++;
+                }
+            }
+            return count ? round(sum / count, decimals) : null;
+        });
+    }
+
+    // plotly's naive date strings ("2021-03-04 12:00:00.5") as epoch milliseconds, like the numeric x values
+    function parseDate(text) {
+        return Date.parse(text.length <= 10 ? text + "T00:00:00Z" : text.replace(" ", "T") + "Z");
+    }
+
+    // lod.window_from_relayout: [first, stop) days of the zoomed x range with one day of margin, or null
+    function zoomWindow(relayoutData, x0, dx, days) {
+        if (!relayoutData || relayoutData["xaxis.autorange"]) {
+            return null;
+        }
+        var range = relayoutData["xaxis.range"] ||
+            ("xaxis.range[0]" in relayoutData ? [relayoutData["xaxis.range[0]"], relayoutData["xaxis.range[1]"]] : null);
+        if (!range || range[0] === undefined || range[1] === undefined) {
+            return null;
+        }
+        var left = parseDate(String(range[0]));
+        var right = parseDate(String(range[1]));
+        if (isNaN(left) || isNaN(right)) {
+            return null;
+        }
+        // days before left, days up to and including right
+        var first = Math.max(Math.min(Math.ceil((left - x0) / dx), days) - 1, 0);
+        var stop = Math.min(Math.max(Math.floor((right - x0) / dx) + 1, 0) + 1, days);
+        return first < stop ? [first, stop] : null;
+    }
+
+    // x and y of every trace at the resolution, see figure_builder.lod_traces
+    function lodTraces(traces, payload, resolution, relayoutData, config) {
+        var days = payload.daily_cases.length;
+        if (payload.x || !resolution || resolution === "day" || (resolution === "auto" && days <= config.lod_points)) {
+            return traces.map(function (trace) {
+                if (payload.x) {
+                    trace.x = payload.x;
+                } else {
+                    trace.x0 = payload.x0;
+                    trace.dx = payload.dx;
+                }
+                trace.type = "scatter";
+                return trace;
+            });
+        }
+        var x0 = Date.parse(payload.x0 + "T00:00:00Z");
+        var dx = payload.dx;
+        if (resolution === "week" || resolution === "month") {
+            var starts = payload.buckets[resolution];
+            var x = starts.map(function (start, bucket) {
+                var stop = bucket + 1 < starts.length ? starts[bucket + 1] : days;
+                return x0 + (stop - 1) * dx;
+            });
+            return traces.map(function (trace) {
+                return Object.assign({}, trace, {y: bucketMeans(trace.y, starts, config.decimals), x: x, type: "scatter"});
+            });
+        }
+        var zoom = zoomWindow(relayoutData, x0, dx, days);
+        return traces.map(function (trace) {
+            var picks = lttbIndices(trace.y, config.lod_points);
+            if (zoom) {
+                var kept = {};
+                picks.forEach(function (day) { kept[day] = true; });
+                for (var day = zoom[0]; day < zoom[1]; day++) {
+                    kept[day] = true;
+                }
+                picks = Object.keys(kept).map(Number).sort(function (a, b) { return a - b; });
+            }
+            return Object.assign({}, trace, {
+                y: picks.map(function (day) { return trace.y[day]; }),
+                x: picks.map(function (day) { return x0 + day * dx; }),
+                type: "scatter"
+            });
+        });
+    }
+
+    // main_app.zoom_window: a relayout event alone only redraws an auto resolution chart whose x range moved or was reset
+    function zoomIgnored(payload, resolution, relayoutData) {
+        var context = window.dash_clientside.callback_context;
+        var triggered = context && context.triggered ? context.triggered : [];
+        if (!triggered.length || !triggered.every(function (trigger) { return trigger.prop_id === "graph.relayoutData"; })) {
+            return false;
+        }
+        if (resolution !== "auto") {
+            return true;
+        }
+        var x0 = Date.parse(payload.x0 + "T00:00:00Z");
+        return !(relayoutData && relayoutData["xaxis.autorange"]) &&
+            zoomWindow(relayoutData, x0, payload.dx, payload.daily_cases.length) === null;
+    }
+
+    function renderChart(payload, chart, n_clicks, resolution, relayoutData, config) {
+        if (!payload || !chart || !(chart in config.titles) || zoomIgnored(payload, resolution, relayoutData)) {
+            return window.dash_clientside.no_update;
+        }
+        var data = lodTraces(chartTraces(payload, chart, config), payload, resolution, relayoutData, config);
+        var xaxis = Object.assign({}, config.layout.xaxis);
+        if (chart === "RSI") {
+            xaxis.title = {text: "Dates"};
+        }
+        // figure_builder.ui_revision
+        var layout = Object.assign({}, config.layout, {
+            title: {text: config.titles[chart]},
+            xaxis: xaxis,
+            uirevision: JSON.stringify([[payload.region], chart, resolution || "day"])
+        });
+        return {data: data, layout: layout};
+    }
+
+    window.dash_clientside = Object.assign({}, window.dash_clientside, {
+        charts: {
+            render: renderChart
+        }
+    });
+})();
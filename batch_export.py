@@ -0,0 +1,178 @@
+# Headless export of every indicator for every region, without the Dash app.
+#   python batch_export.py --output export --datasets confirmed_global,deaths_global --format parquet
+# the data is loaded like main_app does (JHU download cache, DATA_FIXTURE_DIR style fixtures or a local csv),
+# then --chunk-regions regions at a time are computed with the batch indicator functions and written as one
+# partition file, so memory stays bounded by a few chunks however many regions the dataset has:
+#   <output>/dataset=<name>/part-00000.parquet (or .csv), long format: one row per region and day
+# computing a chunk is a few vectorized passes, writing it costs far more, so --workers N hands the writes
+# to N processes while the next chunks are computed.
+import os
+import sys
+import json
+import time
+import argparse
+import importlib.util
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterator, List
+
+import numpy as np
+import pandas as pd
+
+import Covid19DataHandler as handler
+from data_loader import open_data_source
+from data_quality import QualityPolicy
+
+# regions computed and written per partition file
+CHUNK_REGIONS = 256
+EXPORT_FORMATS = ('auto', 'parquet', 'csv')
+
+
+# True when pandas can write parquet (pyarrow or fastparquet is installed)
+def parquet_available() -> bool:
+    return any(importlib.util.find_spec(engine) is not None for engine in ('pyarrow', 'fastparquet'))
+
+
+# long-format frames of chunk_regions regions each: region, aggregate, date, accu_cases, daily_cases,
+# quality_flags (data_quality FLAG_* bits of the day) and one column per indicator series. indicator_params as in getCovidDataFrame, by default every indicator
+# with its default periods. the precomputed MACD/RSI are sliced from the store, the rest is computed per chunk
+def iter_region_frames(store: handler.CovidDataStore, indicator_params: Dict[str, Dict] = None,
+                       chunk_regions: int = CHUNK_REGIONS) -> Iterator[pd.DataFrame]:
+    if indicator_params is None:
+        indicator_params = {indicator: None for indicator in handler.INDICATOR_DEFAULTS}
+    indicator_params = {indicator: handler.normalizeIndicatorParams(indicator, params) for indicator, params in indicator_params.items()}
+    days = len(store.dates)
+    for start in range(0, len(store.regions), chunk_regions):
+        rows = slice(start, min(start + chunk_regions, len(store.regions)))
+        regions = store.regions[rows]
+        daily_cases = store.daily_cases[rows]
+        columns = {
+            'region': pd.Categorical(np.repeat(regions, days)),
+            'aggregate': np.repeat(np.arange(rows.start, rows.stop) >= store.base_regions, days),
+            'date': np.tile(store.dates.values, len(regions)),
+            'accu_cases': np.asarray(store.accu_cases[rows]).ravel(),
+            'daily_cases': np.asarray(daily_cases, dtype=np.float64).ravel(),
+            'quality_flags': np.asarray(store.quality.flags[rows]).ravel(),
+        }
+        for indicator, params in indicator_params.items():
+            if indicator in ('MACD', 'RSI') and params == handler.normalizeIndicatorParams(indicator):
+                names = ['MACD', 'MACDs', 'MACDh'] if indicator == 'MACD' else [f'RSI_{length}' for length in handler.RSI_LENGTHS]
+                series = {name: store.indicators[name][rows] for name in names}
+            else:
+                series = handler.calculateIndicatorSeries(daily_cases, indicator, dict(params))
+            for name, values in series.items():
+                columns[name] = np.asarray(values, dtype=np.float64).ravel()
+        yield pd.DataFrame(columns)
+
+
+# write one partition file, returns its rows and bytes
+def write_partition(frame: pd.DataFrame, path: str, file_format: str):
+    if file_format == 'parquet':
+        frame.to_parquet(path, index=False)
+    else:
+        frame.to_csv(path, index=False, float_format='%.6g', date_format='%Y-%m-%d')
+    return len(frame), os.path.getsize(path)
+
+
+# write the partitions of one dataset, returns regions, rows, files, bytes and seconds.
+# with workers > 1 the files are written by a process pool, at most 2 * workers frames are in flight
+def export_store(store: handler.CovidDataStore, output_dir: str, file_format: str, indicator_params: Dict[str, Dict] = None,
+                 chunk_regions: int = CHUNK_REGIONS, workers: int = 1) -> Dict[str, float]:
+    partition_dir = os.path.join(output_dir, f'dataset={store.dataset}')
+    os.makedirs(partition_dir, exist_ok=True)
+    # parts of an earlier export would mix with this one
+    for name in os.listdir(partition_dir):
+        if name.startswith('part-'):
+            os.remove(os.path.join(partition_dir, name))
+    stats = {'regions': len(store.regions), 'rows': 0, 'files': 0, 'bytes': 0}
+
+    def count(rows, size):
+        stats['rows'] += rows
+        stats['files'] += 1
+        stats['bytes'] += size
+
+    start = time.perf_counter()
+    frames = iter_region_frames(store, indicator_params, chunk_regions)
+    paths = (os.path.join(partition_dir, f'part-{part:05d}.{file_format}') for part in range(sys.maxsize))
+    if workers <= 1:
+        for frame, path in zip(frames, paths):
+            count(*write_partition(frame, path, file_format))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            pending = deque()
+            for frame, path in zip(frames, paths):
+                if len(pending) >= 2 * workers:
+                    count(*pending.popleft().result())
+                pending.append(executor.submit(write_partition, frame, path, file_format))
+            while pending:
+                count(*pending.popleft().result())
+    stats['seconds'] = time.perf_counter() - start
+    return stats
+
+
+def main(argv: List[str] = None):
+    parser = argparse.ArgumentParser(description='export every indicator of every region to partitioned parquet/csv files')
+    parser.add_argument('--output', required=True, help='output directory, one dataset=<name> folder per dataset')
+    parser.add_argument('--datasets', default=handler.DEFAULT_DATASET, help=f"comma separated, any of {', '.join(handler.DATASETS)} or 'all'")
+    parser.add_argument('--format', choices=EXPORT_FORMATS, default='auto', help='auto writes parquet when pyarrow or fastparquet is installed, csv otherwise')
+    parser.add_argument('--source', help='csv path or URL to read instead of the JHU repository (only with a single dataset)')
+    parser.add_argument('--cache-dir', default=os.environ.get('DATA_CACHE_DIR', 'data_cache'), help='download cache of the JHU csv files')
+    parser.add_argument('--fixture-dir', default=os.environ.get('DATA_FIXTURE_DIR'), help='read the csv files from this directory instead')
+    parser.add_argument('--groups-file', default=os.environ.get('REGION_GROUPS_FILE'), help='json of dataset -> {group name: [member regions]}')
+    parser.add_argument('--indicator-params', help='json like {"SMA": {"periods": [7, 30]}}, only these indicators are exported')
+    parser.add_argument('--quality-policy', default=os.environ.get('DATA_QUALITY_POLICY'), help='json like {"negatives": "clamp"}, how daily cases are derived (see data_quality)')
+    parser.add_argument('--chunk-regions', type=int, default=CHUNK_REGIONS, help='regions per partition file')
+    parser.add_argument('--workers', type=int, default=1, help='processes writing partition files, e.g. the number of cores')
+    args = parser.parse_args(argv)
+
+    datasets = list(handler.DATASETS) if args.datasets == 'all' else args.datasets.split(',')
+    unknown = [name for name in datasets if name not in handler.DATASETS]
+    if unknown:
+        parser.error(f"unknown datasets: {', '.join(unknown)}")
+    if args.source and len(datasets) != 1:
+        parser.error('--source needs exactly one dataset')
+    if args.chunk_regions < 1:
+        parser.error('--chunk-regions must be at least 1')
+    file_format = args.format
+    if file_format == 'auto':
+        file_format = 'parquet' if parquet_available() else 'csv'
+    elif file_format == 'parquet' and not parquet_available():
+        parser.error('parquet output needs pyarrow or fastparquet, install one or use --format csv')
+    indicator_params = None
+    if args.indicator_params:
+        try:
+            indicator_params = json.loads(args.indicator_params)
+            for indicator, params in indicator_params.items():
+                handler.normalizeIndicatorParams(indicator, params)
+        # json.JSONDecodeError is a ValueError too; well-formed json of the wrong shape, like {"SMA": 5} or [1],
+        # fails with TypeError / AttributeError
+        except (TypeError, ValueError, AttributeError) as e:
+            parser.error(f'--indicator-params: {e}')
+    try:
+        quality_policy = QualityPolicy(**json.loads(args.quality_policy or '{}'))
+    except (TypeError, ValueError) as e:
+        parser.error(f'--quality-policy: {e}')
+    custom_groups = {}
+    if args.groups_file:
+        with open(args.groups_file, 'r', encoding='utf-8') as f:
+            custom_groups = json.load(f)
+
+    total_regions, total_seconds = 0, 0.0
+    for name in datasets:
+        load_start = time.perf_counter()
+        source = open_data_source(args.source or handler.JHU_TIME_SERIES_URL + handler.DATASETS[name]['file_name'],
+                                  cache_dir=args.cache_dir, fixture_dir=None if args.source else args.fixture_dir)
+        store = handler.buildCovidDataStore(source, source.fingerprint(), name, custom_groups.get(name), quality_policy)
+        load_seconds = time.perf_counter() - load_start
+        stats = export_store(store, args.output, file_format, indicator_params, args.chunk_regions, args.workers)
+        total_regions += stats['regions']
+        total_seconds += stats['seconds']
+        print(f"{name}: {stats['regions']} regions, {stats['rows']:,d} rows, {stats['files']} {file_format} files, "
+              f"{stats['bytes'] / 2 ** 20:.1f} MB; load {load_seconds:.2f} s, export {stats['seconds']:.2f} s, "
+              f"{stats['regions'] / max(stats['seconds'], 1e-9):,.0f} regions/s")
+    if len(datasets) > 1:
+        print(f'total: {total_regions} regions in {total_seconds:.2f} s, {total_regions / max(total_seconds, 1e-9):,.0f} regions/s')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
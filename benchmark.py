@@ -0,0 +1,222 @@
+# Benchmark of the data pipeline and the plot callback hot path, runs offline on synthetic data.
+#   python benchmark.py --sizes 300x1000,5000x3000 --output bench.json
+# every stage is timed (best of --repeat runs) with its tracemalloc peak, the result is printed
+# as a table and optionally written as json so runs on different commits can be compared.
+import os
+import sys
+import gzip
+import json
+import time
+import argparse
+import tempfile
+import platform
+import threading
+import subprocess
+import tracemalloc
+from typing import Callable, Dict, List
+
+import numpy as np
+import pandas as pd
+
+import Covid19DataHandler as handler
+import tech_analysis_lib as ta
+from data_loader import LocalFileSource
+from region_index import RegionIndex
+from screener import LatestSnapshot
+from lod import LevelOfDetail
+from data_quality import DataQuality
+
+CHARTS = ['Line', 'SMA', 'EMA', 'MACD', 'RSI']
+
+
+# JHU-shaped confirmed cases csv: Province/State, Country/Region, Lat, Long, then one accumulated count per day
+def write_synthetic_csv(path: str, regions: int, days: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    daily = rng.poisson(rng.uniform(0, 500, (regions, 1)), (regions, days))
+    # occasional back-corrections like the real data
+    daily[rng.random((regions, days)) < 0.005] *= -1
+    accu_cases = np.maximum.accumulate(np.cumsum(daily, axis=1), axis=1)
+    dates = pd.date_range('2020-01-22', periods=days)
+    df = pd.DataFrame(accu_cases, columns=[f'{d.month}/{d.day}/{d.year % 100}' for d in dates])
+    df.insert(0, 'Long', 0.0)
+    df.insert(0, 'Lat', 0.0)
+    df.insert(0, 'Country/Region', ['Taiwan*'] + [f'Country {i}' for i in range(1, regions)])
+    df.insert(0, 'Province/State', [f'Province {i}' if i % 7 == 1 else None for i in range(regions)])
+    df.to_csv(path, index=False)
+
+
+def measure(func: Callable, repeat: int) -> Dict[str, float]:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'best_s': min(timings), 'mean_s': sum(timings) / len(timings), 'peak_mb': peak / 2 ** 20}
+
+
+def bench_size(regions: int, days: int, repeat: int, work_dir: str) -> Dict[str, Dict[str, float]]:
+    file_name = handler.DATASETS[handler.DEFAULT_DATASET]['file_name']
+    csv_path = os.path.join(work_dir, file_name)
+    write_synthetic_csv(csv_path, regions, days)
+    raw_df = pd.read_csv(csv_path, sep=',')
+    source = LocalFileSource(csv_path)
+    data_store = handler.buildCovidDataStore(source)
+    region = 'Taiwan*'
+    region_df = data_store.getRegionFrame(region)
+    daily_cases = data_store.daily_cases
+    # the store one day earlier, for the incremental quality pass
+    previous_daily, previous_quality = DataQuality.build(data_store.accu_cases[:, :-1], data_store.quality.policy)
+
+    stages = {
+        'parse.read_csv': lambda: pd.read_csv(csv_path, sep=','),
+        'parse.store_chunked': lambda: handler._readWideCsv(source),
+        'store.build': lambda: handler.buildCovidDataStore(raw_df),
+        'store.aggregate': lambda: data_store.groups.sum(data_store.accu_cases[:data_store.base_regions]),
+        'store.aggregate_one_day': lambda: data_store.groups.sum(data_store.accu_cases[:data_store.base_regions, -1:]),
+        'screener.build': lambda: LatestSnapshot.build(data_store.regions, data_store.dates, data_store.base_regions,
+                                                       data_store.accu_cases, data_store.daily_cases, data_store.indicators),
+        'screener.rank': lambda: data_store.latest.records(data_store.latest.rank('growth_7d', scope='regions')[:20]),
+        'lod.build': lambda: LevelOfDetail(data_store.dates, data_store.daily_cases),
+        'quality.build': lambda: DataQuality.build(data_store.accu_cases, data_store.quality.policy),
+        'quality.append_day': lambda: previous_quality.append(data_store.accu_cases, previous_daily),
+        'country_list': lambda: handler.getCountryList(raw_df),
+        'region_index.build': lambda: RegionIndex(data_store.regions),
+        'region_index.search_prefix': lambda: data_store.region_search.search('taiw'),
+        'region_index.search_fuzzy': lambda: data_store.region_search.search('tiawan'),
+        'extract.dataframe_mode': lambda: handler.getCovidDataFrame(raw_dataframe=raw_df, country=region, op_mode=handler.OP_MODE_DATAFRAME),
+        'extract.store_mode': lambda: handler.getCovidDataFrame(country=region, op_mode=handler.OP_MODE_STORE, data_store=data_store),
+        'indicator.rsi_6': lambda: ta.calculate_rsi(region_df, rsi_length=6),
+        'indicator.rsi_12': lambda: ta.calculate_rsi(region_df, rsi_length=12),
+        'indicator.macd': lambda: ta.calculate_macd(region_df, 'daily_cases'),
+        'indicator.batch_rsi_6': lambda: ta.calculate_rsi_batch(daily_cases, rsi_length=6),
+        'indicator.batch_macd': lambda: ta.calculate_macd_batch(daily_cases),
+    }
+    results = {name: measure(func, repeat) for name, func in stages.items()}
+    results.update(_bench_figures(work_dir, region, repeat))
+    return results
+
+
+# figure stages need main_app, which loads its data at import, so they run in a child process
+# pointed at the synthetic csv
+def _bench_figures(work_dir: str, region: str, repeat: int) -> Dict[str, Dict[str, float]]:
+    env = dict(os.environ, DATA_FIXTURE_DIR=work_dir, DATA_REFRESH_INTERVAL='0', DATASETS=handler.DEFAULT_DATASET,
+               DATA_SNAPSHOT_DIR=os.path.join(work_dir, 'snapshot'), CLIENTSIDE_CHARTS='1')
+    env.pop('FIGURE_CACHE_DIR', None)
+    output = subprocess.run([sys.executable, os.path.abspath(__file__), '--figures', region, '--repeat', str(repeat)],
+                            env=env, check=True, capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+def _figure_stages(region: str, repeat: int):
+    import main_app
+    from figure_builder import build_figure_json, build_comparison_json, build_region_payload_json
+
+    store = main_app.data_stores[handler.DEFAULT_DATASET]
+    # plain functions, without dash's callback context
+    graph_generator = main_app.graph_generator
+    region_payload = main_app.region_payload.__wrapped__
+    figure_cache = main_app.figure_caches[handler.DEFAULT_DATASET]
+    results = {}
+
+    # client side charts: one payload per region, chart switching costs nothing on the server
+    results['payload.build_json'] = measure(lambda: build_region_payload_json(store, region), repeat)
+    payload = build_region_payload_json(store, region).encode('utf-8')
+    results['payload.bytes'] = {'bytes': len(payload)}
+    results['payload.gzip_bytes'] = {'bytes': len(gzip.compress(payload, 6))}
+
+    def cold_payload():
+        figure_cache.clear()
+        region_payload(handler.DEFAULT_DATASET, region)
+    results['callback.payload.cold'] = measure(cold_payload, repeat)
+    results['callback.payload.warm'] = measure(lambda: region_payload(handler.DEFAULT_DATASET, region), repeat)
+
+    # identical requests from several clients at once on a cold cache, coalesced into one build
+    def concurrent_cold(clients):
+        figure_cache.clear()
+        store._indicator_cache.clear()
+        threads = [threading.Thread(target=graph_generator, args=(1, 'day', None, handler.DEFAULT_DATASET, region, 'SMA', '5, 20'))
+                   for _ in range(clients)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    for clients in (1, 8):
+        results[f'callback.SMA.cold_{clients}_clients'] = measure(lambda: concurrent_cold(clients), repeat)
+
+    # comparison of ten regions, indicators computed cold (memo cleared) in one batch
+    compared = store.regions[:10]
+    for chart in ('SMA', 'MACD'):
+        for count in (1, len(compared)):
+            def cold_comparison():
+                store._indicator_cache.clear()
+                build_comparison_json(store, compared[:count], chart, main_app.colors)
+            results[f'compare.{chart}.{count}_regions'] = measure(cold_comparison, repeat)
+
+    # server side charts
+    for chart in CHARTS:
+        results[f'figure.{chart}.build_json'] = measure(lambda: build_figure_json(store, region, chart, main_app.colors), repeat)
+        payload = build_figure_json(store, region, chart, main_app.colors).encode('utf-8')
+        results[f'figure.{chart}.bytes'] = {'bytes': len(payload)}
+        results[f'figure.{chart}.gzip_bytes'] = {'bytes': len(gzip.compress(payload, 6))}
+        # long ranges as LTTB picks (resolution auto)
+        payload = build_figure_json(store, region, chart, main_app.colors, resolution='auto').encode('utf-8')
+        results[f'figure.{chart}.auto_gzip_bytes'] = {'bytes': len(gzip.compress(payload, 6))}
+
+        def cold_callback():
+            figure_cache.clear()
+            graph_generator(1, 'day', None, handler.DEFAULT_DATASET, region, chart)
+        results[f'callback.{chart}.cold'] = measure(cold_callback, repeat)
+        results[f'callback.{chart}.warm'] = measure(lambda: graph_generator(1, 'day', None, handler.DEFAULT_DATASET, region, chart), repeat)
+    print(json.dumps(results))
+
+
+def parse_sizes(text: str) -> List[tuple]:
+    return [tuple(int(n) for n in size.lower().split('x')) for size in text.split(',')]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark the COVID-19 data pipeline on synthetic JHU data')
+    parser.add_argument('--sizes', default='300x1000', help='comma separated REGIONSxDAYS, e.g. 300x1000,5000x3000')
+    parser.add_argument('--repeat', type=int, default=5, help='runs per stage, the best and mean are reported')
+    parser.add_argument('--output', help='write the results as json to this file')
+    parser.add_argument('--figures', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.figures:
+        _figure_stages(args.figures, args.repeat)
+        return
+
+    report = {
+        'python': platform.python_version(), 'numpy': np.__version__, 'pandas': pd.__version__,
+        'commit': _git_commit(), 'repeat': args.repeat, 'sizes': {},
+    }
+    for regions, days in parse_sizes(args.sizes):
+        with tempfile.TemporaryDirectory() as work_dir:
+            results = bench_size(regions, days, args.repeat, work_dir)
+        report['sizes'][f'{regions}x{days}'] = results
+        print(f'\n{regions} regions x {days} days')
+        for name, result in results.items():
+            if 'bytes' in result:
+                print(f'  {name:32s} {result["bytes"]:>12,d} bytes')
+            else:
+                print(f'  {name:32s} {result["best_s"] * 1000:10.2f} ms  {result["peak_mb"]:8.1f} MB peak')
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        return ''
+
+
+if __name__ == '__main__':
+    main()
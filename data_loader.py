@@ -0,0 +1,231 @@
+import os
+import json
+import time
+import logging
+import tempfile
+import threading
+from abc import ABC, abstractmethod
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import urlparse
+
+import pandas as pd
+import requests
+
+logger = logging.getLogger(__name__)
+
+# load timings per source kind, see get_load_metrics
+_load_metrics: Dict[str, Dict[str, float]] = {}
+_metrics_lock = threading.Lock()
+
+
+def _record_load(source_kind: str, seconds: float, failed: bool = False, offline: bool = False):
+    with _metrics_lock:
+        metrics = _load_metrics.setdefault(source_kind, {'loads': 0, 'failures': 0, 'offline_loads': 0,
+                                                         'last_seconds': 0.0, 'total_seconds': 0.0})
+        if failed:
+            metrics['failures'] += 1
+            return
+        metrics['loads'] += 1
+        metrics['offline_loads'] += int(offline)
+        metrics['last_seconds'] = seconds
+        metrics['total_seconds'] += seconds
+
+
+# loads, failures, loads served from the offline cache and load seconds per source kind
+def get_load_metrics() -> Dict[str, Dict[str, float]]:
+    with _metrics_lock:
+        return {kind: dict(metrics) for kind, metrics in _load_metrics.items()}
+
+
+# a JHU csv source. fingerprint() is a cheap version tag used to skip unchanged data,
+# local_path() returns a local copy of the file that read_frame() parses.
+class DataSource(ABC):
+    kind = 'base'
+
+    @abstractmethod
+    def fingerprint(self) -> Optional[str]:
+        pass
+
+    @abstractmethod
+    def local_path(self) -> str:
+        pass
+
+    # fingerprint of the file the reads of the current load parsed. that is the one fingerprint() returned
+    # unless the source had to fall back to an older copy since
+    def loaded_fingerprint(self, fingerprint: Optional[str]) -> Optional[str]:
+        return fingerprint
+
+    def read_frame(self) -> pd.DataFrame:
+        start = time.perf_counter()
+        try:
+            df = pd.read_csv(self.local_path(), sep=',')
+        except Exception:
+            _record_load(self.kind, 0.0, failed=True)
+            raise
+        _record_load(self.kind, time.perf_counter() - start, offline=getattr(self, 'offline', False))
+        return df
+
+    # read the csv in row chunks of chunksize rows, extra keyword arguments go to pd.read_csv.
+    # the load is recorded once the last chunk was read.
+    def read_chunks(self, chunksize: int, **read_csv_kwargs) -> Iterator[pd.DataFrame]:
+        start = time.perf_counter()
+        try:
+            with pd.read_csv(self.local_path(), sep=',', chunksize=chunksize, **read_csv_kwargs) as reader:
+                for chunk in reader:
+                    yield chunk
+        except Exception:
+            _record_load(self.kind, 0.0, failed=True)
+            raise
+        _record_load(self.kind, time.perf_counter() - start, offline=getattr(self, 'offline', False))
+
+    # column names from the header line only
+    def read_header(self) -> List[str]:
+        return list(pd.read_csv(self.local_path(), sep=',', nrows=0).columns)
+
+
+# csv file on the local disk, versioned by size and modification time
+class LocalFileSource(DataSource):
+    kind = 'file'
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def fingerprint(self) -> Optional[str]:
+        stat = os.stat(self.path)
+        return f'{stat.st_size}-{stat.st_mtime_ns}'
+
+    def local_path(self) -> str:
+        return self.path
+
+
+# csv files checked into a fixture directory, never touches the network
+class FixtureSource(LocalFileSource):
+    kind = 'fixture'
+
+    def __init__(self, fixture_dir: str, file_name: str):
+        super().__init__(os.path.join(fixture_dir, file_name))
+
+
+# csv over HTTP, downloaded into cache_dir with conditional requests (ETag / Last-Modified).
+# every request has a timeout and is retried with exponential backoff. when the server cannot be
+# reached the last good cached copy is used, so the app still starts without network.
+# a load starts with fingerprint(): the local copy is then fetched at most once and shared by every read
+# of that load, and once the server turned out to be unreachable the rest of the load stays offline.
+class CachedHTTPSource(DataSource):
+    kind = 'http'
+
+    def __init__(self, url: str, cache_dir: str, timeout: float = 30, retries: int = 3, backoff: float = 1.0):
+        self.url = url
+        self.cache_dir = cache_dir
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        # True when the last answer came from the cache because the server was unreachable
+        self.offline = False
+        name = os.path.basename(urlparse(url).path) or 'data.csv'
+        self._data_path = os.path.join(cache_dir, name)
+        self._meta_path = self._data_path + '.meta.json'
+        # local copy resolved for the current load and its fingerprint, None until the first read
+        self._load_path = None
+        self._load_fingerprint = None
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def fingerprint(self) -> Optional[str]:
+        self._load_path = None
+        try:
+            response = self._request(requests.head, allow_redirects=True)
+            self.offline = False
+            return _validator(response.headers)
+        except requests.RequestException:
+            meta = self._read_meta()
+            if meta is None:
+                raise
+            logger.warning('%s unreachable, using cached copy', self.url)
+            self.offline = True
+            return meta.get('fingerprint')
+
+    def local_path(self) -> str:
+        if self._load_path is None:
+            self._load_path, self._load_fingerprint = self._fetch()
+        return self._load_path
+
+    # a HEAD that reached the server followed by a GET that did not leaves the old cached copy behind
+    # the new fingerprint, the store must be tagged with the cached copy's own fingerprint
+    def loaded_fingerprint(self, fingerprint: Optional[str]) -> Optional[str]:
+        return fingerprint if self._load_path is None else self._load_fingerprint
+
+    # download the file unless the cached copy is current, or use the cached copy when offline.
+    # returns the local path and the fingerprint of the file there
+    def _fetch(self) -> Tuple[str, Optional[str]]:
+        meta = self._read_meta()
+        if self.offline and meta is not None and os.path.exists(self._data_path):
+            return self._data_path, meta.get('fingerprint')
+        headers = {}
+        if meta is not None and os.path.exists(self._data_path):
+            if meta.get('etag'):
+                headers['If-None-Match'] = meta['etag']
+            if meta.get('last_modified'):
+                headers['If-Modified-Since'] = meta['last_modified']
+        try:
+            response = self._request(requests.get, headers=headers)
+        except requests.RequestException:
+            if not headers:
+                raise
+            logger.warning('%s unreachable, using cached copy', self.url)
+            self.offline = True
+            return self._data_path, meta.get('fingerprint')
+        self.offline = False
+        if response.status_code == 304:
+            return self._data_path, meta.get('fingerprint')
+        _write_atomic(self._data_path, response.content)
+        _write_atomic(self._meta_path, json.dumps({
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'fingerprint': _validator(response.headers),
+        }).encode('utf-8'))
+        return self._data_path, _validator(response.headers)
+
+    def _request(self, method: Callable, **kwargs) -> requests.Response:
+        for attempt in range(self.retries + 1):
+            try:
+                response = method(self.url, timeout=self.timeout, **kwargs)
+                if response.status_code != 304:
+                    response.raise_for_status()
+                return response
+            except requests.RequestException:
+                if attempt == self.retries:
+                    raise
+                time.sleep(self.backoff * 2 ** attempt)
+
+    def _read_meta(self) -> Optional[dict]:
+        try:
+            with open(self._meta_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+
+# source for a path or URL. with fixture_dir set every source resolves to the file of the same
+# name in that directory, which is how tests run fully offline.
+def open_data_source(data_src: str, cache_dir: str = 'data_cache', fixture_dir: str = None) -> DataSource:
+    if fixture_dir is not None:
+        return FixtureSource(fixture_dir, os.path.basename(urlparse(data_src).path))
+    if urlparse(data_src).scheme in ('http', 'https'):
+        return CachedHTTPSource(data_src, cache_dir)
+    return LocalFileSource(data_src)
+
+
+def _validator(headers) -> Optional[str]:
+    return headers.get('ETag') or headers.get('Last-Modified')
+
+
+def _write_atomic(path: str, content: bytes):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
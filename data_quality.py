@@ -0,0 +1,262 @@
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+
+# data quality pass over the accumulated counts of every region. the JHU series have three kinds of defects:
+#   negative  the accumulated count drops, a back-correction of cases reported before
+#   gap       days without new cases between two reported days of a region that reports every day,
+#             followed by a catch-up day holding their cases
+#   dump      a day with far more cases than the days before, a backlog reported at once
+# each kind is flagged per region and day (one bit each) and handled by its policy when daily cases are derived.
+FLAG_NEGATIVE = 1
+FLAG_GAP = 2
+FLAG_DUMP = 4
+# the daily value differs from the raw difference of the accumulated counts
+FLAG_ADJUSTED = 8
+QUALITY_FLAGS = {'negative': FLAG_NEGATIVE, 'gap': FLAG_GAP, 'dump': FLAG_DUMP, 'adjusted': FLAG_ADJUSTED}
+
+# negatives: clamp     a negative day counts as 0, the corrected cases stay in the totals (what the charts did before)
+#            carry     the accumulated count never drops, the following days are 0 until it is exceeded again
+#            backfill  the correction is taken off the days before it, latest first and at most backfill_days back,
+#                      so the totals match the corrected count (a correction larger than those days is carried)
+# gaps:      keep      zeros and catch-up day as reported
+#            spread    the catch-up day's cases are spread evenly over the gap and the catch-up day
+# dumps:     keep      as reported
+#            spread    the cases above the mean of the dump_window days before are spread evenly over those days
+QUALITY_POLICIES = {
+    'negatives': ('clamp', 'carry', 'backfill'),
+    'gaps': ('keep', 'spread'),
+    'dumps': ('keep', 'spread'),
+}
+# gap_min_daily: mean daily cases over the dump_window days before a gap below which zero days are
+# plausible and not treated as a gap. dump_factor, dump_min_cases: a dump has more than dump_factor times
+# the mean of the dump_window days before and at least dump_min_cases cases
+QUALITY_DEFAULTS = {
+    'negatives': 'backfill',
+    'gaps': 'spread',
+    'dumps': 'keep',
+    'backfill_days': 28,
+    'max_gap_days': 7,
+    'gap_min_daily': 10.0,
+    'dump_window': 14,
+    'dump_factor': 5.0,
+    'dump_min_cases': 100.0,
+}
+MAX_QUALITY_DAYS = 365
+
+
+# how daily cases are derived, parameters as in QUALITY_DEFAULTS (missing ones use the defaults).
+# raises ValueError for unknown parameters or values
+class QualityPolicy:
+    def __init__(self, **params):
+        unknown = params.keys() - QUALITY_DEFAULTS.keys()
+        if unknown:
+            raise ValueError(f"unknown quality policy parameters: {', '.join(sorted(map(str, unknown)))}")
+        params = dict(QUALITY_DEFAULTS, **params)
+        for name, choices in QUALITY_POLICIES.items():
+            if params[name] not in choices:
+                raise ValueError(f"unknown {name} policy '{params[name]}', expected one of {', '.join(choices)}")
+        for name in ('backfill_days', 'max_gap_days', 'dump_window'):
+            value = params[name]
+            if isinstance(value, bool) or not isinstance(value, (int, np.integer)) or not 1 <= value <= MAX_QUALITY_DAYS:
+                raise ValueError(f'{name} must be a whole number from 1 to {MAX_QUALITY_DAYS}, got {value!r}')
+            params[name] = int(value)
+        for name in ('gap_min_daily', 'dump_factor', 'dump_min_cases'):
+            value = params[name]
+            if isinstance(value, bool) or not isinstance(value, (int, float, np.number)) or not value >= 0:
+                raise ValueError(f'{name} must be a number of at least 0, got {value!r}')
+            params[name] = float(value)
+        self.params = params
+        for name, value in params.items():
+            setattr(self, name, value)
+        # a refresh re-derives the last revision_days known days (a correction, catch-up or dump on a new
+        # day reaches back that far) plus context_days before them, the trailing windows of the detection
+        self.revision_days = self.backfill_days + self.max_gap_days + 1 + self.dump_window
+        self.context_days = self.max_gap_days + 1 + 2 * self.dump_window
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, QualityPolicy) and self.params == other.params
+
+    def __repr__(self) -> str:
+        return f"QualityPolicy({', '.join(f'{name}={value!r}' for name, value in self.params.items())})"
+
+    def to_dict(self) -> dict:
+        return dict(self.params)
+
+    @classmethod
+    def from_dict(cls, state: dict = None) -> 'QualityPolicy':
+        return cls(**(state or {}))
+
+
+# daily cases and flags of accumulated cases (one region or regions x days) under policy, the default
+# policy when None. the first day is 0
+def clean_daily_cases(accu_cases: np.ndarray, policy: QualityPolicy = None) -> Tuple[np.ndarray, np.ndarray]:
+    accu_cases = np.asarray(accu_cases)
+    daily_cases, flags, _ = _clean_window(np.atleast_2d(accu_cases).astype(np.float64), policy or QualityPolicy())
+    return daily_cases.reshape(accu_cases.shape), flags.reshape(accu_cases.shape)
+
+
+# result of the quality pass of a data store: the policy, the flags of every region and day, every flag a
+# region had on any day, and what a refresh continues from (see append)
+class DataQuality:
+    def __init__(self, policy: QualityPolicy, flags: np.ndarray, start: int = 0, level: np.ndarray = None):
+        self.policy = policy
+        self.flags = flags
+        self.region_flags = np.bitwise_or.reduce(flags, axis=1) if flags.shape[1] else np.zeros(len(flags), dtype=np.uint8)
+        # a refresh re-derives the days from start on, level holds the cleaned accumulated count of the day
+        # before start (None when start is 0 or the negatives are clamped)
+        self.start = start
+        self.level = level
+
+    # regions with each flag on any day
+    def counts(self) -> Dict[str, int]:
+        return {name: int(np.count_nonzero(self.region_flags & flag)) for name, flag in QUALITY_FLAGS.items()}
+
+    # daily cases and quality of a whole (regions x days) matrix of accumulated cases
+    @classmethod
+    def build(cls, accu_cases: np.ndarray, policy: QualityPolicy = None) -> Tuple[np.ndarray, 'DataQuality']:
+        policy = policy or QualityPolicy()
+        daily_cases, flags, cleaned = _clean_window(np.asarray(accu_cases, dtype=np.float64), policy)
+        start = _refresh_start(accu_cases.shape[1], policy)
+        level = cleaned[:, start - 1].copy() if start > 0 and cleaned is not None else None
+        return daily_cases, cls(policy, flags, start, level)
+
+    # daily cases and quality after days were appended: accu_cases holds every day (the known ones unchanged),
+    # daily_cases the known days as derived before. only the days from start on are derived again, so
+    # corrections on the new days can still change the known days they reach back into. also returns
+    # the rows whose known daily cases changed.
+    def append(self, accu_cases: np.ndarray, daily_cases: np.ndarray) -> Tuple[np.ndarray, 'DataQuality', np.ndarray]:
+        policy = self.policy
+        known_days, days = daily_cases.shape[1], accu_cases.shape[1]
+        start = self.start
+        window = np.asarray(accu_cases[:, start:], dtype=np.float64)
+        previous = np.asarray(accu_cases[:, start - 1], dtype=np.float64) if start > 0 else None
+        window_daily, window_flags, cleaned = _clean_window(window, policy, previous, self.level)
+        # the first context_days of a window lack the days before them and differ from a full pass
+        first = start + policy.context_days if start > 0 else 0
+        revised = np.flatnonzero((window_daily[:, first - start:known_days - start] != daily_cases[:, first:known_days]).any(axis=1))
+        new_daily = np.concatenate((daily_cases, window_daily[:, known_days - start:]), axis=1)
+        if len(revised):
+            new_daily[revised, first:] = window_daily[revised, first - start:]
+        # flags of unchanged days can change as well, e.g. zero days that turn out to be a gap
+        new_flags = np.concatenate((self.flags[:, :first], window_flags[:, first - start:]), axis=1)
+        new_start = _refresh_start(days, policy)
+        level = None
+        if cleaned is not None and new_start > 0:
+            level = cleaned[:, new_start - 1 - start].copy() if new_start > start else self.level
+        return new_daily, DataQuality(policy, new_flags, new_start, level), revised
+
+    def state_dict(self) -> dict:
+        return {'policy': self.policy.to_dict(), 'start': self.start, 'level': None if self.level is None else self.level.tolist()}
+
+    @classmethod
+    def from_state(cls, state: dict, flags: np.ndarray) -> 'DataQuality':
+        level = state.get('level')
+        return cls(QualityPolicy.from_dict(state['policy']), flags, state['start'], None if level is None else np.asarray(level, dtype=np.float64))
+
+
+# first day the next refresh derives again, the known days a new day can change and the context before them
+def _refresh_start(days: int, policy: QualityPolicy) -> int:
+    return max(days - policy.revision_days - policy.context_days, 0)
+
+
+# smallest value of each day and the days days after it (fewer at the end of the rows), in log2(days) passes
+def _forward_min(values: np.ndarray, days: int) -> np.ndarray:
+    result = values.copy()
+    covered = 1
+    while covered <= days and covered < values.shape[1]:
+        step = min(covered, days + 1 - covered)
+        np.minimum(result[:, :-step], result[:, step:], out=result[:, :-step])
+        covered += step
+    return result
+
+
+# sum of the days values before each day (NaN without that many days before it). built from sums of
+# power of two blocks, added in the same order for every window, so a window of days gives the same sums
+# wherever the rows start (a running total would not)
+def _trailing_sum(values: np.ndarray, days: int) -> np.ndarray:
+    rows, length = values.shape
+    sums = np.full((rows, length), np.nan)
+    if length <= days:
+        return sums
+    # block holds the sums of size consecutive values from each day on, total the window sums from day
+    # 'days' on of the bits of days added so far, offset where the next bit's block starts
+    total = np.zeros((rows, length - days))
+    block, size, offset = values, 1, 0
+    while size <= days:
+        if days & size:
+            total += block[:, offset:offset + length - days]
+            offset += size
+        if 2 * size <= days:
+            block = block[:, :-size] + block[:, size:]
+        size *= 2
+    sums[:, days:] = total
+    return sums
+
+
+# daily cases, flags and cleaned accumulated counts (None when negatives are clamped) of a (regions x days)
+# float matrix of accumulated counts. previous and level are the accumulated and cleaned accumulated counts
+# of the day before the matrix, without them its first day is the first day of the series and counts 0
+def _clean_window(accu_cases: np.ndarray, policy: QualityPolicy, previous: np.ndarray = None,
+                  level: np.ndarray = None) -> Tuple[np.ndarray, np.ndarray, Optional[np.ndarray]]:
+    rows, days = accu_cases.shape
+    raw = np.zeros((rows, days))
+    if days:
+        np.subtract(accu_cases[:, 1:], accu_cases[:, :-1], out=raw[:, 1:])
+        if previous is not None:
+            raw[:, 0] = accu_cases[:, 0] - previous
+    flags = (raw < 0).astype(np.uint8)  # FLAG_NEGATIVE
+
+    # negatives
+    cleaned = None
+    if policy.negatives == 'clamp':
+        daily_cases = np.maximum(raw, 0)
+    else:
+        floor = _forward_min(accu_cases, policy.backfill_days) if policy.negatives == 'backfill' else accu_cases
+        cleaned = np.maximum.accumulate(floor, axis=1)
+        if level is not None:
+            np.maximum(cleaned, level[:, None], out=cleaned)
+        daily_cases = np.zeros((rows, days))
+        if days:
+            np.subtract(cleaned[:, 1:], cleaned[:, :-1], out=daily_cases[:, 1:])
+            if level is not None:
+                daily_cases[:, 0] = cleaned[:, 0] - level
+
+    # gaps: every day gets the last reported (positive) day before it and the first one from it on, a gap day
+    # or catch-up day is at most max_gap_days + 1 days after the last reported one
+    if days:
+        positions = np.arange(days, dtype=np.int32)
+        reported = daily_cases > 0
+        last_reported = np.full((rows, days), -1, dtype=np.int32)
+        np.maximum.accumulate(np.where(reported[:, :-1], positions[:-1], -1), axis=1, out=last_reported[:, 1:])
+        next_reported = np.minimum.accumulate(np.where(reported, positions, days)[:, ::-1], axis=1)[:, ::-1]
+        span = next_reported - last_reported
+        row, day = np.nonzero((last_reported >= 0) & (next_reported < days) & (span >= 2) & (span <= policy.max_gap_days + 1))
+        # only those days can be gap days: the mean daily cases of the dump_window days up to the last
+        # reported one must make a day without cases implausible. exact, the counts are whole numbers here
+        totals = np.zeros((rows, days + 1))
+        np.cumsum(daily_cases, axis=1, out=totals[:, 1:])
+        stop = last_reported[row, day] + 1
+        begin = np.maximum(stop - policy.dump_window, 0)
+        gap = (totals[row, stop] - totals[row, begin]) >= policy.gap_min_daily * (stop - begin)
+        row, day = row[gap], day[gap]
+        flags[row, day] |= FLAG_GAP
+        if policy.gaps == 'spread':
+            daily_cases[row, day] = daily_cases[row, next_reported[row, day]] / span[row, day]
+
+    # dumps
+    mean = _trailing_sum(daily_cases, policy.dump_window)
+    mean /= policy.dump_window
+    with np.errstate(invalid='ignore'):
+        dump = (daily_cases >= policy.dump_min_cases) & (daily_cases > policy.dump_factor * mean)
+    flags[dump] |= FLAG_DUMP
+    if policy.dumps == 'spread' and dump.any():
+        share = np.where(dump, (daily_cases - mean) / policy.dump_window, 0)
+        # each day receives the shares of the dumps in the dump_window days after it
+        padded = np.concatenate((share, np.zeros((rows, policy.dump_window + 1))), axis=1)
+        received = _trailing_sum(padded[:, ::-1], policy.dump_window)[:, ::-1][:, :days]
+        daily_cases = np.where(dump, mean, daily_cases) + received
+
+    flags[np.abs(daily_cases - raw) > 1e-9] |= FLAG_ADJUSTED
+    return daily_cases, flags, cleaned
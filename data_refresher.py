@@ -0,0 +1,71 @@
+import sys
+import threading
+import logging
+from typing import Callable, Optional
+
+from Covid19DataHandler import CovidDataStore, updateCovidDataStore
+from data_loader import DataSource
+
+logger = logging.getLogger(__name__)
+
+
+# background thread that keeps a CovidDataStore up to date with its source.
+# every interval seconds the source fingerprint is checked (ETag / Last-Modified from a HEAD request
+# for URLs, size and mtime for local files) and the csv is only read again when it changed.
+# the refreshed store is handed to on_update, readers keep using whichever store they already hold. on_update may
+# return the store it published instead (e.g. memory-mapped from a snapshot), the next refresh continues from that one.
+# initial_delay is the wait before the first check, the interval by default; 0 checks right after start, for
+# stores loaded from a snapshot without asking the source.
+# under gevent (gunicorn -k gevent) this thread is a greenlet of the worker's event loop, so the csv parse and
+# on_update run on the hub's threadpool instead, requests of the worker are served while they run.
+class DataRefresher(threading.Thread):
+    def __init__(self, data_source: DataSource, data_store: CovidDataStore, on_update: Callable[[CovidDataStore], Optional[CovidDataStore]], interval: float = 3600,
+                 initial_delay: float = None):
+        super().__init__(name='covid-data-refresher', daemon=True)
+        self.data_source = data_source
+        self.data_store = data_store
+        self.on_update = on_update
+        self.interval = interval
+        self.initial_delay = interval if initial_delay is None else initial_delay
+        # fingerprint of the source version last read, also when it brought no new days
+        self.source_fingerprint = data_store.source_fingerprint
+        self._stop_event = threading.Event()
+
+    def run(self):
+        delay = self.initial_delay
+        while not self._stop_event.wait(delay):
+            delay = self.interval
+            try:
+                self.refresh()
+            except Exception:
+                # keep serving the current data and try again next interval
+                logger.exception('refreshing %s failed', self.data_source.kind)
+
+    def stop(self):
+        self._stop_event.set()
+
+    # check the source once, returns True when a new store was published
+    def refresh(self) -> bool:
+        source_fingerprint = self.data_source.fingerprint()
+        # servers without validators are always re-read, updateCovidDataStore skips the work when nothing changed
+        if source_fingerprint is not None and source_fingerprint == self.source_fingerprint:
+            return False
+        new_store = _run_blocking(updateCovidDataStore, self.data_store, self.data_source, source_fingerprint)
+        # a changed file without new days returns the same store, remember the version so it is not read again.
+        # when the download failed and the cached copy was read, its older fingerprint is kept and the next check retries
+        self.source_fingerprint = self.data_source.loaded_fingerprint(source_fingerprint)
+        if new_store is self.data_store:
+            return False
+        published = _run_blocking(self.on_update, new_store)
+        self.data_store = new_store if published is None else published
+        return True
+
+
+# func(*args) on a real OS thread when threading is monkey patched by gevent, so a long parse does not hold
+# the event loop; a plain call otherwise
+def _run_blocking(func: Callable, *args):
+    monkey = sys.modules.get('gevent.monkey')
+    if monkey is None or not monkey.is_module_patched('threading'):
+        return func(*args)
+    from gevent import get_hub
+    return get_hub().threadpool.apply(func, args)
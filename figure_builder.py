@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+# Lean plotly figures for the plot callback, serialized straight to JSON.
+# the figures look the same as the go.Figure versions but skip plotly's validation and encoder:
+# series come from the data store as NumPy arrays and are rounded once, the shared daily x axis is
+# sent as x0/dx instead of one date list per trace, and the template is encoded only once.
+import json
+from typing import Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+import plotly.io as pio
+
+from Covid19DataHandler import CovidDataStore, INDICATOR_DEFAULTS, normalizeIndicatorParams
+from lod import RESOLUTIONS, LOD_POINTS, lttb_indices, bucket_means
+from perf_metrics import span
+
+# decimals kept for every y value
+DECIMALS = 2
+DAY_MS = 24 * 60 * 60 * 1000
+
+CHART_TITLES = {
+    "Line": "每日確診病例數 Line",
+    "SMA": "簡單移動平均 Simple Moving Average",
+    "EMA": "指數移動平均 Exponential Moving Average",
+    "MACD": "指數平滑異同移動平均線 MACD",
+    "RSI": "相對強弱指數 RSI",
+}
+
+# comparison charts: every region's first series on one chart, or one small chart per region
+COMPARE_MODES = ("overlay", "grid")
+MAX_COMPARE_REGIONS = 10
+GRID_ROW_HEIGHT = 260
+
+RANGE_SELECTOR_BUTTONS = [
+    dict(count=7, label="7D", step="day", stepmode="backward"),
+    dict(count=14, label="14D", step="day", stepmode="backward"),
+    dict(count=1, label="1m", step="month", stepmode="backward"),
+    dict(count=3, label="3m", step="month", stepmode="backward"),
+    dict(count=6, label="6m", step="month", stepmode="backward"),
+    dict(count=1, label="1y", step="year", stepmode="backward"),
+    dict(count=1, label="YTD", step="year", stepmode="todate"),
+    dict(step="all"),
+]
+
+# the default template go.Figure would embed, encoded once
+_template_json = json.dumps(pio.templates[pio.templates.default].to_plotly_json(), separators=(',', ':'))
+
+
+# rounded values as a JSON-ready list, NaN becomes null
+def series_values(values: np.ndarray) -> List:
+    rounded = np.round(np.asarray(values, dtype=np.float64), DECIMALS)
+    return np.where(np.isnan(rounded), None, rounded).tolist()
+
+
+# series drawn on one chart: daily cases for Line, otherwise the indicator with the given params
+# (see Covid19DataHandler.INDICATOR_DEFAULTS)
+def chart_series(store: CovidDataStore, selected_country: str, chart_name: str, params: Dict = None) -> Dict[str, np.ndarray]:
+    if chart_name == "Line":
+        return {'daily_cases': store.getRegionArrays(selected_country)['daily_cases']}
+    if chart_name not in CHART_TITLES:
+        raise ValueError(f"unknown chart '{chart_name}'")
+    return store.getIndicator(selected_country, chart_name, params)
+
+
+# chart_series for several regions (resolved name -> series). indicators missing from the store's memo
+# are computed for all regions in one batch
+def comparison_series(store: CovidDataStore, regions: List[str], chart_name: str, params: Dict = None) -> Dict[str, Dict[str, np.ndarray]]:
+    if chart_name == "Line":
+        return {store.resolveRegion(region): {'daily_cases': store.getRegionArrays(region)['daily_cases']} for region in regions}
+    if chart_name not in CHART_TITLES:
+        raise ValueError(f"unknown chart '{chart_name}'")
+    return store.getIndicators(regions, chart_name, params)
+
+
+# traces of one chart without x, y is still a NumPy array
+def chart_traces(series: Dict[str, np.ndarray], chart_name: str) -> List[Dict]:
+    if chart_name == "Line":
+        return [{"y": series['daily_cases'], "fill": "tozeroy", "name": "daily_cases"}]
+    if chart_name in ("SMA", "EMA"):
+        # SMA_7 -> 7 Days
+        return [{"y": values, "name": f"{name.split('_')[1]} Days"} for name, values in series.items()]
+    if chart_name == "MACD":
+        return [
+            {"y": series['MACD'], "name": "MACD"},
+            {"y": series['MACDs'], "name": "Signal"},
+            {"y": series['MACDh'], "line": {"color": "royalblue", "width": 2, "dash": "dot"}, "name": "Hitogram"},
+        ]
+    if chart_name == "RSI":
+        return [{"y": values, "name": f"RSI {name.split('_')[1]} Day"} for name, values in series.items()]
+    raise ValueError(f"unknown chart '{chart_name}'")
+
+
+# x placement shared by every trace: x0/dx when the dates are consecutive days, else ISO date strings
+def x_axis_values(dates: pd.DatetimeIndex) -> Dict:
+    if len(dates) > 1 and (np.diff(dates.values) == np.timedelta64(1, 'D')).all():
+        return {"x0": dates[0].strftime('%Y-%m-%d'), "dx": DAY_MS}
+    return {"x": list(dates.strftime('%Y-%m-%d'))}
+
+
+# traces with x and rounded y at one of lod.RESOLUTIONS. day keeps every day on the shared x0/dx axis, week and
+# month plot the bucket means on the last day of each bucket, auto keeps the LTTB picks of every trace (all traces
+# picked in one batch) plus every day of window, the (first, stop) days of a zoomed view. daily_rows are the store
+# rows when the traces are daily cases, their means and picks are precomputed by the store
+def lod_traces(store: CovidDataStore, traces: List[Dict], resolution: str = "day", window: Tuple[int, int] = None,
+               daily_rows: List[int] = None) -> List[Dict]:
+    if resolution not in RESOLUTIONS:
+        raise ValueError(f"unknown resolution '{resolution}', expected one of {', '.join(RESOLUTIONS)}")
+    lod = store.lod
+    if resolution == "day" or (resolution == "auto" and len(store.dates) <= lod.points):
+        x_values = x_axis_values(store.dates)
+        for trace in traces:
+            trace.update(x_values, type="scatter", y=series_values(trace["y"]))
+        return traces
+    if resolution in ("week", "month"):
+        if daily_rows is not None:
+            means = lod.daily_means[resolution][daily_rows]
+        else:
+            means = [bucket_means(trace["y"], lod.starts[resolution]) for trace in traces]
+        x = lod.bucket_x[resolution].tolist()
+        for trace, values in zip(traces, means):
+            trace.update(x=x, type="scatter", y=series_values(values))
+        return traces
+    # picked from the rounded values, like the client side charts
+    rounded = np.round(np.stack([np.asarray(trace["y"], dtype=np.float64) for trace in traces]), DECIMALS)
+    picks = lod.daily_picks[daily_rows] if daily_rows is not None else lttb_indices(rounded, lod.points)
+    for trace, values, picked in zip(traces, rounded, picks):
+        if window is not None:
+            picked = np.union1d(picked, np.arange(*window))
+        trace.update(x=lod.x[picked].tolist(), type="scatter", y=series_values(values[picked]))
+    return traces
+
+
+# plotly keeps the zoom across redraws while uirevision stays the same: a chart redrawn for a zoomed window
+# (see lod_traces) stays zoomed, another region, chart or resolution starts unzoomed
+def ui_revision(regions: List[str], chart_name: str, resolution: str) -> str:
+    return json.dumps([list(regions), chart_name, resolution], ensure_ascii=False, separators=(',', ':'))
+
+
+# layout shared by every chart, the title and the x axis title are set per chart
+def base_layout(colors: Dict[str, str], uirevision: str = None) -> Dict:
+    return {
+        "height": 1000,
+        "uirevision": uirevision,
+        "showlegend": True,
+        "plot_bgcolor": colors["background"],
+        "paper_bgcolor": colors["background"],
+        "font": {"color": colors["text"]},
+        "xaxis": {
+            "type": "date",
+            "rangeslider": {"visible": True},
+            "rangeselector": {"activecolor": "blue", "bgcolor": colors["background"], "buttons": RANGE_SELECTOR_BUTTONS},
+        },
+    }
+
+
+def _figure_json(data: List[Dict], layout: Dict) -> str:
+    layout_json = json.dumps(layout, ensure_ascii=False, separators=(',', ':'))
+    # splice the pre-encoded template into the layout object
+    layout_json = layout_json[:-1] + ',"template":' + _template_json + '}'
+    return '{"data":' + json.dumps(data, allow_nan=False, separators=(',', ':')) + ',"layout":' + layout_json + '}'
+
+
+# resolution and window as in lod_traces
+def build_figure_json(store: CovidDataStore, selected_country: str, chart_name: str, colors: Dict[str, str], params: Dict = None,
+                      resolution: str = "day", window: Tuple[int, int] = None) -> str:
+    with span('extract'):
+        series = chart_series(store, selected_country, chart_name, params)
+    with span('figure_build'):
+        daily_rows = [store.region_index[store.resolveRegion(selected_country)]] if chart_name == "Line" else None
+        data = lod_traces(store, chart_traces(series, chart_name), resolution, window, daily_rows)
+        layout = base_layout(colors, ui_revision([selected_country], chart_name, resolution))
+        layout["title"] = {"text": CHART_TITLES[chart_name]}
+        if chart_name == "RSI":
+            layout["xaxis"]["title"] = {"text": "Dates"}
+    with span('serialize'):
+        return _figure_json(data, layout)
+
+
+# regions compared on one figure. overlay draws the first series of the chart (daily cases, the shortest
+# moving average, the MACD line or the shortest RSI) of every region; grid draws the full chart of each region
+# in its own row, all rows share the date axis.
+def build_comparison_json(store: CovidDataStore, regions: List[str], chart_name: str, colors: Dict[str, str],
+                          params: Dict = None, mode: str = "overlay", resolution: str = "day", window: Tuple[int, int] = None) -> str:
+    if mode not in COMPARE_MODES:
+        raise ValueError(f"unknown comparison mode '{mode}', expected one of {', '.join(COMPARE_MODES)}")
+    if not 1 <= len(regions) <= MAX_COMPARE_REGIONS:
+        raise ValueError(f'compare 1 to {MAX_COMPARE_REGIONS} regions')
+    with span('extract'):
+        series_by_region = comparison_series(store, regions, chart_name, params)
+    with span('figure_build'):
+        layout = base_layout(colors, ui_revision(regions, chart_name, resolution))
+        layout["title"] = {"text": CHART_TITLES[chart_name]}
+        data = []
+        rows = len(series_by_region)
+        for row, (region, series) in enumerate(series_by_region.items()):
+            traces = chart_traces(series, chart_name)
+            if mode == "overlay":
+                trace = {"y": traces[0]["y"], "name": region}
+                if chart_name != "Line":
+                    trace["legendgroup"] = traces[0]["name"]
+                traces = [trace]
+            else:
+                axis = "y" if row == 0 else f"y{row + 1}"
+                for trace in traces:
+                    trace.pop("fill", None)
+                    trace.update(name=f'{region} {trace["name"]}', legendgroup=region, yaxis=axis)
+                # rows from top to bottom with a small gap, the date axis sits under the last one
+                top = 1 - row / rows
+                layout["yaxis" if row == 0 else f"yaxis{row + 1}"] = {"domain": [max(top - 1 / rows + 0.02, 0), top]}
+                layout.setdefault("annotations", []).append({
+                    "text": region, "showarrow": False, "xref": "paper", "yref": "paper",
+                    "x": 0, "xanchor": "left", "y": top, "yanchor": "bottom",
+                })
+            data.extend(traces)
+        daily_rows = [store.region_index[region] for region in series_by_region] if chart_name == "Line" else None
+        data = lod_traces(store, data, resolution, window, daily_rows)
+        if mode == "grid":
+            layout["height"] = max(layout["height"], rows * GRID_ROW_HEIGHT + 200)
+            layout["xaxis"]["anchor"] = "y" if rows == 1 else f"y{rows}"
+    with span('serialize'):
+        return _figure_json(data, layout)
+
+
+# static part of the client side charts (assets/chart_switch.js), sent once with the page layout
+def chart_config(colors: Dict[str, str]) -> Dict:
+    layout = base_layout(colors)
+    layout["template"] = json.loads(_template_json)
+    return {"titles": CHART_TITLES, "decimals": DECIMALS, "lod_points": LOD_POINTS, "layout": layout}
+
+
+# everything the client needs to draw any chart of one region: daily cases, MACD and RSI with the chosen
+# parameters (indicator name -> params), the parameters themselves and the first day of every week/month bucket.
+# SMA and EMA are rolled in the browser from daily_cases, coarse resolutions are derived there as well
+def build_region_payload_json(store: CovidDataStore, selected_country: str, indicator_params: Dict[str, Dict] = None) -> str:
+    indicator_params = indicator_params or {}
+    params = {indicator: dict(normalizeIndicatorParams(indicator, indicator_params.get(indicator))) for indicator in INDICATOR_DEFAULTS}
+    with span('extract'):
+        series = chart_series(store, selected_country, "Line")
+        series.update(chart_series(store, selected_country, "MACD", params["MACD"]))
+        series.update(chart_series(store, selected_country, "RSI", params["RSI"]))
+    with span('serialize'):
+        payload = {"region": selected_country, "params": params,
+                   "buckets": {resolution: starts.tolist() for resolution, starts in store.lod.starts.items()}}
+        payload.update(x_axis_values(store.dates))
+        for name, values in series.items():
+            payload[name] = series_values(values)
+        return json.dumps(payload, ensure_ascii=False, allow_nan=False, separators=(',', ':'))
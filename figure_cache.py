@@ -0,0 +1,195 @@
+import os
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, Optional
+
+
+# one build in progress, shared by every caller waiting for it
+class _Flight:
+    __slots__ = ('done', 'value', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+# runs at most one build per key at a time: a caller asking for a key that is already being built waits
+# for that build and gets its result (or its exception) instead of building it again.
+# works with threads and with gevent's monkey patched locks alike.
+class SingleFlight:
+    def __init__(self):
+        self.coalesced = 0
+        self._flights: Dict[Hashable, _Flight] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: Hashable, build: Callable[[], str]) -> str:
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+            else:
+                self.coalesced += 1
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+        try:
+            flight.value = build()
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+        return flight.value
+
+
+# bounded LRU cache for serialized figure JSON.
+# entries belong to one data version. the version only moves forward through set_version(), called when a
+# refreshed store is published; a cache without a version takes the first one asked for. requests for any
+# other version (a callback still holding the store before a refresh) miss and their results are not cached.
+# with cache_dir set, entries are also written to disk so every gunicorn worker on the host shares them.
+# build_once coalesces concurrent misses of one key into a single build.
+class FigureCache:
+    def __init__(self, max_entries: int = 256, max_bytes: int = 64 * 1024 * 1024, cache_dir: Optional[str] = None, max_disk_bytes: int = 256 * 1024 * 1024,
+                 version: Hashable = None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self.max_disk_bytes = max_disk_bytes
+        self.version = version
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[Hashable, str]" = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self._flights = SingleFlight()
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def get(self, key: Hashable, version: Hashable = None) -> Optional[str]:
+        with self._lock:
+            if self.version is None:
+                self.version = version
+            if version != self.version:
+                self.misses += 1
+                return None
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+        value = self._read_disk(key, version)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            # the disk read ran unlocked, a newer version may have taken over meanwhile
+            if version == self.version:
+                self._insert(key, value)
+        return value
+
+    # a put for any other version than the current one comes from a build that started before the data
+    # changed and is dropped
+    def put(self, key: Hashable, value: str, version: Hashable = None):
+        with self._lock:
+            if version != self.version:
+                return
+            self._insert(key, value)
+        self._write_disk(key, version, value)
+
+    # value of key after a missed get: built by build() and cached, unless another caller is already
+    # building it (then its result is returned) or finished since the miss
+    def build_once(self, key: Hashable, build: Callable[[], str], version: Hashable = None) -> str:
+        def build_and_put():
+            with self._lock:
+                if version == self.version and key in self._entries:
+                    return self._entries[key]
+            value = build()
+            self.put(key, value, version)
+            return value
+        return self._flights.do((version, key), build_and_put)
+
+    # switch to the version of newly published data, everything cached for the old one is dropped
+    def set_version(self, version: Hashable):
+        with self._lock:
+            if version != self.version:
+                self._entries.clear()
+                self._size = 0
+                self.version = version
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'coalesced': self._flights.coalesced, 'entries': len(self._entries), 'bytes': self._size}
+
+    # must be called with the lock held
+    def _insert(self, key: Hashable, value: str):
+        if key in self._entries:
+            self._size -= len(self._entries.pop(key))
+        if len(value) > self.max_bytes:
+            return
+        self._entries[key] = value
+        self._size += len(value)
+        while len(self._entries) > self.max_entries or self._size > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._size -= len(evicted)
+            self.evictions += 1
+
+    def _disk_path(self, key: Hashable, version: Hashable) -> str:
+        digest = hashlib.sha1(repr((version, key)).encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, digest + '.json')
+
+    def _read_disk(self, key: Hashable, version: Hashable) -> Optional[str]:
+        if self.cache_dir is None:
+            return None
+        try:
+            with open(self._disk_path(key, version), 'r', encoding='utf-8') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def _write_disk(self, key: Hashable, version: Hashable, value: str):
+        if self.cache_dir is None:
+            return
+        # write to a temp file and rename so other workers never read a partial file
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write(value)
+            os.replace(tmp_path, self._disk_path(key, version))
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+        self._prune_disk()
+
+    # drop the least recently written files once the directory grows past max_disk_bytes
+    def _prune_disk(self):
+        try:
+            files = [e for e in os.scandir(self.cache_dir) if e.name.endswith('.json')]
+            stats = [(e.stat().st_mtime, e.stat().st_size, e.path) for e in files]
+        except OSError:
+            return
+        total = sum(size for _, size, _ in stats)
+        for _, size, path in sorted(stats):
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
@@ -0,0 +1,130 @@
+from typing import Dict, Optional, Tuple, Type
+
+import numpy as np
+import pandas as pd
+
+
+# chart resolutions: auto keeps at most LOD_POINTS shape-preserving points per trace (LTTB) over the whole range
+# and every day of a zoomed window, day keeps every day, week and month plot the mean of each bucket
+RESOLUTIONS = ('auto', 'day', 'week', 'month')
+LOD_POINTS = 300
+# up to this many rows lttb_indices loops over python floats instead of numpy arrays
+SCALAR_ROWS = 8
+# days per week bucket, the last bucket ends on the latest day
+WEEK_DAYS = 7
+
+
+# indices of the points kept by Largest-Triangle-Three-Buckets for every row of values (rows x days), points
+# per row including the first and last day. the buckets are walked in order (each pick depends on the previous
+# one) but every row of a big batch is handled at once. NaN counts as 0 while picking.
+# ref:https://skemman.is/bitstream/1946/15343/3/SS_MSthesis.pdf
+def lttb_indices(values: np.ndarray, points: int = LOD_POINTS) -> np.ndarray:
+    values = np.nan_to_num(np.atleast_2d(np.asarray(values, dtype=np.float64)))
+    rows, days = values.shape
+    if points >= days or points < 3:
+        return np.broadcast_to(np.arange(days), (rows, days))
+    # bucket b holds days starts[b]:starts[b+1]
+    every = (days - 2) / (points - 2)
+    starts = (np.arange(points - 1) * every).astype(np.int64) + 1
+    starts[-1] = days - 1
+    # mean of the next bucket, the last day for the last one
+    next_starts = np.append(starts[1:], days)
+    next_x = (next_starts[:-1] + next_starts[1:] - 1) / 2
+    sums = np.add.reduceat(values, next_starts[:-1], axis=1)
+    next_y = sums / (next_starts[1:] - next_starts[:-1])
+    selected = np.empty((rows, points), dtype=np.int64)
+    selected[:, 0] = 0
+    selected[:, -1] = days - 1
+    if rows <= SCALAR_ROWS:
+        # a plain loop per row, numpy's per call overhead would dominate. same arithmetic as below
+        bounds, next_x = starts.tolist(), next_x.tolist()
+        for row in range(rows):
+            row_values, row_next_y = values[row].tolist(), next_y[row].tolist()
+            previous = 0
+            for bucket in range(points - 2):
+                previous_y = row_values[previous]
+                best = -1.0
+                for day in range(bounds[bucket], bounds[bucket + 1]):
+                    area = abs((previous - next_x[bucket]) * (row_values[day] - previous_y)
+                               - (previous - day) * (row_next_y[bucket] - previous_y))
+                    if area > best:
+                        best, pick = area, day
+                previous = pick
+                selected[row, bucket + 1] = pick
+        return selected
+    # candidates of every bucket padded to the widest one
+    widths = np.diff(starts)
+    candidates_x = starts[:-1, None] + np.arange(widths.max())[None, :]
+    padding = candidates_x >= starts[1:, None]
+    candidates_x = np.minimum(candidates_x, days - 1)
+    candidates_y = values[:, candidates_x]
+    all_rows = np.arange(rows)
+    previous = np.zeros(rows, dtype=np.int64)
+    for bucket in range(points - 2):
+        previous_y = values[all_rows, previous]
+        area = np.abs((previous - next_x[bucket])[:, None] * (candidates_y[:, bucket] - previous_y[:, None])
+                      - (previous[:, None] - candidates_x[bucket]) * (next_y[:, bucket] - previous_y)[:, None])
+        area[:, padding[bucket]] = -1
+        previous = candidates_x[bucket, area.argmax(axis=1)]
+        selected[:, bucket + 1] = previous
+    return selected
+
+
+# first day of every bucket of the resolution: weeks of WEEK_DAYS days counted back from the last day
+# (the first one may be shorter) or calendar months
+def bucket_starts(dates: Type[pd.DatetimeIndex], resolution: str) -> np.ndarray:
+    days = len(dates)
+    if days == 0:
+        return np.zeros(0, dtype=np.int64)
+    if resolution == 'week':
+        return np.unique(np.concatenate(([0], np.arange(days % WEEK_DAYS - WEEK_DAYS, days, WEEK_DAYS))).clip(0))
+    if resolution == 'month':
+        months = dates.year * 12 + dates.month
+        return np.concatenate(([0], np.flatnonzero(np.diff(months)) + 1))
+    raise ValueError(f"no buckets for resolution '{resolution}'")
+
+
+# mean of every bucket along the last axis, NaN values are left out and an all NaN bucket is NaN
+def bucket_means(values: np.ndarray, starts: np.ndarray) -> np.ndarray:
+    values = np.asarray(values, dtype=np.float64)
+    known = ~np.isnan(values)
+    sums = np.add.reduceat(np.where(known, values, 0), starts, axis=-1)
+    counts = np.add.reduceat(known, starts, axis=-1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(counts > 0, sums / counts, np.nan)
+
+
+# the days of a plotly relayoutData x range as (first, stop) positions, one day of margin on both sides.
+# None when the range was reset (autorange), the event is not about the x axis or a side of the range is missing
+def window_from_relayout(relayout_data: Dict, dates: Type[pd.DatetimeIndex]) -> Optional[Tuple[int, int]]:
+    if not relayout_data or relayout_data.get('xaxis.autorange') or not len(dates):
+        return None
+    x_range = relayout_data.get('xaxis.range')
+    if x_range is None and 'xaxis.range[0]' in relayout_data:
+        x_range = [relayout_data['xaxis.range[0]'], relayout_data.get('xaxis.range[1]')]
+    try:
+        left, right = pd.Timestamp(x_range[0]), pd.Timestamp(x_range[1])
+    except (TypeError, ValueError, IndexError):
+        return None
+    # pd.Timestamp(None) is NaT, not an error
+    if left is pd.NaT or right is pd.NaT:
+        return None
+    first = max(int(dates.searchsorted(left)) - 1, 0)
+    stop = min(int(dates.searchsorted(right, side='right')) + 1, len(dates))
+    return (first, stop) if first < stop else None
+
+
+# what a data store keeps for fast coarse charts: the buckets of each resolution with the bucket means of
+# daily cases, and the LTTB picks of daily cases, for every region
+class LevelOfDetail:
+    def __init__(self, dates: Type[pd.DatetimeIndex], daily_cases: np.ndarray, points: int = LOD_POINTS):
+        self.points = points
+        # x of every day as epoch milliseconds, how plotly reads numbers on a date axis
+        self.x = np.asarray(dates.values, dtype='datetime64[ms]').astype(np.int64)
+        self.starts = {resolution: bucket_starts(dates, resolution) for resolution in ('week', 'month')}
+        # a bucket is plotted on its last day
+        self.bucket_x = {resolution: self.x[np.append(starts[1:], len(dates)) - 1] if len(starts) else self.x[:0]
+                         for resolution, starts in self.starts.items()}
+        self.daily_means = {resolution: bucket_means(daily_cases, starts) if len(starts) else np.zeros((len(daily_cases), 0))
+                            for resolution, starts in self.starts.items()}
+        self.daily_picks = lttb_indices(daily_cases, points) if len(daily_cases) else np.zeros((0, 0), dtype=np.int64)
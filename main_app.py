@@ -1,26 +1,105 @@
 # -*- coding: utf-8 -*-
+import os
+import json
+
 import dash
 import dash_core_components as dcc
 import dash_html_components as html
-from dash.dependencies import Input, Output, State
+import dash_table
+from dash.dependencies import Input, Output, State, ClientsideFunction
+from dash.exceptions import PreventUpdate, MissingCallbackContextException
 import dash_bootstrap_components as dbc
-import plotly.graph_objs as go
-import pandas as pd
+from flask import request
+from flask_compress import Compress
 
-from Covid19DataHandler import getCovidDataFrame, getCountryList
+from Covid19DataHandler import loadCovidDataStore, shareCovidDataStore, normalizeIndicatorParams, DATASETS, DEFAULT_DATASET, JHU_TIME_SERIES_URL, INDICATOR_DEFAULTS
+from figure_builder import build_figure_json, build_comparison_json, build_region_payload_json, chart_config, CHART_TITLES, MAX_COMPARE_REGIONS
+from figure_cache import FigureCache
+from data_refresher import DataRefresher
+from data_loader import open_data_source, get_load_metrics
+from screener import SCREENER_COLUMNS, SCREENER_SCOPES
+from lod import window_from_relayout
+from data_quality import QualityPolicy, QUALITY_FLAGS
+import perf_metrics
 
 
 # define style color
 colors = {"background": "#000000", "text": "#ffFFFF"}
 external_stylesheets = [dbc.themes.SLATE]
 
-# load date from Johns Hopkins University repository
-# data_src = 'time_series_covid19_confirmed_global.csv'
-data_src = 'https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/csse_covid_19_data/csse_covid_19_time_series/time_series_covid19_confirmed_global.csv'
-raw_df = pd.read_csv(data_src, sep=',')
+# load date from Johns Hopkins University repository. DATASETS selects the time series to serve
+# (comma separated keys of Covid19DataHandler.DATASETS), only the global confirmed cases by default:
+# every listed dataset is parsed and refreshed from startup on, and the US county series are large
+dataset_names = [name for name in os.environ.get('DATASETS', DEFAULT_DATASET).split(',') if name in DATASETS]
+if DEFAULT_DATASET not in dataset_names:
+    dataset_names.insert(0, DEFAULT_DATASET)
+
+# downloads are cached in DATA_CACHE_DIR and reused when the network is down.
+# DATA_FIXTURE_DIR serves the csv files from a local directory instead (offline tests)
+data_sources = {
+    name: open_data_source(JHU_TIME_SERIES_URL + DATASETS[name]['file_name'],
+                           cache_dir=os.environ.get('DATA_CACHE_DIR', 'data_cache'),
+                           fixture_dir=os.environ.get('DATA_FIXTURE_DIR'))
+    for name in dataset_names
+}
+
+# parse all regions once into a (regions x days) matrix per dataset. the parsed data is kept as a memory-mapped
+# snapshot in DATA_SNAPSHOT_DIR, so later starts and other workers skip the csv while the source is unchanged
+snapshot_dir = os.environ.get('DATA_SNAPSHOT_DIR', 'data_snapshot')
+
+# country totals and WHO regions are added to every store as extra regions. REGION_GROUPS_FILE adds user groups:
+# a json file of dataset -> {group name: [member regions]}, e.g. {"confirmed_global": {"Nordics": ["Denmark", "Finland"]}}
+custom_groups = {}
+if os.environ.get('REGION_GROUPS_FILE'):
+    with open(os.environ['REGION_GROUPS_FILE'], 'r', encoding='utf-8') as f:
+        custom_groups = json.load(f)
+
+# DATA_QUALITY_POLICY: json of data_quality.QUALITY_DEFAULTS parameters, how daily cases are derived from the
+# accumulated counts, e.g. {"negatives": "clamp", "gaps": "keep"} for the raw differences with negatives as 0
+quality_policy = QualityPolicy(**json.loads(os.environ.get('DATA_QUALITY_POLICY') or '{}'))
+
+# with refreshing on, an existing snapshot is served right away and the refresher checks the source in the
+# background, so a slow or unreachable server does not hold up the start with a HEAD request per dataset
+data_refresh_interval = float(os.environ.get('DATA_REFRESH_INTERVAL', 3600))
+data_stores = {name: loadCovidDataStore(data_sources[name], os.path.join(snapshot_dir, name), name, custom_groups.get(name), quality_policy,
+                                        revalidate=data_refresh_interval <= 0)
+               for name in dataset_names}
+
+# poll the sources in the background and swap in refreshed data, set DATA_REFRESH_INTERVAL=0 to disable.
+# the refreshed store is served memory-mapped from its snapshot, the same pages for every worker
+def publish_data_store(new_store):
+    new_store = shareCovidDataStore(new_store, os.path.join(snapshot_dir, new_store.dataset))
+    # a single reference assignment, callbacks keep the store they started with
+    data_stores[new_store.dataset] = new_store
+    # the figure cache moves on to the new data, callbacks still holding the old store miss without clearing it
+    figure_caches[new_store.dataset].set_version(new_store.fingerprint)
+    return new_store
+
+
+if data_refresh_interval > 0:
+    for name in dataset_names:
+        DataRefresher(data_sources[name], data_stores[name], publish_data_store, interval=data_refresh_interval, initial_delay=0).start()
+
+# cache of serialized figures per dataset, set FIGURE_CACHE_DIR to share them between gunicorn workers on one host.
+# concurrent requests for a figure that is not cached yet wait for one build (FigureCache.build_once), so
+# threaded or gevent workers (gunicorn -k gthread --threads N / -k gevent) build a popular figure once
+figure_cache_dir = os.environ.get('FIGURE_CACHE_DIR')
+figure_caches = {
+    name: FigureCache(max_entries=256, max_bytes=64 * 1024 * 1024,
+                      cache_dir=os.path.join(figure_cache_dir, name) if figure_cache_dir else None,
+                      version=data_stores[name].fingerprint)
+    for name in dataset_names
+}
+
+# country dropdown options sent per search
+COUNTRY_OPTIONS_LIMIT = 50
+# screener table rows per page, and the most rows /screener returns at once
+SCREENER_PAGE_SIZE = 20
+SCREENER_MAX_LIMIT = 1000
 
-# get country list
-country_list = getCountryList(df=raw_df.copy(deep=True))
+# with CLIENTSIDE_CHARTS=1 (default) selecting a country sends one payload with the region's series and indicators,
+# the chart type is switched in the browser (assets/chart_switch.js). 0 builds every chart on the server
+clientside_charts = os.environ.get('CLIENTSIDE_CHARTS', '1') != '0'
 
 # add meta tags for google search. ref:https://github.com/plotly/dash/pull/286
 my_meta_tags = [
@@ -28,10 +107,136 @@ my_meta_tags = [
 ]
 
 # adding css
-app = dash.Dash(__name__, external_stylesheets=external_stylesheets, meta_tags=my_meta_tags)
+app = dash.Dash(__name__, external_stylesheets=external_stylesheets, meta_tags=my_meta_tags, compress=False)
 app.title = 'COVID-19確診病例技術分析 Technical Analysis of COVID-19 Confirm Case'
 server = app.server  # this line is necessary for deploying on heroku
 
+# compress callback responses and assets with brotli (gzip for older clients). dash alone only
+# enables gzip; brotli at level 5 is both smaller and fast enough per request
+server.config["COMPRESS_ALGORITHM"] = ["br", "gzip"]
+server.config["COMPRESS_BR_LEVEL"] = 5
+server.config["COMPRESS_MIMETYPES"] = ["application/json", "application/javascript", "text/css", "text/html", "text/plain"]
+Compress(server)
+
+
+# figure cache counters for monitoring
+@server.route('/cache-stats')
+def cache_stats():
+    return {name: cache.stats() for name, cache in figure_caches.items()}
+
+
+# csv load timings per source kind
+@server.route('/load-stats')
+def load_stats():
+    return get_load_metrics()
+
+
+# quality pass of a dataset: the policy and the regions with each flag, with region=<name> the flagged days of
+# that region: /data-quality?dataset=confirmed_global&region=France
+@server.route('/data-quality')
+def data_quality():
+    dataset = request.args.get('dataset', DEFAULT_DATASET)
+    if dataset not in data_stores:
+        return {'error': f"unknown dataset '{dataset}'"}, 404
+    store = data_stores[dataset]
+    result = {'dataset': dataset, 'policy': store.quality.policy.to_dict(), 'regions': store.quality.counts()}
+    if request.args.get('region'):
+        try:
+            region = store.resolveRegion(request.args['region'])
+        except KeyError:
+            return {'error': f"unknown region '{request.args['region']}'"}, 404
+        flags = store.quality.flags[store.region_index[region]]
+        result['region'] = region
+        result['days'] = [{'date': store.dates[day].strftime('%Y-%m-%d'), 'daily_cases': float(store.daily_cases[store.region_index[region], day]),
+                           'flags': [name for name, flag in QUALITY_FLAGS.items() if flags[day] & flag]}
+                          for day in flags.nonzero()[0]]
+    return result
+
+
+# region names matching q (exact, alias, prefix, then fuzzy): /region-search?q=taiw&dataset=confirmed_global&limit=10
+@server.route('/region-search')
+def region_search():
+    dataset = request.args.get('dataset', DEFAULT_DATASET)
+    if dataset not in data_stores:
+        return {'error': f"unknown dataset '{dataset}'"}, 404
+    limit = min(request.args.get('limit', COUNTRY_OPTIONS_LIMIT, type=int), 1000)
+    return {'dataset': dataset, 'regions': data_stores[dataset].region_search.search(request.args.get('q', ''), limit=limit)}
+
+
+# one page of regions ranked by a column of the latest-day snapshot: (rows matched, records of the page)
+def screener_page(dataset, by, descending=True, scope='all', min_cases_7d=0, offset=0, limit=SCREENER_PAGE_SIZE):
+    latest = data_stores[dataset].latest
+    rows = latest.rank(by, descending, scope, min_cases_7d)
+    return len(rows), latest.records(rows[offset:offset + limit])
+
+
+# regions ranked by a screener column: /screener?by=RSI_6&order=desc&scope=regions&min_cases=100&limit=20&offset=0
+# by is one of screener.SCREENER_COLUMNS, scope one of all, regions (no aggregates), aggregates
+@server.route('/screener')
+def screener():
+    dataset = request.args.get('dataset', DEFAULT_DATASET)
+    if dataset not in data_stores:
+        return {'error': f"unknown dataset '{dataset}'"}, 404
+    by = request.args.get('by', 'RSI_6')
+    order = request.args.get('order', 'desc')
+    if order not in ('asc', 'desc'):
+        return {'error': f"unknown order '{order}', expected asc or desc"}, 400
+    limit = min(max(request.args.get('limit', SCREENER_PAGE_SIZE, type=int), 0), SCREENER_MAX_LIMIT)
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    try:
+        total, records = screener_page(dataset, by, order == 'desc', request.args.get('scope', 'all'),
+                                       request.args.get('min_cases', 0, type=float), offset, limit)
+    except ValueError as e:
+        return {'error': str(e)}, 400
+    date = data_stores[dataset].latest.date
+    return {'dataset': dataset, 'date': date.strftime('%Y-%m-%d') if date is not None else None, 'by': by, 'order': order,
+            'total': total, 'offset': offset, 'rows': records}
+
+
+# set PROFILE_DIR to profile a PROFILE_SAMPLE_RATE share of plot requests and keep the PROFILE_SLOWEST slowest
+slow_request_profiler = None
+if os.environ.get('PROFILE_DIR'):
+    slow_request_profiler = perf_metrics.SlowRequestProfiler(os.environ['PROFILE_DIR'],
+                                                             slowest=int(os.environ.get('PROFILE_SLOWEST', 10)),
+                                                             sample_rate=float(os.environ.get('PROFILE_SAMPLE_RATE', 0.1)))
+
+
+# /metrics names of the figure cache and data load stats. monotonic values are counters named *_total,
+# the rest are gauges
+FIGURE_CACHE_COUNTERS = {'hits': 'Figure cache hits', 'misses': 'Figure cache misses',
+                         'evictions': 'Figures evicted from the cache', 'coalesced': 'Figure builds coalesced into a running build'}
+FIGURE_CACHE_GAUGES = {'entries': 'Figures in the cache', 'bytes': 'Bytes of the cached figures'}
+DATA_LOAD_COUNTERS = {'loads': ('covid_data_loads_total', 'Data source loads'),
+                      'failures': ('covid_data_load_failures_total', 'Failed data source loads'),
+                      'offline_loads': ('covid_data_offline_loads_total', 'Data source loads served from the offline cache'),
+                      'total_seconds': ('covid_data_load_seconds_total', 'Seconds spent loading data sources')}
+
+
+# latency histograms per chart type and stage, figure cache and data load counters in Prometheus text format
+@server.route('/metrics')
+def metrics():
+    cache_stats = {name: cache.stats() for name, cache in figure_caches.items()}
+    load_metrics = get_load_metrics()
+    extra = {}
+    for counter, help_text in FIGURE_CACHE_COUNTERS.items():
+        extra[f'covid_figure_cache_{counter}_total'] = ('counter', help_text, {(('dataset', name),): stats[counter]
+                                                                                for name, stats in cache_stats.items()})
+    for gauge, help_text in FIGURE_CACHE_GAUGES.items():
+        extra[f'covid_figure_cache_{gauge}'] = ('gauge', help_text, {(('dataset', name),): stats[gauge]
+                                                                     for name, stats in cache_stats.items()})
+    for counter, (metric, help_text) in DATA_LOAD_COUNTERS.items():
+        extra[metric] = ('counter', help_text, {(('source', kind),): values[counter] for kind, values in load_metrics.items()})
+    extra.update({
+        'covid_data_load_last_seconds': ('gauge', 'Seconds the last data source load took',
+                                         {(('source', kind),): values['last_seconds'] for kind, values in load_metrics.items()}),
+        'covid_dataset_days': ('gauge', 'Days in the loaded dataset',
+                               {(('dataset', name),): len(store.dates) for name, store in data_stores.items()}),
+        'covid_data_quality_regions': ('gauge', 'Regions with each data quality flag on any day',
+                                       {(('dataset', name), ('flag', flag)): regions
+                                        for name, store in data_stores.items() for flag, regions in store.quality.counts().items()}),
+    })
+    return perf_metrics.render_prometheus(extra), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
 app.layout = html.Div(
     style={"backgroundColor": colors["background"]},
     children=[
@@ -69,21 +274,28 @@ app.layout = html.Div(
             [  # Dropdown Div
                 dbc.Row(
                     [
-                        dbc.Col(  # Country
+                        dbc.Col(  # Dataset
                             dcc.Dropdown(
-                                id="selected-country",
+                                id="dataset",
                                 options=[
-                                    {
-                                        "label": str(country_list[i]),
-                                        "value": str(country_list[i]),
-                                    }
-                                    for i in range(len(country_list))
+                                    {"label": DATASETS[name]["label"], "value": name}
+                                    for name in dataset_names
                                 ],
+                                value=DEFAULT_DATASET,
+                                clearable=False,
+                                style={"color": "#000000"},
+                            ),
+                            width={"size": 2, "offset": 1},
+                        ),
+                        dbc.Col(  # Country
+                            dcc.Dropdown(  # options follow the typed text, see country_options
+                                id="selected-country",
+                                options=[{"label": "Taiwan*", "value": "Taiwan*"}],
                                 searchable=True,
                                 value='Taiwan*',
                                 placeholder="輸入國家 Enter Country",
                             ),
-                            width={"size": 3, "offset": 3},
+                            width={"size": 3},
                         ),
                         dbc.Col(  # Graph type
                             dcc.Dropdown(
@@ -114,7 +326,62 @@ app.layout = html.Div(
                             width={"size": 2},
                         ),
                     ]
-                )
+                ),
+                html.Br(),
+                dbc.Row(
+                    [
+                        dbc.Col(  # indicator periods, comma separated
+                            dbc.InputGroup(
+                                [
+                                    dbc.InputGroupAddon(label, addon_type="prepend"),
+                                    dbc.Input(id=f"{indicator.lower()}-periods", type="text", debounce=True,
+                                              value=", ".join(str(period) for period in INDICATOR_DEFAULTS[indicator]["periods"])),
+                                ],
+                                size="sm",
+                            ),
+                            width={"size": 2},
+                        )
+                        for indicator, label in [("SMA", "SMA"), ("EMA", "EMA"), ("MACD", "MACD"), ("RSI", "RSI")]
+                    ]
+                    + [
+                        dbc.Col(  # RSI smoothing
+                            dcc.Dropdown(
+                                id="rsi-smoothing",
+                                options=[
+                                    {"label": "RSI 簡單平均 Simple", "value": "sma"},
+                                    {"label": "RSI Wilder 平滑 Wilder", "value": "wilder"},
+                                ],
+                                value=INDICATOR_DEFAULTS["RSI"]["smoothing"],
+                                clearable=False,
+                                style={"color": "#000000"},
+                            ),
+                            width={"size": 2},
+                        ),
+                        dbc.Col(  # resolution of long ranges, auto sends full detail only for the zoomed window
+                            dcc.Dropdown(
+                                id="resolution",
+                                options=[
+                                    {"label": "自動解析度 Auto detail", "value": "auto"},
+                                    {"label": "每日 Daily", "value": "day"},
+                                    {"label": "每週 Weekly", "value": "week"},
+                                    {"label": "每月 Monthly", "value": "month"},
+                                ],
+                                value="auto",
+                                clearable=False,
+                                style={"color": "#000000"},
+                            ),
+                            width={"size": 2},
+                        ),
+                    ]
+                ),
+                dbc.Row(
+                    [
+                        dbc.Col(  # what is wrong with the selected chart's inputs, see indicator_error
+                            html.Div(id="indicator-error", style={"color": "#ff6666"}),
+                            width={"size": 10, "offset": 1},
+                        )
+                    ]
+                ),
             ]
         ),
         html.Div(
@@ -131,7 +398,106 @@ app.layout = html.Div(
                             ),
                         )
                     ]
-                )
+                ),
+                # series of the selected region and the static chart layout for client side charts
+                dcc.Store(id="region-payload"),
+                dcc.Store(id="chart-config", data=chart_config(colors) if clientside_charts else None),
+            ]
+        ),
+        html.Div(
+            [  # comparison of several regions with the selected chart type
+                dbc.Row(
+                    [
+                        dbc.Col(
+                            dcc.Dropdown(  # options follow the typed text, see compare_options
+                                id="compare-regions",
+                                options=[],
+                                value=[],
+                                multi=True,
+                                searchable=True,
+                                placeholder=f"比較地區 Compare regions (up to {MAX_COMPARE_REGIONS})",
+                            ),
+                            width={"size": 7, "offset": 1},
+                        ),
+                        dbc.Col(
+                            dcc.RadioItems(
+                                id="compare-mode",
+                                options=[
+                                    {"label": " 疊加 Overlay ", "value": "overlay"},
+                                    {"label": " 分圖 Small multiples", "value": "grid"},
+                                ],
+                                value="overlay",
+                                style={"color": colors["text"]},
+                            ),
+                            width={"size": 3},
+                        ),
+                    ]
+                ),
+                dbc.Row(
+                    [
+                        dbc.Col(
+                            dcc.Graph(
+                                id="compare-graph",
+                                config={
+                                    "displaylogo": False,
+                                    "modeBarButtonsToRemove": ["pan2d", "lasso2d"],
+                                },
+                            ),
+                        )
+                    ]
+                ),
+            ]
+        ),
+        html.Br(),
+        html.Div(
+            [  # screener: every region ranked by its latest indicator values, sorted and paged on the server
+                dbc.Row(
+                    [
+                        dbc.Col(
+                            dcc.RadioItems(
+                                id="screener-scope",
+                                options=[
+                                    {"label": " 全部 All ", "value": "all"},
+                                    {"label": " 地區 Regions ", "value": "regions"},
+                                    {"label": " 合計 Aggregates", "value": "aggregates"},
+                                ],
+                                value="regions",
+                                style={"color": colors["text"]},
+                            ),
+                            width={"size": 4, "offset": 1},
+                        ),
+                        dbc.Col(
+                            dbc.InputGroup(
+                                [
+                                    dbc.InputGroupAddon("7日病例至少 Min 7D cases", addon_type="prepend"),
+                                    dbc.Input(id="screener-min-cases", type="number", min=0, value=100, debounce=True),
+                                ],
+                                size="sm",
+                            ),
+                            width={"size": 3},
+                        ),
+                    ]
+                ),
+                dbc.Row(
+                    [
+                        dbc.Col(
+                            dash_table.DataTable(
+                                id="screener-table",
+                                columns=[{"name": "地區 Region", "id": "region"}]
+                                + [{"name": label, "id": column, "type": "numeric"} for column, label in SCREENER_COLUMNS.items()],
+                                sort_action="custom",
+                                sort_mode="single",
+                                sort_by=[{"column_id": "RSI_6", "direction": "desc"}],
+                                page_action="custom",
+                                page_current=0,
+                                page_size=SCREENER_PAGE_SIZE,
+                                style_header={"backgroundColor": "#303030", "color": colors["text"]},
+                                style_cell={"backgroundColor": colors["background"], "color": colors["text"]},
+                            ),
+                            width={"size": 10, "offset": 1},
+                        )
+                    ]
+                ),
             ]
         ),
         dcc.Markdown('''
@@ -142,237 +508,260 @@ app.layout = html.Div(
     ],
 )
 
-# Callback main graph
+# Callback country options matching the typed text. only the matches and the selected country are sent,
+# so the layout and each update stay small however many regions the dataset has
 @app.callback(
-    Output("graph", "figure"),
-    Input("submit-button-state", "n_clicks"),
-    State("selected-country", "value"),
-    State("chart", "value")
+    Output("selected-country", "options"),
+    Output("selected-country", "value"),
+    Input("dataset", "value"),
+    Input("selected-country", "search_value"),
+    State("selected-country", "value")
+)
+def country_options(dataset, search_value, selected_country):
+    store = data_stores[dataset]
+    try:
+        selected_country = store.resolveRegion(selected_country)
+    except KeyError:
+        selected_country = store.region_search.lookup('Taiwan*') or (store.regions[0] if store.regions else None)
+    regions = store.region_search.search(search_value, limit=COUNTRY_OPTIONS_LIMIT) if search_value else []
+    if selected_country is not None and selected_country not in regions:
+        regions.append(selected_country)
+    return [{"label": region, "value": region} for region in regions], selected_country
+
+
+# Callback comparison region options matching the typed text, plus the regions already picked
+@app.callback(
+    Output("compare-regions", "options"),
+    Output("compare-regions", "value"),
+    Input("dataset", "value"),
+    Input("compare-regions", "search_value"),
+    State("compare-regions", "value")
 )
-def graph_generator(n_clicks, selected_country, chart_name):
+def compare_options(dataset, search_value, compare_regions):
+    store = data_stores[dataset]
+    selected = []
+    for region in compare_regions or []:
+        region = store.region_search.lookup(region)
+        if region is not None and region not in selected:
+            selected.append(region)
+    selected = selected[:MAX_COMPARE_REGIONS]
+    regions = store.region_search.search(search_value, limit=COUNTRY_OPTIONS_LIMIT) if search_value else []
+    regions += [region for region in selected if region not in regions]
+    return [{"label": region, "value": region} for region in regions], selected
+
+
+# indicator parameters from the period inputs ("7, 30, 90"), empty inputs keep the defaults.
+# returns (indicator -> normalized parameters, indicator -> error message): an input normalizeIndicatorParams
+# rejects only fails its own indicator, the others are still usable
+def indicator_params_from_inputs(sma_periods, ema_periods, macd_periods, rsi_periods, rsi_smoothing):
+    params = {}
+    errors = {}
+    for indicator, text in [("SMA", sma_periods), ("EMA", ema_periods), ("MACD", macd_periods), ("RSI", rsi_periods)]:
+        values = {"smoothing": rsi_smoothing or INDICATOR_DEFAULTS["RSI"]["smoothing"]} if indicator == "RSI" else {}
+        try:
+            periods = [int(period) for period in str(text or "").replace(",", " ").split()]
+        except ValueError:
+            errors[indicator] = f"{indicator} periods must be whole numbers separated by commas, got '{text}'"
+            continue
+        if periods:
+            values["periods"] = periods
+        try:
+            params[indicator] = normalizeIndicatorParams(indicator, values)
+        except ValueError as e:
+            errors[indicator] = str(e)
+    return params, errors
+
+
+# True when the running callback was fired by prop_id ("graph.relayoutData") alone.
+# False outside a dash callback (direct calls from benchmark.py)
+def triggered_only_by(prop_id):
+    try:
+        triggered = dash.callback_context.triggered
+    except MissingCallbackContextException:
+        return False
+    return bool(triggered) and all(trigger["prop_id"] == prop_id for trigger in triggered)
+
+
+# the zoomed window of a chart at the resolution. a zoom (relayoutData of graph_id) only changes an auto resolution
+# chart and only when the x range moved or was reset, for any other relayout event the drawn figure stays.
+# plotly keeps the zoom itself, see figure_builder.base_layout
+def zoom_window(graph_id, resolution, relayout_data, dates):
+    window = window_from_relayout(relayout_data, dates) if resolution == "auto" else None
+    if triggered_only_by(f"{graph_id}.relayoutData"):
+        if resolution != "auto" or (window is None and not (relayout_data or {}).get("xaxis.autorange")):
+            raise PreventUpdate
+    return window
+
+
+# Callback main graph, built on the server. with resolution auto long ranges are sent as LTTB picks and zooming
+# (relayout_data) redraws the chart with every day of the visible window
+def graph_generator(n_clicks, resolution, relayout_data, dataset, selected_country, chart_name, sma_periods=None,
+                    ema_periods=None, macd_periods=None, rsi_periods=None, rsi_smoothing=None):
 
     if n_clicks >= 1:  # Checking for user to click submit button
 
-        # processing data
-        df = getCovidDataFrame(raw_dataframe=raw_df.copy(deep=True), country=selected_country, op_mode=1)
-
-        # selecting graph type
-        # Line plot
-        if chart_name == "Line":
-            fig = go.Figure(
-                data=[
-                    go.Scatter(
-                        x=list(df.date), y=list(df.daily_cases), fill="tozeroy", name="daily_cases"
-                    )
-                ],
-                layout={
-                    "height": 1000,
-                    "title": "每日確診病例數 Line",
-                    "showlegend": True,
-                    "plot_bgcolor": colors["background"],
-                    "paper_bgcolor": colors["background"],
-                    "font": {"color": colors["text"]},
-                },
-            )
-
-            fig.update_xaxes(
-                rangeslider_visible=True,
-                rangeselector=dict(
-                    activecolor="blue",
-                    bgcolor=colors["background"],
-                    buttons=list([
-                            dict(count=7, label="7D",step="day", stepmode="backward"),
-                            dict(count=14, label="14D", step="day", stepmode="backward"),
-                            dict(count=1, label="1m", step="month", stepmode="backward"),
-                            dict(count=3, label="3m", step="month", stepmode="backward"),
-                            dict(count=6, label="6m", step="month", stepmode="backward"),
-                            dict(count=1, label="1y", step="year", stepmode="backward"),
-                            dict(count=1, label="YTD", step="year", stepmode="todate"),
-                            dict(step="all"),
-                    ])
-                )
-            )
-
-        # Simple moving average
-        if chart_name == "SMA":
-            close_ma_7 = df.daily_cases.rolling(7).mean()
-            close_ma_30 = df.daily_cases.rolling(30).mean()
-            close_ma_90 = df.daily_cases.rolling(90).mean()
-            close_ma_120 = df.daily_cases.rolling(120).mean()
-            fig = go.Figure(
-                data=[
-                    go.Scatter(
-                        x=list(df.date), y=list(close_ma_7), name="7 Days"
-                    ),
-                    go.Scatter(
-                        x=list(df.date), y=list(close_ma_30), name="30 Days"
-                    ),
-                    go.Scatter(
-                        x=list(df.date), y=list(close_ma_90), name="90 Days"
-                    ),
-                    go.Scatter(
-                        x=list(df.date), y=list(close_ma_120), name="120 Days"
-                    ),
-                ],
-                layout={
-                    "height": 1000,
-                    "title": "簡單移動平均 Simple Moving Average",
-                    "showlegend": True,
-                    "plot_bgcolor": colors["background"],
-                    "paper_bgcolor": colors["background"],
-                    "font": {"color": colors["text"]},
-                },
-            )
-
-            fig.update_xaxes(
-                rangeslider_visible=True,
-                rangeselector=dict(
-                    activecolor="blue",
-                    bgcolor=colors["background"],
-                    buttons=list([
-                            dict(count=7, label="7D",step="day", stepmode="backward"),
-                            dict(count=14, label="14D", step="day", stepmode="backward"),
-                            dict(count=1, label="1m", step="month", stepmode="backward"),
-                            dict(count=3, label="3m", step="month", stepmode="backward"),
-                            dict(count=6, label="6m", step="month", stepmode="backward"),
-                            dict(count=1, label="1y", step="year", stepmode="backward"),
-                            dict(count=1, label="YTD", step="year", stepmode="todate"),
-                            dict(step="all"),
-                    ])
-                )
-            )            
-
-        # Exponential moving average
-        if chart_name == "EMA":
-            close_ema_7 = df.daily_cases.ewm(span=7).mean()
-            close_ema_30 = df.daily_cases.ewm(span=30).mean()
-            close_ema_90 = df.daily_cases.ewm(span=90).mean()
-            close_ema_120 = df.daily_cases.ewm(span=120).mean()
-            fig = go.Figure(
-                data=[
-                    go.Scatter(
-                        x=list(df.date), y=list(close_ema_7), name="7 Days"
-                    ),
-                    go.Scatter(
-                        x=list(df.date), y=list(close_ema_30), name="30 Days"
-                    ),
-                    go.Scatter(
-                        x=list(df.date), y=list(close_ema_90), name="90 Days"
-                    ),
-                    go.Scatter(
-                        x=list(df.date), y=list(close_ema_120), name="120 Days",
-                    ),
-                ],
-                layout={
-                    "height": 1000,
-                    "title": "指數移動平均 Exponential Moving Average",
-                    "showlegend": True,
-                    "plot_bgcolor": colors["background"],
-                    "paper_bgcolor": colors["background"],
-                    "font": {"color": colors["text"]},
-                },
-            )
-
-            fig.update_xaxes(
-                rangeslider_visible=True,
-                rangeselector=dict(
-                    activecolor="blue",
-                    bgcolor=colors["background"],
-                    buttons=list([
-                            dict(count=7, label="7D",step="day", stepmode="backward"),
-                            dict(count=14, label="14D", step="day", stepmode="backward"),
-                            dict(count=1, label="1m", step="month", stepmode="backward"),
-                            dict(count=3, label="3m", step="month", stepmode="backward"),
-                            dict(count=6, label="6m", step="month", stepmode="backward"),
-                            dict(count=1, label="1y", step="year", stepmode="backward"),
-                            dict(count=1, label="YTD", step="year", stepmode="todate"),
-                            dict(step="all"),
-                    ])
-                )
-            )
-
-        # Moving average convergence divergence
-        if chart_name == "MACD":
-            fig = go.Figure(
-                data=[
-                    go.Scatter(x=list(df.date), y=list(df.MACD), name="MACD"),
-                    go.Scatter(x=list(df.date), y=list(
-                        df.MACDs), name="Signal"),
-                    go.Scatter(
-                        x=list(df.date),
-                        y=list(df['MACDh']),
-                        line=dict(color="royalblue", width=2, dash="dot"),
-                        name="Hitogram",
-                    ),
-                ],
-                layout={
-                    "height": 1000,
-                    "title": "指數平滑異同移動平均線 MACD",
-                    "showlegend": True,
-                    "plot_bgcolor": colors["background"],
-                    "paper_bgcolor": colors["background"],
-                    "font": {"color": colors["text"]},
-                },
-            )
-
-            fig.update_xaxes(
-                rangeslider_visible=True,
-                rangeselector=dict(
-                    activecolor="blue",
-                    bgcolor=colors["background"],
-                    buttons=list([
-                            dict(count=7, label="7D",step="day", stepmode="backward"),
-                            dict(count=14, label="14D", step="day", stepmode="backward"),
-                            dict(count=1, label="1m", step="month", stepmode="backward"),
-                            dict(count=3, label="3m", step="month", stepmode="backward"),
-                            dict(count=6, label="6m", step="month", stepmode="backward"),
-                            dict(count=1, label="1y", step="year", stepmode="backward"),
-                            dict(count=1, label="YTD", step="year", stepmode="todate"),
-                            dict(step="all"),
-                    ])
-                )
-            )
-        
-        # Relative Strength Index
-        if chart_name == "RSI":
-            rsi_6 = df['RSI_6']
-            rsi_12 = df['RSI_12']
-            fig = go.Figure(
-                data=[
-                    go.Scatter(x=list(df.date), y=list(
-                        rsi_6), name="RSI 6 Day"),
-                    go.Scatter(x=list(df.date), y=list(
-                        rsi_12), name="RSI 12 Day"),
-                ],
-                layout={
-                    "height": 1000,
-                    "title": "相對強弱指數 RSI",
-                    "xaxis_title" : 'Dates',                    
-                    "showlegend": True,
-                    "plot_bgcolor": colors["background"],
-                    "paper_bgcolor": colors["background"],
-                    "font": {"color": colors["text"]},
-                },
-            )
-
-            fig.update_xaxes(
-                rangeslider_visible=True,
-                rangeselector=dict(
-                    activecolor="blue",
-                    bgcolor=colors["background"],
-                    buttons=list([
-                            dict(count=7, label="7D",step="day", stepmode="backward"),
-                            dict(count=14, label="14D", step="day", stepmode="backward"),
-                            dict(count=1, label="1m", step="month", stepmode="backward"),
-                            dict(count=3, label="3m", step="month", stepmode="backward"),
-                            dict(count=6, label="6m", step="month", stepmode="backward"),
-                            dict(count=1, label="1y", step="year", stepmode="backward"),
-                            dict(count=1, label="YTD", step="year", stepmode="todate"),
-                            dict(step="all"),
-                    ])
-                )
-            )
-    return fig
+        store = data_stores[dataset]  # the refresher may swap the store while this callback runs
+        # a cleared dropdown or a region of another dataset keeps the drawn chart
+        if selected_country not in store.region_index or chart_name not in CHART_TITLES:
+            raise PreventUpdate
+
+        # only the drawn chart's inputs have to be valid, indicator_error shows what is wrong with them
+        params, errors = indicator_params_from_inputs(sma_periods, ema_periods, macd_periods, rsi_periods, rsi_smoothing)
+        if chart_name in errors:
+            raise PreventUpdate
+        params = params.get(chart_name)
+
+        resolution = resolution or "day"
+        window = zoom_window("graph", resolution, relayout_data, store.dates)
+
+        with perf_metrics.request(chart_name, slow_request_profiler):
+            figure_cache = figure_caches[dataset]
+
+            # reuse the serialized figure when this selection was already plotted for the current dataset
+            cache_key = (selected_country, chart_name, params, resolution, window)
+            with perf_metrics.span('cache_lookup'):
+                fig_json = figure_cache.get(cache_key, version=store.fingerprint)
+            if fig_json is None:
+                fig_json = figure_cache.build_once(
+                    cache_key, lambda: build_figure_json(store, selected_country, chart_name, colors, params, resolution, window),
+                    version=store.fingerprint)
+            with perf_metrics.span('decode'):
+                figure = json.loads(fig_json)
+    return figure
+
+
+# Callback series of the selected region for the client side charts. an indicator with invalid inputs is sent
+# with its defaults unless it is the drawn chart, then the chart keeps its last payload
+def region_payload(dataset, selected_country, sma_periods=None, ema_periods=None, macd_periods=None, rsi_periods=None,
+                   rsi_smoothing=None, chart_name=None):
+    store = data_stores[dataset]
+    if selected_country not in store.region_index:
+        raise PreventUpdate
+    params, errors = indicator_params_from_inputs(sma_periods, ema_periods, macd_periods, rsi_periods, rsi_smoothing)
+    if chart_name in errors:
+        raise PreventUpdate
+
+    with perf_metrics.request('payload', slow_request_profiler):
+        figure_cache = figure_caches[dataset]
+        cache_key = (selected_country, 'payload', tuple(sorted(params.items())))
+        with perf_metrics.span('cache_lookup'):
+            payload_json = figure_cache.get(cache_key, version=store.fingerprint)
+        if payload_json is None:
+            payload_json = figure_cache.build_once(cache_key, lambda: build_region_payload_json(store, selected_country, params),
+                                                   version=store.fingerprint)
+        with perf_metrics.span('decode'):
+            payload = json.loads(payload_json)
+    return payload
+
+
+# indicator parameter controls, passed to every chart callback in this order
+indicator_controls = ["sma-periods", "ema-periods", "macd-periods", "rsi-periods", "rsi-smoothing"]
+
+
+# Callback comparison chart, built on the server. indicators missing from the store's memo are computed
+# for all compared regions in one batch, resolution and zoom work like the main graph
+@app.callback(
+    Output("compare-graph", "figure"),
+    Input("submit-button-state", "n_clicks"),
+    Input("compare-regions", "value"),
+    Input("compare-mode", "value"),
+    Input("chart", "value"),
+    Input("resolution", "value"),
+    Input("compare-graph", "relayoutData"),
+    State("dataset", "value"),
+    *[State(control, "value") for control in indicator_controls]
+)
+def compare_generator(n_clicks, compare_regions, compare_mode, chart_name, resolution, relayout_data, dataset, sma_periods=None,
+                      ema_periods=None, macd_periods=None, rsi_periods=None, rsi_smoothing=None):
+    store = data_stores[dataset]
+    compare_regions = [region for region in compare_regions or [] if region in store.region_index][:MAX_COMPARE_REGIONS]
+    if not compare_regions or not chart_name:
+        return {"data": [], "layout": {"plot_bgcolor": colors["background"], "paper_bgcolor": colors["background"]}}
+    params, errors = indicator_params_from_inputs(sma_periods, ema_periods, macd_periods, rsi_periods, rsi_smoothing)
+    if chart_name in errors:
+        raise PreventUpdate
+    params = params.get(chart_name)
+
+    resolution = resolution or "day"
+    window = zoom_window("compare-graph", resolution, relayout_data, store.dates)
+
+    with perf_metrics.request(f'compare_{chart_name}', slow_request_profiler):
+        figure_cache = figure_caches[dataset]
+        cache_key = (tuple(compare_regions), chart_name, params, compare_mode, resolution, window)
+        with perf_metrics.span('cache_lookup'):
+            fig_json = figure_cache.get(cache_key, version=store.fingerprint)
+        if fig_json is None:
+            fig_json = figure_cache.build_once(
+                cache_key, lambda: build_comparison_json(store, compare_regions, chart_name, colors, params, compare_mode, resolution, window),
+                version=store.fingerprint)
+        with perf_metrics.span('decode'):
+            figure = json.loads(fig_json)
+    return figure
+
+
+# Callback validation message for the inputs of the selected chart, empty when they are valid
+@app.callback(
+    Output("indicator-error", "children"),
+    Input("chart", "value"),
+    *[Input(control, "value") for control in indicator_controls]
+)
+def indicator_error(chart_name, sma_periods, ema_periods, macd_periods, rsi_periods, rsi_smoothing):
+    _, errors = indicator_params_from_inputs(sma_periods, ema_periods, macd_periods, rsi_periods, rsi_smoothing)
+    return errors.get(chart_name, "")
+
+
+# Callback screener page, one vectorized sort of the dataset's latest-day snapshot per update
+@app.callback(
+    Output("screener-table", "data"),
+    Output("screener-table", "page_count"),
+    Input("dataset", "value"),
+    Input("screener-table", "sort_by"),
+    Input("screener-table", "page_current"),
+    Input("screener-scope", "value"),
+    Input("screener-min-cases", "value"),
+    State("screener-table", "page_size")
+)
+def screener_table(dataset, sort_by, page_current, scope, min_cases_7d, page_size):
+    sort = (sort_by or [{"column_id": "RSI_6", "direction": "desc"}])[0]
+    if sort["column_id"] not in SCREENER_COLUMNS or scope not in SCREENER_SCOPES:
+        raise PreventUpdate
+    page_size = page_size or SCREENER_PAGE_SIZE
+    total, records = screener_page(dataset, sort["column_id"], sort["direction"] == "desc", scope, min_cases_7d or 0,
+                                   (page_current or 0) * page_size, page_size)
+    return records, max(1, -(-total // page_size))
+
+
+if clientside_charts:
+    region_payload = app.callback(
+        Output("region-payload", "data"),
+        Input("dataset", "value"),
+        Input("selected-country", "value"),
+        *[Input(control, "value") for control in indicator_controls],
+        State("chart", "value")
+    )(region_payload)
+    # the payload holds every day, zooming only redraws in the browser
+    app.clientside_callback(
+        ClientsideFunction(namespace="charts", function_name="render"),
+        Output("graph", "figure"),
+        Input("region-payload", "data"),
+        Input("chart", "value"),
+        Input("submit-button-state", "n_clicks"),
+        Input("resolution", "value"),
+        Input("graph", "relayoutData"),
+        State("chart-config", "data")
+    )
+else:
+    graph_generator = app.callback(
+        Output("graph", "figure"),
+        Input("submit-button-state", "n_clicks"),
+        Input("resolution", "value"),
+        Input("graph", "relayoutData"),
+        State("dataset", "value"),
+        State("selected-country", "value"),
+        State("chart", "value"),
+        *[State(control, "value") for control in indicator_controls]
+    )(graph_generator)
+
 
 if __name__ == "__main__":
     app.run_server(debug=True)
@@ -0,0 +1,150 @@
+import os
+import time
+import heapq
+import random
+import cProfile
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+# timing spans are recorded unless PERF_METRICS=0
+ENABLED = os.environ.get('PERF_METRICS', '1') != '0'
+
+# latency histogram buckets in seconds
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# chart type of the request being handled, added as a label to every span inside it
+_current_chart: contextvars.ContextVar = contextvars.ContextVar('current_chart', default='')
+
+
+# cumulative histogram in the Prometheus layout
+class Histogram:
+    __slots__ = ('counts', 'total', 'count')
+
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, seconds: float):
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.counts[i] += 1
+        self.total += seconds
+        self.count += 1
+
+
+_histograms: Dict[Tuple[str, str, str], Histogram] = {}
+_lock = threading.Lock()
+
+
+def observe(metric: str, seconds: float, stage: str = '', chart: Optional[str] = None):
+    key = (metric, stage, _current_chart.get() if chart is None else chart)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = Histogram()
+        histogram.observe(seconds)
+
+
+# time one stage of the current request, e.g. `with span('serialize'):`
+@contextmanager
+def span(stage: str) -> Iterator[None]:
+    if not ENABLED:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe('covid_stage_seconds', time.perf_counter() - start, stage)
+
+
+# time a whole request for one chart type. with a SlowRequestProfiler a sample of requests is
+# profiled and the slowest ones are kept
+@contextmanager
+def request(chart: str, profiler: 'SlowRequestProfiler' = None) -> Iterator[None]:
+    token = _current_chart.set(chart or '')
+    profile = profiler.start() if profiler is not None else None
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        if profile is not None:
+            profiler.finish(profile, seconds, chart)
+        if ENABLED:
+            observe('covid_request_seconds', seconds)
+        _current_chart.reset(token)
+
+
+# profiles a random sample_rate share of requests with cProfile and keeps the `slowest` slowest
+# of them as .prof files in profile_dir (open with `python -m pstats` or snakeviz)
+class SlowRequestProfiler:
+    def __init__(self, profile_dir: str, slowest: int = 10, sample_rate: float = 0.1):
+        self.profile_dir = profile_dir
+        self.slowest = slowest
+        self.sample_rate = sample_rate
+        self._kept: List[Tuple[float, str]] = []  # min-heap of (seconds, path)
+        self._lock = threading.Lock()
+        os.makedirs(profile_dir, exist_ok=True)
+
+    def start(self) -> Optional[cProfile.Profile]:
+        if random.random() >= self.sample_rate:
+            return None
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # another profiler is already active on this thread
+            return None
+        return profile
+
+    def finish(self, profile: cProfile.Profile, seconds: float, chart: str):
+        profile.disable()
+        with self._lock:
+            if len(self._kept) >= self.slowest and seconds <= self._kept[0][0]:
+                return
+            path = os.path.join(self.profile_dir, f'{int(seconds * 1e6):010d}us-{chart}-{time.time_ns()}.prof')
+            profile.dump_stats(path)
+            heapq.heappush(self._kept, (seconds, path))
+            if len(self._kept) > self.slowest:
+                _, dropped = heapq.heappop(self._kept)
+                if os.path.exists(dropped):
+                    os.remove(dropped)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+# Prometheus text exposition of the latency histograms plus any extra counters/gauges,
+# extra maps a metric name to (type, help, {labels tuple: value})
+def render_prometheus(extra: Dict[str, Tuple[str, str, Dict[Tuple[Tuple[str, str], ...], float]]] = None) -> str:
+    with _lock:
+        snapshot = {key: (list(h.counts), h.total, h.count) for key, h in _histograms.items()}
+    lines = []
+    helps = {
+        'covid_request_seconds': 'Plot callback latency per chart type',
+        'covid_stage_seconds': 'Latency of one stage of the plot callback or data handler',
+    }
+    for metric in sorted({key[0] for key in snapshot}):
+        lines.append(f'# HELP {metric} {helps.get(metric, metric)}')
+        lines.append(f'# TYPE {metric} histogram')
+        for (name, stage, chart), (counts, total, count) in sorted(snapshot.items()):
+            if name != metric:
+                continue
+            labels = f'chart="{_escape(chart)}"' + (f',stage="{_escape(stage)}"' if stage else '')
+            for bound, bucket_count in zip(BUCKETS, counts):
+                lines.append(f'{metric}_bucket{{{labels},le="{bound}"}} {bucket_count}')
+            lines.append(f'{metric}_bucket{{{labels},le="+Inf"}} {count}')
+            lines.append(f'{metric}_sum{{{labels}}} {total}')
+            lines.append(f'{metric}_count{{{labels}}} {count}')
+    for metric, (metric_type, help_text, samples) in (extra or {}).items():
+        lines.append(f'# HELP {metric} {help_text}')
+        lines.append(f'# TYPE {metric} {metric_type}')
+        for labels, value in samples.items():
+            label_text = ','.join(f'{k}="{_escape(v)}"' for k, v in labels)
+            lines.append(f'{metric}{{{label_text}}} {value}' if label_text else f'{metric} {value}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,137 @@
+from typing import Dict, List, Iterable
+
+import numpy as np
+
+from region_index import RegionIndex
+
+
+# WHO regions by JHU country name. Taiwan is not a WHO member and is listed with its neighbours;
+# cruise ships and the Olympics entries belong to no region.
+# ref:https://www.who.int/countries
+WHO_REGIONS = {
+    'WHO African Region': [
+        'Algeria', 'Angola', 'Benin', 'Botswana', 'Burkina Faso', 'Burundi', 'Cabo Verde', 'Cameroon',
+        'Central African Republic', 'Chad', 'Comoros', 'Congo (Brazzaville)', 'Congo (Kinshasa)', "Cote d'Ivoire",
+        'Equatorial Guinea', 'Eritrea', 'Eswatini', 'Ethiopia', 'Gabon', 'Gambia', 'Ghana', 'Guinea', 'Guinea-Bissau',
+        'Kenya', 'Lesotho', 'Liberia', 'Madagascar', 'Malawi', 'Mali', 'Mauritania', 'Mauritius', 'Mozambique',
+        'Namibia', 'Niger', 'Nigeria', 'Rwanda', 'Sao Tome and Principe', 'Senegal', 'Seychelles', 'Sierra Leone',
+        'South Africa', 'South Sudan', 'Tanzania', 'Togo', 'Uganda', 'Zambia', 'Zimbabwe',
+    ],
+    'WHO Region of the Americas': [
+        'Antigua and Barbuda', 'Argentina', 'Bahamas', 'Barbados', 'Belize', 'Bolivia', 'Brazil', 'Canada', 'Chile',
+        'Colombia', 'Costa Rica', 'Cuba', 'Dominica', 'Dominican Republic', 'Ecuador', 'El Salvador', 'Grenada',
+        'Guatemala', 'Guyana', 'Haiti', 'Honduras', 'Jamaica', 'Mexico', 'Nicaragua', 'Panama', 'Paraguay', 'Peru',
+        'Saint Kitts and Nevis', 'Saint Lucia', 'Saint Vincent and the Grenadines', 'Suriname', 'Trinidad and Tobago',
+        'US', 'Uruguay', 'Venezuela',
+    ],
+    'WHO South-East Asia Region': [
+        'Bangladesh', 'Bhutan', 'Burma', 'India', 'Indonesia', 'Korea, North', 'Maldives', 'Nepal', 'Sri Lanka',
+        'Thailand', 'Timor-Leste',
+    ],
+    'WHO European Region': [
+        'Albania', 'Andorra', 'Armenia', 'Austria', 'Azerbaijan', 'Belarus', 'Belgium', 'Bosnia and Herzegovina',
+        'Bulgaria', 'Croatia', 'Cyprus', 'Czechia', 'Denmark', 'Estonia', 'Finland', 'France', 'Georgia', 'Germany',
+        'Greece', 'Holy See', 'Hungary', 'Iceland', 'Ireland', 'Israel', 'Italy', 'Kazakhstan', 'Kosovo',
+        'Kyrgyzstan', 'Latvia', 'Liechtenstein', 'Lithuania', 'Luxembourg', 'Malta', 'Moldova', 'Monaco',
+        'Montenegro', 'Netherlands', 'North Macedonia', 'Norway', 'Poland', 'Portugal', 'Romania', 'Russia',
+        'San Marino', 'Serbia', 'Slovakia', 'Slovenia', 'Spain', 'Sweden', 'Switzerland', 'Tajikistan', 'Turkey',
+        'Turkmenistan', 'Ukraine', 'United Kingdom', 'Uzbekistan',
+    ],
+    'WHO Eastern Mediterranean Region': [
+        'Afghanistan', 'Bahrain', 'Djibouti', 'Egypt', 'Iran', 'Iraq', 'Jordan', 'Kuwait', 'Lebanon', 'Libya',
+        'Morocco', 'Oman', 'Pakistan', 'Qatar', 'Saudi Arabia', 'Somalia', 'Sudan', 'Syria', 'Tunisia',
+        'United Arab Emirates', 'West Bank and Gaza', 'Yemen',
+    ],
+    'WHO Western Pacific Region': [
+        'Australia', 'Brunei', 'Cambodia', 'China', 'Fiji', 'Japan', 'Kiribati', 'Korea, South', 'Laos', 'Malaysia',
+        'Marshall Islands', 'Micronesia', 'Mongolia', 'Nauru', 'New Zealand', 'Palau', 'Papua New Guinea',
+        'Philippines', 'Samoa', 'Singapore', 'Solomon Islands', 'Taiwan*', 'Tonga', 'Tuvalu', 'Vanuatu', 'Vietnam',
+    ],
+}
+
+WORLD = 'World'
+# appended to the key of a total group, 'Australia' -> 'Australia (total)'
+TOTAL_SUFFIX = ' (total)'
+
+
+# group membership as a sparse (groups x regions) 0/1 matrix in CSR layout: the member rows of group g
+# are indices[indptr[g]:indptr[g+1]]. sum() adds member rows of any (regions x days) matrix, so one
+# membership serves the whole history and each appended day alike.
+class RegionGroups:
+    def __init__(self, names: List[str], members: Iterable[Iterable[int]]):
+        self.names = list(names)
+        members = [np.asarray(sorted(rows), dtype=np.int64) for rows in members]
+        if len(members) != len(self.names):
+            raise ValueError('one member list per group name is needed')
+        self.indptr = np.zeros(len(members) + 1, dtype=np.int64)
+        self.indptr[1:] = np.cumsum([len(rows) for rows in members])
+        self.indices = np.concatenate(members) if members else np.zeros(0, dtype=np.int64)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def __eq__(self, other) -> bool:
+        return (isinstance(other, RegionGroups) and self.names == other.names
+                and np.array_equal(self.indptr, other.indptr) and np.array_equal(self.indices, other.indices))
+
+    def members(self, group: int) -> np.ndarray:
+        return self.indices[self.indptr[group]:self.indptr[group + 1]]
+
+    # (groups x days) sums of the member rows of a (regions x days) matrix, integer input is summed as int64
+    def sum(self, matrix: np.ndarray) -> np.ndarray:
+        dtype = np.int64 if np.issubdtype(matrix.dtype, np.integer) else np.float64
+        sums = np.zeros((len(self.names),) + matrix.shape[1:], dtype=dtype)
+        nonempty = np.diff(self.indptr) > 0
+        if nonempty.any():
+            # empty groups are skipped, otherwise reduceat would return their next row instead of 0
+            sums[nonempty] = np.add.reduceat(matrix[self.indices], self.indptr[:-1][nonempty], axis=0, dtype=dtype)
+        return sums
+
+    def to_dict(self) -> dict:
+        return {'names': self.names, 'indptr': self.indptr.tolist(), 'indices': self.indices.tolist()}
+
+    @classmethod
+    def from_dict(cls, state: dict) -> 'RegionGroups':
+        indptr, indices = state['indptr'], state['indices']
+        return cls(state['names'], [indices[indptr[g]:indptr[g + 1]] for g in range(len(state['names']))])
+
+
+# groups of a dataset over the rows of regions:
+#   totals: one group per distinct value of each list of key columns that spans several regions,
+#           e.g. [['Country/Region']] gives 'Australia (total)' over all Australian states
+#   who_column: the country column used for WHO regions and the world total (global datasets only)
+#   custom_groups: user groups (name -> member regions), members may be normalized names or aliases
+#                  (see RegionIndex), unknown members are skipped
+# groups whose name is already a region, or that end up without members, are dropped.
+def build_region_groups(regions: List[str], group_keys: Dict[str, List[str]], totals: List[List[str]] = (),
+                        who_column: str = None, custom_groups: Dict[str, List[str]] = None) -> RegionGroups:
+    groups: Dict[str, List[int]] = {}
+    for columns in totals:
+        by_key: Dict[str, List[int]] = {}
+        for row in range(len(regions)):
+            parts = [group_keys[column][row] for column in columns]
+            if all(parts):
+                by_key.setdefault(', '.join(parts), []).append(row)
+        for key, rows in by_key.items():
+            if len(rows) > 1:
+                groups[key + TOTAL_SUFFIX] = rows
+
+    if who_column is not None:
+        countries = group_keys[who_column]
+        for who_region, who_countries in WHO_REGIONS.items():
+            who_countries = set(who_countries)
+            groups[who_region] = [row for row, country in enumerate(countries) if country in who_countries]
+        groups[WORLD] = list(range(len(regions)))
+
+    if custom_groups:
+        index = RegionIndex(regions)
+        first_rows: Dict[str, int] = {}
+        for row, region in enumerate(regions):
+            first_rows.setdefault(region, row)
+        for name, members in custom_groups.items():
+            resolved = (index.lookup(member) for member in members)
+            groups[name] = list(dict.fromkeys(first_rows[region] for region in resolved if region is not None))
+
+    known = set(regions)
+    groups = {name: rows for name, rows in groups.items() if rows and name not in known}
+    return RegionGroups(list(groups), groups.values())
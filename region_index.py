@@ -0,0 +1,145 @@
+import re
+import bisect
+import difflib
+import unicodedata
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional
+
+
+# common names that differ from the JHU spelling, used when the JHU name is in the dataset.
+# keys are normalized (see normalize_region_name)
+REGION_ALIASES = {
+    'usa': 'US',
+    'united states': 'US',
+    'united states of america': 'US',
+    'america': 'US',
+    'uk': 'United Kingdom',
+    'great britain': 'United Kingdom',
+    'britain': 'United Kingdom',
+    'south korea': 'Korea, South',
+    'korea': 'Korea, South',
+    'republic of korea': 'Korea, South',
+    'north korea': 'Korea, North',
+    'russian federation': 'Russia',
+    'czech republic': 'Czechia',
+    'ivory coast': "Cote d'Ivoire",
+    'myanmar': 'Burma',
+    'vatican': 'Holy See',
+    'vatican city': 'Holy See',
+    'uae': 'United Arab Emirates',
+    'drc': 'Congo (Kinshasa)',
+    'dr congo': 'Congo (Kinshasa)',
+    'democratic republic of the congo': 'Congo (Kinshasa)',
+    'republic of the congo': 'Congo (Brazzaville)',
+    'macedonia': 'North Macedonia',
+    'swaziland': 'Eswatini',
+    'east timor': 'Timor-Leste',
+    'cape verde': 'Cabo Verde',
+    'palestine': 'West Bank and Gaza',
+}
+
+# similarity needed for a fuzzy match (difflib ratio)
+FUZZY_CUTOFF = 0.75
+# names sharing the most trigrams with the query that are compared with difflib
+FUZZY_CANDIDATES = 64
+
+
+# lower case ascii words: accents dropped, punctuation and '*' turned into spaces, 'Taiwan*' -> 'taiwan'
+def normalize_region_name(name: str) -> str:
+    name = unicodedata.normalize('NFKD', str(name))
+    name = ''.join(c for c in name if not unicodedata.combining(c))
+    return ' '.join(re.sub(r'[^0-9a-z]+', ' ', name.lower()).split())
+
+
+def _trigrams(key: str) -> set:
+    padded = f'  {key} '
+    return {padded[i:i+3] for i in range(len(padded) - 2)}
+
+
+# lookup and search over the region names of one dataset, built once per data store.
+# lookup() resolves exact names, normalized names and aliases in O(1); search() ranks exact/alias matches,
+# then names starting with the query, then names with words starting with the query words (both by
+# binary search over sorted keys) and finally fuzzy matches for typos, scored with difflib on the few
+# names that share the most trigrams with the query.
+class RegionIndex:
+    def __init__(self, regions: List[str]):
+        self.regions = list(regions)
+        self._exact: Dict[str, str] = {}
+        self._normalized: Dict[str, str] = {}
+        token_keys = []
+        for region in self.regions:
+            self._exact.setdefault(region, region)
+            key = normalize_region_name(region)
+            self._normalized.setdefault(key, region)
+            for token in set(key.split()):
+                token_keys.append((token, region))
+        for alias, region in REGION_ALIASES.items():
+            if region in self._exact:
+                self._normalized.setdefault(alias, region)
+        # (normalized name, region) and (word, region), sorted for prefix search
+        self._names = sorted((key, region) for key, region in self._normalized.items())
+        self._name_keys = [key for key, _ in self._names]
+        self._tokens = sorted(token_keys)
+        self._token_keys = [token for token, _ in self._tokens]
+        self._trigram_keys = defaultdict(list)
+        for key in self._name_keys:
+            for trigram in _trigrams(key):
+                self._trigram_keys[trigram].append(key)
+
+    def __len__(self) -> int:
+        return len(self.regions)
+
+    # the region called name, or None
+    def lookup(self, name: str) -> Optional[str]:
+        if name is None:
+            return None
+        region = self._exact.get(name)
+        if region is None:
+            region = self._normalized.get(normalize_region_name(name))
+        return region
+
+    # up to limit region names matching query, best first
+    def search(self, query: str, limit: int = 20) -> List[str]:
+        query = normalize_region_name(query or '')
+        if not query or limit <= 0:
+            return []
+        results = {}  # insertion ordered set
+
+        def add(regions):
+            for region in regions:
+                results.setdefault(region)
+                if len(results) >= limit:
+                    return True
+            return False
+
+        exact = self._normalized.get(query)
+        if add([exact] if exact is not None else []):
+            return list(results)
+        if add(region for _, region in self._prefixed(self._names, self._name_keys, query)):
+            return list(results)
+
+        # every query word must start a word of the name, longest (most selective) word first
+        candidates = None
+        for word in sorted(query.split(), key=len, reverse=True):
+            matched = {region for _, region in self._prefixed(self._tokens, self._token_keys, word)}
+            candidates = matched if candidates is None else candidates & matched
+            if not candidates:
+                break
+        if add(sorted(candidates)):
+            return list(results)
+
+        shared = Counter()
+        for trigram in _trigrams(query):
+            shared.update(self._trigram_keys.get(trigram, ()))
+        candidates = [key for key, _ in shared.most_common(FUZZY_CANDIDATES)]
+        close = difflib.get_close_matches(query, candidates, n=limit, cutoff=FUZZY_CUTOFF)
+        add(self._normalized[key] for key in close)
+        return list(results)
+
+    @staticmethod
+    def _prefixed(entries: List, keys: List[str], prefix: str):
+        start = bisect.bisect_left(keys, prefix)
+        for index in range(start, len(keys)):
+            if not keys[index].startswith(prefix):
+                break
+            yield entries[index]
@@ -0,0 +1,155 @@
+from typing import Dict, List, Type
+
+import numpy as np
+import pandas as pd
+
+
+# columns of the screener, in table order. every column holds one value per region for the latest day:
+#   accu_cases, daily_cases  counts of the latest day
+#   cases_7d                 new cases over the last 7 days
+#   growth_7d                % change of cases_7d against the 7 days before (NaN when those had no cases)
+#   RSI_6, RSI_12, MACD, MACDs, MACDh  latest precomputed indicator values
+#   macd_cross               direction of the latest MACD histogram sign flip, 1 up, -1 down, 0 none yet
+#   macd_cross_age           days since that flip, 0 when it happened on the latest day (NaN without a flip)
+SCREENER_COLUMNS = {
+    'accu_cases': '累計 Total',
+    'daily_cases': '當日 Daily',
+    'cases_7d': '7日 7 Days',
+    'growth_7d': '7日增長% 7D Growth %',
+    'RSI_6': 'RSI 6',
+    'RSI_12': 'RSI 12',
+    'MACD': 'MACD',
+    'MACDs': 'MACD Signal',
+    'MACDh': 'MACD Hist',
+    'macd_cross': 'MACD 交叉 Cross',
+    'macd_cross_age': '交叉天數 Cross Age',
+}
+# which rows a ranking covers
+SCREENER_SCOPES = ('all', 'regions', 'aggregates')
+GROWTH_DAYS = 7
+# decimals kept for every value of a ranking
+DECIMALS = 2
+
+
+# latest-day values of every region as columns (one NumPy array per column, row order of the data store),
+# so a ranking is one vectorized sort over a column. built from the last 2 * GROWTH_DAYS days of the store
+# matrices plus one scan of the MACD histogram for the latest sign flips; appended days only need the
+# new days (see append), the flips continue from the previous snapshot.
+class LatestSnapshot:
+    def __init__(self, regions: List[str], date: Type[pd.Timestamp], base_regions: int, columns: Dict[str, np.ndarray]):
+        self.regions = regions
+        self.date = date
+        # rows from base_regions on are aggregates
+        self.base_regions = base_regions
+        self.columns = columns
+        for values in columns.values():
+            values.setflags(write=False)  # shared by every request
+
+    def __len__(self) -> int:
+        return len(self.regions)
+
+    # snapshot of a whole history: the (regions x days) matrices and indicator rows of a data store
+    @classmethod
+    def build(cls, regions: List[str], dates: Type[pd.DatetimeIndex], base_regions: int, accu_cases: np.ndarray,
+              daily_cases: np.ndarray, indicators: Dict[str, np.ndarray]) -> 'LatestSnapshot':
+        cross, cross_age = _latest_cross(indicators['MACDh'])
+        return cls(regions, dates[-1] if len(dates) else None, base_regions,
+                   _tail_columns(accu_cases, daily_cases, indicators, cross, cross_age))
+
+    # snapshot after new_days were appended to the history of this one. only the last days of the
+    # matrices are read, the same regions are expected
+    def append(self, dates: Type[pd.DatetimeIndex], accu_cases: np.ndarray, daily_cases: np.ndarray,
+               indicators: Dict[str, np.ndarray], new_days: int) -> 'LatestSnapshot':
+        if new_days <= 0:
+            return self
+        # the new histogram days, preceded by the last known one so a flip on the first new day is seen
+        histogram = np.concatenate((self.columns['MACDh'][:, None], indicators['MACDh'][:, -new_days:]), axis=1)
+        cross, cross_age = _latest_cross(histogram)
+        flipped = ~np.isnan(cross_age)
+        cross = np.where(flipped, cross, self.columns['macd_cross'])
+        cross_age = np.where(flipped, cross_age, self.columns['macd_cross_age'] + new_days)
+        return LatestSnapshot(self.regions, dates[-1], self.base_regions,
+                              _tail_columns(accu_cases, daily_cases, indicators, cross, cross_age))
+
+    # snapshot with the values of rows taken from other, a snapshot of just those rows in the same order
+    # (e.g. rows whose history was revised and recomputed)
+    def with_rows(self, rows: np.ndarray, other: 'LatestSnapshot') -> 'LatestSnapshot':
+        columns = {}
+        for name, values in self.columns.items():
+            values = values.copy()
+            values[rows] = other.columns[name]
+            columns[name] = values
+        return LatestSnapshot(self.regions, self.date, self.base_regions, columns)
+
+    # row numbers ranked by column, NaN always last. scope is one of SCREENER_SCOPES, regions with fewer
+    # than min_cases_7d cases over the last week are left out (noisy growth and RSI of tiny counts)
+    def rank(self, by: str, descending: bool = True, scope: str = 'all', min_cases_7d: float = 0) -> np.ndarray:
+        if by not in self.columns:
+            raise ValueError(f"unknown screener column '{by}', expected one of {', '.join(self.columns)}")
+        if scope not in SCREENER_SCOPES:
+            raise ValueError(f"unknown screener scope '{scope}', expected one of {', '.join(SCREENER_SCOPES)}")
+        rows = np.arange(len(self.regions))
+        mask = self.columns['cases_7d'] >= min_cases_7d
+        if scope == 'regions':
+            mask &= rows < self.base_regions
+        elif scope == 'aggregates':
+            mask &= rows >= self.base_regions
+        rows = rows[mask]
+        values = self.columns[by][rows].astype(np.float64)
+        # lexsort is stable and sorts by its last key first: NaN last, then the values
+        order = np.lexsort((-values if descending else values, np.isnan(values)))
+        return rows[order]
+
+    # JSON-ready records of rows (e.g. a slice of rank), values rounded, NaN as None
+    def records(self, rows: np.ndarray) -> List[Dict]:
+        rows = np.asarray(rows, dtype=np.int64)
+        records = [{'region': self.regions[row], 'aggregate': bool(row >= self.base_regions)} for row in rows]
+        for name, values in self.columns.items():
+            picked = values[rows]
+            if not np.issubdtype(picked.dtype, np.integer):
+                picked = np.round(picked, DECIMALS)
+                picked = np.where(np.isnan(picked), None, picked)
+            for record, value in zip(records, picked.tolist()):
+                record[name] = value
+        return records
+
+
+# direction and age of the latest sign flip of the histogram in every row, NaN age where it never flips.
+# a flip is a day whose histogram is positive after a day that was not, or the other way round
+def _latest_cross(histogram: np.ndarray):
+    histogram = np.asarray(histogram, dtype=np.float64)
+    rows, days = histogram.shape
+    positive = histogram > 0
+    if days < 2:
+        return np.zeros(rows), np.full(rows, np.nan)
+    flips = positive[:, 1:] != positive[:, :-1]
+    # position of the last flip from the end of the row
+    last_from_end = np.argmax(flips[:, ::-1], axis=1)
+    flipped = flips.any(axis=1)
+    cross_age = np.where(flipped, last_from_end, np.nan)
+    cross = np.where(flipped, np.where(positive[:, -1], 1.0, -1.0), 0.0)
+    return cross, cross_age
+
+
+# every column but the flips from the last days of the matrices
+def _tail_columns(accu_cases: np.ndarray, daily_cases: np.ndarray, indicators: Dict[str, np.ndarray],
+                  cross: np.ndarray, cross_age: np.ndarray) -> Dict[str, np.ndarray]:
+    rows = len(accu_cases)
+    tail = np.asarray(daily_cases[:, -2 * GROWTH_DAYS:], dtype=np.float64)
+    cases_7d = tail[:, -GROWTH_DAYS:].sum(axis=1)
+    # the week before, no growth until there is a full one
+    previous_7d = tail[:, :-GROWTH_DAYS].sum(axis=1) if tail.shape[1] == 2 * GROWTH_DAYS else np.zeros(rows)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        growth_7d = np.where(previous_7d > 0, 100 * (cases_7d - previous_7d) / previous_7d, np.nan)
+    columns = {
+        'accu_cases': np.array(accu_cases[:, -1], dtype=np.int64) if accu_cases.shape[1] else np.zeros(rows, dtype=np.int64),
+        'daily_cases': tail[:, -1].copy() if tail.shape[1] else np.zeros(rows),
+        'cases_7d': cases_7d,
+        'growth_7d': growth_7d,
+    }
+    for name in ('RSI_6', 'RSI_12', 'MACD', 'MACDs', 'MACDh'):
+        values = indicators[name]
+        columns[name] = np.array(values[:, -1], dtype=np.float64) if values.shape[1] else np.full(rows, np.nan)
+    columns['macd_cross'] = np.asarray(cross, dtype=np.float64)
+    columns['macd_cross_age'] = np.asarray(cross_age, dtype=np.float64)
+    return columns
@@ -14,24 +14,317 @@ def calculate_macd(df, PRICE_NAME: str, period_long: int = 26, period_short: int
     MACD_Histogram = MACD_line - MACD_Signal_line
     return MACD_line, MACD_Signal_line, MACD_Histogram
 
+# rolling mean over the last axis via cumulative sums, O(n) regardless of window length.
+# position i holds mean(values[..., i-length+1:i+1]); positions before a full window are NaN.
+# ref:https://stackoverflow.com/questions/13728392/moving-average-or-running-mean
+def _rolling_mean(values: np.ndarray, length: int) -> np.ndarray:
+    values = np.asarray(values, dtype=np.float64)
+    out = np.full(values.shape, np.nan)
+    if length <= 0 or values.shape[-1] < length:
+        return out
+    csum = np.cumsum(values, axis=-1)
+    window_sum = csum[..., length-1:].copy()
+    window_sum[..., 1:] -= csum[..., :-length]
+    out[..., length-1:] = window_sum / length
+    return out
+
+# Wilder's smoothing (RMA) over the last axis: seeded with the simple mean of the first window,
+# then avg[i] = (avg[i-1] * (length-1) + values[i]) / length, which equals ewm(alpha=1/length, adjust=False).
+# ref:https://www.investopedia.com/terms/r/rsi.asp
+def _wilder_mean(values: np.ndarray, length: int) -> np.ndarray:
+    values = np.asarray(values, dtype=np.float64)
+    out = np.full(values.shape, np.nan)
+    if length <= 0 or values.shape[-1] < length:
+        return out
+    seeded = values[..., length-1:].copy()
+    seeded[..., 0] = values[..., :length].mean(axis=-1)
+    out[..., length-1:] = _ewm_mean(seeded, alpha=1.0/length)
+    return out
+
+# exponential moving average (adjust=False unless asked) over the last axis of a 1-D or 2-D array.
+# pandas ewm works column-wise, so time runs along rows while smoothing.
+def _ewm_mean(values: np.ndarray, adjust: bool = False, **ewm_kwargs) -> np.ndarray:
+    values = np.asarray(values, dtype=np.float64)
+    smoothed = pd.DataFrame(np.atleast_2d(values).T).ewm(adjust=adjust, **ewm_kwargs).mean().to_numpy().T
+    return smoothed.reshape(values.shape)
+
+# RSI from average gains/losses. windows with neither gains nor losses are neutral (50) instead of 0/0 = NaN.
+def _rsi_from_means(up_mean: np.ndarray, down_mean: np.ndarray) -> np.ndarray:
+    total = up_mean + down_mean
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rsi = 100 * up_mean / total
+    return np.where(total == 0, 50.0, rsi)
+
 # Calculating RSI indicator  # ref:https://stackoverflow.com/questions/40181344/how-to-annotate-types-of-multiple-return-values
-def calculate_rsi(df: Type[pd.DataFrame], price_name: str = 'daily_cases', rsi_length: int = 14) -> Tuple[Type[pd.Series], List]:
+# smoothing: 'sma' averages gains/losses over a plain rolling window (original behaviour),
+#            'wilder' uses Wilder's recursive smoothing seeded with the first window's mean.
+def calculate_rsi(df: Type[pd.DataFrame], price_name: str = 'daily_cases', rsi_length: int = 14, smoothing: str = 'sma') -> Tuple[Type[pd.Series], List]:
     Close = df[price_name]
-    Chg = Close - Close.shift(1)
-    Chg_pos = pd.Series(index=Chg.index, data=Chg[Chg>0])
-    Chg_pos = Chg_pos.fillna(0)
-    Chg_neg = pd.Series(index=Chg.index, data=-Chg[Chg<0])
-    Chg_neg = Chg_neg.fillna(0)
-    
-    up_mean = []
-    down_mean = []
-    for i in range(rsi_length+1, len(Chg_pos)+1):
-        up_mean.append(np.mean(Chg_pos.values[i-rsi_length:i]))
-        down_mean.append(np.mean(Chg_neg.values[i-rsi_length:i]))
-
-    # calculate RSI
-    rsi = []
-    for i in range(len(up_mean)):
-        rsi.append(100 * up_mean[i] / (up_mean[i] + down_mean[i]))
+    Chg = np.diff(Close.values.astype(np.float64), prepend=np.nan)
+    Chg = np.nan_to_num(Chg, nan=0.0)
+    Chg_pos = np.where(Chg > 0, Chg, 0.0)
+    Chg_neg = np.where(Chg < 0, -Chg, 0.0)
+
+    if smoothing == 'sma':
+        up_mean = _rolling_mean(Chg_pos, rsi_length)
+        down_mean = _rolling_mean(Chg_neg, rsi_length)
+    elif smoothing == 'wilder':
+        # seed from the first full window of real changes (skip the undefined first change)
+        up_mean = np.concatenate(([np.nan], _wilder_mean(Chg_pos[1:], rsi_length)))
+        down_mean = np.concatenate(([np.nan], _wilder_mean(Chg_neg[1:], rsi_length)))
+    else:
+        raise ValueError(f"unknown RSI smoothing '{smoothing}', expected 'sma' or 'wilder'")
+
+    # calculate RSI, the first change is undefined so the series starts at rsi_length
+    rsi = _rsi_from_means(up_mean, down_mean)[rsi_length:]
     rsi_series = pd.Series(index=Close.index[rsi_length:], data=rsi)
-    return rsi_series, rsi_series.tolist()
\ No newline at end of file
+    return rsi_series, rsi_series.tolist()
+
+
+# batch SMA for many regions at once along the last axis, NaN until the window is full.
+def calculate_sma_batch(values: np.ndarray, window: int) -> np.ndarray:
+    return _rolling_mean(values, window)
+
+# batch EMA (adjust=False) for many regions at once along the last axis. when last_ema holds the
+# EMA of the day before values[..., 0] (one per region), the recursion continues from it, so
+# appending days gives the same result as recomputing the whole history.
+# adjust=True gives pandas' default weighting (ewm(span).mean()) and cannot be continued.
+def calculate_ema_batch(values: np.ndarray, span: int, last_ema: np.ndarray = None, adjust: bool = False) -> np.ndarray:
+    if adjust:
+        if last_ema is not None:
+            raise ValueError('an adjusted EMA cannot be continued from last_ema')
+        return _ewm_mean(values, adjust=True, span=span)
+    if last_ema is None:
+        return _ewm_mean(values, span=span)
+    values = np.asarray(values, dtype=np.float64)
+    seeded = np.concatenate((np.asarray(last_ema, dtype=np.float64)[..., None], values), axis=-1)
+    return _ewm_mean(seeded, span=span)[..., 1:]
+
+# batch MACD for many regions at once. daily_cases is a (regions x days) array, the returned
+# MACD line, signal line and histogram have the same shape and match calculate_macd row by row.
+def calculate_macd_batch(daily_cases: np.ndarray, period_long: int = 26, period_short: int = 12, period_singal: int = 9) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    EMA_long = calculate_ema_batch(daily_cases, period_long)
+    EMA_short = calculate_ema_batch(daily_cases, period_short)
+    MACD_line = EMA_short - EMA_long
+    MACD_Signal_line = calculate_ema_batch(MACD_line, period_singal)
+    MACD_Histogram = MACD_line - MACD_Signal_line
+    return MACD_line, MACD_Signal_line, MACD_Histogram
+
+# batch RSI for many regions at once. daily_cases is a (regions x days) array, the result has the
+# same shape with NaN for the first rsi_length days, otherwise it matches calculate_rsi row by row.
+def calculate_rsi_batch(daily_cases: np.ndarray, rsi_length: int = 14, smoothing: str = 'sma') -> np.ndarray:
+    daily_cases = np.asarray(daily_cases, dtype=np.float64)
+    Chg = np.zeros(daily_cases.shape)
+    Chg[..., 1:] = np.diff(daily_cases, axis=-1)
+    Chg = np.nan_to_num(Chg, nan=0.0)
+    Chg_pos = np.where(Chg > 0, Chg, 0.0)
+    Chg_neg = np.where(Chg < 0, -Chg, 0.0)
+
+    if smoothing == 'sma':
+        up_mean = _rolling_mean(Chg_pos, rsi_length)
+        down_mean = _rolling_mean(Chg_neg, rsi_length)
+    elif smoothing == 'wilder':
+        up_mean = np.full(daily_cases.shape, np.nan)
+        down_mean = np.full(daily_cases.shape, np.nan)
+        up_mean[..., 1:] = _wilder_mean(Chg_pos[..., 1:], rsi_length)
+        down_mean[..., 1:] = _wilder_mean(Chg_neg[..., 1:], rsi_length)
+    else:
+        raise ValueError(f"unknown RSI smoothing '{smoothing}', expected 'sma' or 'wilder'")
+
+    rsi = _rsi_from_means(up_mean, down_mean)
+    rsi[..., :rsi_length] = np.nan
+    return rsi
+
+
+# Incremental indicator states. each state covers one series (scalar state) or many regions at once
+# (array state, one value per region). update() takes one new day, update_batch() takes new days along
+# the last axis; both cost O(1) per point and return the same values as the batch functions above.
+# to_dict()/from_dict() round-trip the state through plain JSON types so a daily update never replays history.
+
+def _state_to_list(value):
+    return None if value is None else np.asarray(value).tolist()
+
+def _state_from_list(value):
+    return None if value is None else np.asarray(value, dtype=np.float64)
+
+
+# EMA with adjust=False, same update rule as pandas ewm
+class EMAState:
+    __slots__ = ('span', 'last')
+
+    def __init__(self, span: int, last: np.ndarray = None):
+        self.span = span
+        self.last = _state_from_list(last)
+
+    def update(self, value) -> np.ndarray:
+        value = np.asarray(value, dtype=np.float64)
+        if self.last is None:
+            self.last = value.copy()
+        else:
+            # weights as in pandas ewm(adjust=False)
+            alpha = 2.0 / (self.span + 1.0)
+            old_wt, new_wt = 1.0 - alpha, alpha
+            self.last = (old_wt * self.last + new_wt * value) / (old_wt + new_wt)
+        return self.last
+
+    def update_batch(self, values: np.ndarray) -> np.ndarray:
+        ema = calculate_ema_batch(values, self.span, self.last)
+        if ema.shape[-1]:
+            self.last = ema[..., -1].copy()
+        return ema
+
+    def to_dict(self) -> dict:
+        return {'span': self.span, 'last': _state_to_list(self.last)}
+
+    @classmethod
+    def from_dict(cls, state: dict) -> 'EMAState':
+        return cls(state['span'], state['last'])
+
+
+# simple moving average, NaN until the window is full. keeps the running cumulative sum and a ring of the
+# last `length` cumulative sums, each update returns (csum now - csum `length` days ago) / length in O(1).
+# that is the same arithmetic as _rolling_mean, so the results are bit-identical to calculate_sma_batch and
+# a window of zeros is exactly 0 (a running total of added and subtracted values would drift)
+class SMAState:
+    __slots__ = ('length', 'csums', 'pos', 'count', 'csum')
+
+    def __init__(self, length: int, csums: np.ndarray = None, pos: int = 0, count: int = 0, csum: np.ndarray = None):
+        self.length = length
+        self.csums = _state_from_list(csums)
+        self.pos = pos
+        self.count = count
+        self.csum = _state_from_list(csum)
+
+    def update(self, value) -> np.ndarray:
+        value = np.asarray(value, dtype=np.float64)
+        if self.csums is None:
+            self.csums = np.zeros(value.shape + (self.length,))
+            self.csum = value.copy()
+        else:
+            self.csum = self.csum + value
+        # the oldest slot holds the cumulative sum of the day before the window (0 for the first window)
+        window_sum = self.csum - self.csums[..., self.pos]
+        self.csums[..., self.pos] = self.csum
+        self.pos = (self.pos + 1) % self.length
+        self.count += 1
+        if self.count < self.length:
+            return np.full(value.shape, np.nan)
+        return window_sum / self.length
+
+    def update_batch(self, values: np.ndarray) -> np.ndarray:
+        values = np.asarray(values, dtype=np.float64)
+        return _stack_updates(self, values)
+
+    def to_dict(self) -> dict:
+        return {'length': self.length, 'csums': _state_to_list(self.csums), 'pos': self.pos, 'count': self.count,
+                'csum': _state_to_list(self.csum)}
+
+    @classmethod
+    def from_dict(cls, state: dict) -> 'SMAState':
+        return cls(state['length'], state['csums'], state['pos'], state['count'], state['csum'])
+
+
+# MACD line, signal line and histogram, matches calculate_macd / calculate_macd_batch
+class MACDState:
+    __slots__ = ('ema_long', 'ema_short', 'ema_signal')
+
+    def __init__(self, period_long: int = 26, period_short: int = 12, period_singal: int = 9):
+        self.ema_long = EMAState(period_long)
+        self.ema_short = EMAState(period_short)
+        self.ema_signal = EMAState(period_singal)
+
+    def update(self, value) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        MACD_line = self.ema_short.update(value) - self.ema_long.update(value)
+        MACD_Signal_line = self.ema_signal.update(MACD_line)
+        return MACD_line, MACD_Signal_line, MACD_line - MACD_Signal_line
+
+    def update_batch(self, values: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        MACD_line = self.ema_short.update_batch(values) - self.ema_long.update_batch(values)
+        MACD_Signal_line = self.ema_signal.update_batch(MACD_line)
+        return MACD_line, MACD_Signal_line, MACD_line - MACD_Signal_line
+
+    def to_dict(self) -> dict:
+        return {'long': self.ema_long.to_dict(), 'short': self.ema_short.to_dict(), 'signal': self.ema_signal.to_dict()}
+
+    @classmethod
+    def from_dict(cls, state: dict) -> 'MACDState':
+        macd_state = cls()
+        macd_state.ema_long = EMAState.from_dict(state['long'])
+        macd_state.ema_short = EMAState.from_dict(state['short'])
+        macd_state.ema_signal = EMAState.from_dict(state['signal'])
+        return macd_state
+
+
+# RSI over daily values, matches calculate_rsi / calculate_rsi_batch including the NaN head of rsi_length days
+class RSIState:
+    __slots__ = ('rsi_length', 'smoothing', 'prev', 'count', 'up', 'down', 'up_wilder', 'down_wilder')
+
+    def __init__(self, rsi_length: int = 14, smoothing: str = 'sma'):
+        if smoothing not in ('sma', 'wilder'):
+            raise ValueError(f"unknown RSI smoothing '{smoothing}', expected 'sma' or 'wilder'")
+        self.rsi_length = rsi_length
+        self.smoothing = smoothing
+        self.prev = None
+        self.count = 0
+        # 'sma' averages the last rsi_length changes. 'wilder' also uses them to seed the
+        # first average, then smooths recursively in up_wilder/down_wilder
+        self.up = SMAState(rsi_length)
+        self.down = SMAState(rsi_length)
+        self.up_wilder = None
+        self.down_wilder = None
+
+    def update(self, value) -> np.ndarray:
+        value = np.asarray(value, dtype=np.float64)
+        # the first change is undefined and counts as 0, like calculate_rsi
+        Chg = np.zeros(value.shape) if self.prev is None else np.nan_to_num(value - self.prev, nan=0.0)
+        self.prev = value.copy()
+        self.count += 1
+        Chg_pos = np.where(Chg > 0, Chg, 0.0)
+        Chg_neg = np.where(Chg < 0, -Chg, 0.0)
+
+        if self.smoothing == 'sma' or self.count <= self.rsi_length + 1:
+            # the wilder seed skips the undefined first change
+            if self.smoothing == 'sma' or self.count > 1:
+                up_mean = self.up.update(Chg_pos)
+                down_mean = self.down.update(Chg_neg)
+            if self.smoothing == 'wilder' and self.count == self.rsi_length + 1:
+                self.up_wilder, self.down_wilder = up_mean.copy(), down_mean.copy()
+        else:
+            alpha = 1.0 / self.rsi_length
+            old_wt, new_wt = 1.0 - alpha, alpha
+            self.up_wilder = (old_wt * self.up_wilder + new_wt * Chg_pos) / (old_wt + new_wt)
+            self.down_wilder = (old_wt * self.down_wilder + new_wt * Chg_neg) / (old_wt + new_wt)
+
+        if self.count <= self.rsi_length:
+            return np.full(value.shape, np.nan)
+        if self.smoothing == 'wilder':
+            return _rsi_from_means(self.up_wilder, self.down_wilder)
+        return _rsi_from_means(up_mean, down_mean)
+
+    def update_batch(self, values: np.ndarray) -> np.ndarray:
+        values = np.asarray(values, dtype=np.float64)
+        return _stack_updates(self, values)
+
+    def to_dict(self) -> dict:
+        return {'rsi_length': self.rsi_length, 'smoothing': self.smoothing, 'prev': _state_to_list(self.prev),
+                'count': self.count, 'up': self.up.to_dict(), 'down': self.down.to_dict(),
+                'up_wilder': _state_to_list(self.up_wilder), 'down_wilder': _state_to_list(self.down_wilder)}
+
+    @classmethod
+    def from_dict(cls, state: dict) -> 'RSIState':
+        rsi_state = cls(state['rsi_length'], state['smoothing'])
+        rsi_state.prev = _state_from_list(state['prev'])
+        rsi_state.count = state['count']
+        rsi_state.up = SMAState.from_dict(state['up'])
+        rsi_state.down = SMAState.from_dict(state['down'])
+        rsi_state.up_wilder = _state_from_list(state['up_wilder'])
+        rsi_state.down_wilder = _state_from_list(state['down_wilder'])
+        return rsi_state
+
+
+# feed values day by day along the last axis and stack the results back into the same shape
+def _stack_updates(state, values: np.ndarray) -> np.ndarray:
+    out = np.empty(values.shape)
+    for day in range(values.shape[-1]):
+        out[..., day] = state.update(values[..., day])
+    return out
@@ -0,0 +1,32 @@
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+# the app modules live at the repository root, not in a package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from data_loader import FixtureSource  # noqa: E402
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+FIXTURE_FILE = 'time_series_covid19_confirmed_global.csv'
+
+
+# the checked in JHU style table: 10 regions over 180 days with reporting gaps, a backlog dump and revisions
+@pytest.fixture
+def fixture_source() -> FixtureSource:
+    return FixtureSource(FIXTURE_DIR, FIXTURE_FILE)
+
+
+# source(days) is the fixture table cut after its first `days` date columns, as it looked on an earlier day
+@pytest.fixture
+def truncated_source(tmp_path):
+    raw = pd.read_csv(os.path.join(FIXTURE_DIR, FIXTURE_FILE))
+
+    def source(days: int) -> FixtureSource:
+        fixture_dir = tmp_path / str(days)
+        fixture_dir.mkdir(exist_ok=True)
+        raw.iloc[:, :4 + days].to_csv(fixture_dir / FIXTURE_FILE, index=False)
+        return FixtureSource(str(fixture_dir), FIXTURE_FILE)
+    return source
@@ -0,0 +1,23 @@
+import pandas as pd
+import pytest
+
+import batch_export
+from conftest import FIXTURE_DIR
+
+BASE_COLUMNS = ['region', 'aggregate', 'date', 'accu_cases', 'daily_cases', 'quality_flags']
+
+
+@pytest.mark.parametrize('indicator_params', ['{"SMA": 5}', '[1]', '{"SMA": {"periods": [0]}}', '{"XYZ": {}}', '{'])
+def test_bad_indicator_params_are_usage_errors(indicator_params, tmp_path, capsys):
+    with pytest.raises(SystemExit) as exit_info:
+        batch_export.main(['--output', str(tmp_path), '--indicator-params', indicator_params])
+    assert exit_info.value.code == 2
+    assert '--indicator-params' in capsys.readouterr().err
+
+
+def test_indicator_params_select_the_exported_indicators(tmp_path):
+    batch_export.main(['--output', str(tmp_path), '--fixture-dir', FIXTURE_DIR, '--format', 'csv',
+                       '--indicator-params', '{"SMA": {"periods": [7]}}'])
+    parts = sorted((tmp_path / 'dataset=confirmed_global').glob('part-*.csv'))
+    frame = pd.concat(pd.read_csv(part) for part in parts)
+    assert [name for name in frame.columns if name not in BASE_COLUMNS] == ['SMA_7']
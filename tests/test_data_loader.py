@@ -0,0 +1,91 @@
+import json
+
+import pytest
+import requests
+
+import Covid19DataHandler as handler
+import data_loader
+from data_loader import CachedHTTPSource, DataSource
+
+CACHED_CSV = 'Province/State,Country/Region,Lat,Long,1/22/20,1/23/20\n,Taiwan*,0,0,1,2\n'
+
+
+def _cached_source(tmp_path, **kwargs):
+    source = CachedHTTPSource('https://example.invalid/data.csv', str(tmp_path), backoff=0, **kwargs)
+    with open(source._data_path, 'w') as f:
+        f.write(CACHED_CSV)
+    with open(source._meta_path, 'w') as f:
+        json.dump({'etag': '"v1"', 'last_modified': None, 'fingerprint': '"v1"'}, f)
+    return source
+
+
+def _response(etag):
+    response = requests.Response()
+    response.status_code = 200
+    response.headers['ETag'] = etag
+    response._content = CACHED_CSV.encode('utf-8')
+    return response
+
+
+def test_data_source_is_abstract():
+    with pytest.raises(TypeError):
+        DataSource()
+
+
+# once fingerprint() fell back to the cached copy, the reads of that load do not touch the network again
+def test_offline_load_requests_once(tmp_path, monkeypatch):
+    source = _cached_source(tmp_path, retries=3)
+    requests_made = []
+
+    def unreachable(url, **kwargs):
+        requests_made.append(url)
+        raise requests.ConnectionError(url)
+    monkeypatch.setattr(data_loader.requests, 'head', unreachable)
+    monkeypatch.setattr(data_loader.requests, 'get', unreachable)
+
+    assert source.fingerprint() == '"v1"'
+    assert source.offline
+    assert len(requests_made) == 4
+    assert source.read_header()[:2] == ['Province/State', 'Country/Region']
+    assert len(list(source.read_chunks(1))) == 1
+    assert source.read_frame().shape == (1, 6)
+    assert len(requests_made) == 4
+
+
+def test_online_load_downloads_once(tmp_path, monkeypatch):
+    source = CachedHTTPSource('https://example.invalid/data.csv', str(tmp_path))
+    requests_made = []
+
+    def respond(url, **kwargs):
+        requests_made.append(url)
+        return _response('"v2"')
+    monkeypatch.setattr(data_loader.requests, 'head', respond)
+    monkeypatch.setattr(data_loader.requests, 'get', respond)
+
+    assert source.fingerprint() == '"v2"'
+    assert source.read_header()[:2] == ['Province/State', 'Country/Region']
+    assert len(list(source.read_chunks(1))) == 1
+    assert len(requests_made) == 2
+    assert source.loaded_fingerprint('"v2"') == '"v2"'
+    # the next load checks the server again
+    source.fingerprint()
+    source.read_header()
+    assert len(requests_made) == 4
+
+
+# the server answers the HEAD with a new version, then the download fails: the old cached copy is parsed
+# and the store must carry its fingerprint, so the next check downloads the new version
+def test_store_from_cached_copy_keeps_its_fingerprint(tmp_path, monkeypatch):
+    source = _cached_source(tmp_path, retries=0)
+
+    def unreachable(url, **kwargs):
+        raise requests.ConnectionError(url)
+    monkeypatch.setattr(data_loader.requests, 'head', lambda url, **kwargs: _response('"v2"'))
+    monkeypatch.setattr(data_loader.requests, 'get', unreachable)
+
+    source_fingerprint = source.fingerprint()
+    assert source_fingerprint == '"v2"'
+    store = handler.buildCovidDataStore(source, source_fingerprint)
+    assert source.offline
+    assert store.source_fingerprint == '"v1"'
+    assert handler.updateCovidDataStore(store, source, source.fingerprint()).source_fingerprint == '"v1"'
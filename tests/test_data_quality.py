@@ -0,0 +1,28 @@
+import numpy as np
+import pytest
+
+import Covid19DataHandler as handler
+from data_quality import QualityPolicy
+
+POLICIES = [QualityPolicy(negatives=negatives, gaps='spread', dumps='spread') for negatives in ('clamp', 'backfill', 'carry')]
+
+
+# cut points before, on and right after the fixture's gaps, backlog dump (day 130) and revisions (days 90, 140)
+@pytest.mark.parametrize('policy', POLICIES, ids=lambda policy: policy.negatives)
+@pytest.mark.parametrize('cut', [45, 90, 91, 130, 131, 140, 152, 172])
+def test_incremental_pass_is_bit_identical_to_full_pass(fixture_source, truncated_source, policy, cut):
+    full = handler.buildCovidDataStore(fixture_source, fixture_source.fingerprint(), quality_policy=policy)
+    store = handler.buildCovidDataStore(truncated_source(cut), quality_policy=policy)
+    for days in (cut + 1, cut + 3, 180):
+        store = handler.updateCovidDataStore(store, truncated_source(min(days, 180)))
+    assert store.quality.policy == policy
+    assert store.quality.start == full.quality.start
+    np.testing.assert_array_equal(store.quality.flags, full.quality.flags)
+    np.testing.assert_array_equal(store.daily_cases, full.daily_cases)
+    assert store.fingerprint == full.fingerprint
+
+
+# the fixture must exercise every part of the pass, otherwise the test above proves little
+def test_fixture_triggers_every_flag(fixture_source):
+    store = handler.buildCovidDataStore(fixture_source, quality_policy=POLICIES[0])
+    assert all(count > 0 for count in store.quality.counts().values())
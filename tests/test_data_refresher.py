@@ -0,0 +1,50 @@
+import os
+import threading
+
+from data_loader import LocalFileSource
+from data_refresher import DataRefresher
+import Covid19DataHandler as handler
+
+
+# a rewritten file without new days is read once, not on every check after
+def test_changed_file_without_new_days_is_read_once(fixture_source, tmp_path, monkeypatch):
+    path = tmp_path / os.path.basename(fixture_source.path)
+    path.write_bytes(open(fixture_source.path, 'rb').read())
+    source = LocalFileSource(str(path))
+    store = handler.buildCovidDataStore(source, source.fingerprint())
+    published = []
+    refresher = DataRefresher(source, store, published.append)
+
+    path.write_bytes(path.read_bytes() + b'\n')
+    reads = []
+    read_chunks = source.read_chunks
+    monkeypatch.setattr(source, 'read_chunks', lambda *args, **kwargs: reads.append(1) or read_chunks(*args, **kwargs))
+    assert not refresher.refresh()
+    assert not refresher.refresh()
+    assert len(reads) == 1
+    assert refresher.source_fingerprint == source.fingerprint()
+    assert published == []
+
+
+def test_new_days_are_published(fixture_source, truncated_source):
+    old_source = truncated_source(150)
+    store = handler.buildCovidDataStore(old_source, old_source.fingerprint())
+    published = []
+    refresher = DataRefresher(fixture_source, store, published.append)
+    assert refresher.refresh()
+    assert len(published[0].dates) == 180
+    assert not refresher.refresh()
+
+
+def test_initial_delay_checks_right_after_start(fixture_source, truncated_source):
+    old_source = truncated_source(150)
+    store = handler.buildCovidDataStore(old_source, old_source.fingerprint())
+    published = threading.Event()
+    refresher = DataRefresher(fixture_source, store, lambda new_store: published.set(), interval=3600, initial_delay=0)
+    refresher.start()
+    try:
+        assert published.wait(30)
+    finally:
+        refresher.stop()
+        refresher.join(30)
+    assert len(refresher.data_store.dates) == 180
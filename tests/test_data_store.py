@@ -0,0 +1,97 @@
+import json
+
+import numpy as np
+import pytest
+
+import Covid19DataHandler as handler
+from region_groups import RegionGroups, build_region_groups
+from tech_analysis_lib import MACDState, RSIState, calculate_macd_batch, calculate_rsi_batch
+
+
+def _build(source):
+    return handler.buildCovidDataStore(source, source.fingerprint())
+
+
+def test_store_matches_dataframe_extraction(fixture_source):
+    store = _build(fixture_source)
+    raw = fixture_source.read_frame()
+    for region in store.regions[:store.base_regions]:
+        expected = handler.getCovidDataFrame(raw_dataframe=raw, country=region, op_mode=handler.OP_MODE_DATAFRAME)
+        actual = store.getRegionFrame(region)
+        assert actual['date'].tolist() == expected['date'].tolist()
+        for column in ('accu_cases', 'daily_cases', 'MACD', 'MACDs', 'MACDh', 'RSI_6', 'RSI_12'):
+            np.testing.assert_allclose(actual[column].to_numpy(dtype=np.float64), expected[column].to_numpy(dtype=np.float64),
+                                       rtol=1e-9, atol=1e-7, err_msg=f'{region} {column}')
+
+
+def test_csv_mode_matches_dataframe_mode(fixture_source):
+    raw = fixture_source.read_frame()
+    from_csv = handler.getCovidDataFrame(fixture_source, country='Japan')
+    from_frame = handler.getCovidDataFrame(raw_dataframe=raw, country='Japan', op_mode=handler.OP_MODE_DATAFRAME)
+    assert from_csv.equals(from_frame)
+
+
+@pytest.mark.parametrize('first_days', [40, 100, 179])
+def test_incremental_update_matches_full_rebuild(fixture_source, truncated_source, first_days):
+    full = _build(fixture_source)
+    store = _build(truncated_source(first_days))
+    for days in (first_days + 1, min(first_days + 30, 180), 180):
+        store = handler.updateCovidDataStore(store, truncated_source(days))
+    assert store.regions == full.regions
+    assert store.dates.equals(full.dates)
+    np.testing.assert_array_equal(store.accu_cases, full.accu_cases)
+    np.testing.assert_array_equal(store.daily_cases, full.daily_cases)
+    for name, values in full.indicators.items():
+        np.testing.assert_allclose(store.indicators[name], values, rtol=1e-9, atol=1e-7, err_msg=name)
+    for name, values in full.latest.columns.items():
+        np.testing.assert_allclose(store.latest.columns[name], values, rtol=1e-9, atol=1e-7, err_msg=name)
+
+
+def test_indicator_states_match_batch(fixture_source):
+    store = _build(fixture_source)
+    daily_cases = np.asarray(store.daily_cases, dtype=np.float64)
+    for expected, actual in zip(calculate_macd_batch(daily_cases), MACDState().update_batch(daily_cases)):
+        np.testing.assert_allclose(actual, expected, rtol=1e-9, atol=1e-7)
+    for rsi_length in handler.RSI_LENGTHS:
+        for smoothing in ('sma', 'wilder'):
+            np.testing.assert_allclose(RSIState(rsi_length, smoothing).update_batch(daily_cases),
+                                       calculate_rsi_batch(daily_cases, rsi_length, smoothing), rtol=1e-9, atol=1e-7)
+    # the day by day state continues where the store's batch left off
+    state = MACDState()
+    state.update_batch(daily_cases[:, :-1])
+    macd = state.update(daily_cases[:, -1])
+    np.testing.assert_allclose(macd[0], store.indicators['MACD'][:, -1], rtol=1e-9, atol=1e-7)
+
+
+def test_group_sums_skip_empty_groups():
+    groups = RegionGroups(['empty', 'first', 'middle', 'last', 'trailing'], [[], [0, 2], [], [1, 2, 3], []])
+    matrix = np.arange(12, dtype=np.int32).reshape(4, 3)
+    sums = groups.sum(matrix)
+    assert sums.dtype == np.int64
+    np.testing.assert_array_equal(sums, [[0, 0, 0], matrix[[0, 2]].sum(axis=0), [0, 0, 0], matrix[1:].sum(axis=0), [0, 0, 0]])
+    np.testing.assert_array_equal(groups.sum(matrix.astype(np.float64)), sums)
+
+
+# REGION_GROUPS_FILE: members by normalized name or alias, unknown members are skipped and groups left empty dropped
+def test_custom_groups_from_file(fixture_source, tmp_path):
+    groups_file = tmp_path / 'groups.json'
+    groups_file.write_text(json.dumps({'confirmed_global': {
+        'Pacific': ['Japan', 'taiwan', 'Atlantis'],
+        'Nowhere': ['Atlantis', 'El Dorado'],
+    }}), encoding='utf-8')
+    with open(groups_file, 'r', encoding='utf-8') as f:
+        custom_groups = json.load(f)
+    store = handler.buildCovidDataStore(fixture_source, fixture_source.fingerprint(), custom_groups=custom_groups['confirmed_global'])
+    assert 'Nowhere' not in store.region_index
+    assert store.regions[-1] == 'Pacific'
+    members = [store.region_index['Japan'], store.region_index['Taiwan*']]
+    np.testing.assert_array_equal(store.accu_cases[-1], np.asarray(store.accu_cases)[members].sum(axis=0))
+    assert store.custom_groups == handler._customGroups(custom_groups['confirmed_global'])
+
+
+def test_unknown_group_members_are_skipped():
+    regions = ['Japan', 'Taiwan*', 'Korea, South']
+    groups = build_region_groups(regions, {}, custom_groups={'East Asia': ['korea', 'Mordor', 'Japan', 'Japan'], 'Void': ['Mordor'], 'Japan': ['Japan']})
+    # groups named like a region are dropped too
+    assert groups.names == ['East Asia']
+    assert groups.members(0).tolist() == [0, 2]
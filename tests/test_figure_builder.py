@@ -0,0 +1,22 @@
+import json
+
+import Covid19DataHandler as handler
+from figure_builder import build_comparison_json, build_figure_json
+
+COLORS = {"background": "#000000", "text": "#ffFFFF"}
+
+
+def _uirevision(figure_json):
+    return json.loads(figure_json)["layout"]["uirevision"]
+
+
+# zoomed redraws keep plotly's zoom, another region, chart or resolution resets it
+def test_uirevision_follows_region_chart_and_resolution(fixture_source):
+    store = handler.buildCovidDataStore(fixture_source)
+    revision = _uirevision(build_figure_json(store, 'Japan', 'Line', COLORS, resolution='auto'))
+    assert _uirevision(build_figure_json(store, 'Japan', 'Line', COLORS, resolution='auto', window=(10, 40))) == revision
+    others = {_uirevision(build_figure_json(store, 'Chile', 'Line', COLORS, resolution='auto')),
+              _uirevision(build_figure_json(store, 'Japan', 'RSI', COLORS, resolution='auto')),
+              _uirevision(build_figure_json(store, 'Japan', 'Line', COLORS, resolution='week')),
+              _uirevision(build_comparison_json(store, ['Japan', 'Chile'], 'Line', COLORS, resolution='auto'))}
+    assert revision not in others and len(others) == 4
@@ -0,0 +1,113 @@
+import threading
+import time
+
+from figure_cache import FigureCache
+
+
+def test_put_for_an_older_version_is_dropped():
+    cache = FigureCache(version='v1')
+    cache.put('fig', 'old', version='v1')
+    cache.set_version('v2')
+    assert cache.get('fig', version='v2') is None
+    # a build that started on v1 finishes after the refresh to v2
+    cache.put('fig', 'stale', version='v1')
+    assert cache.get('fig', version='v2') is None
+    cache.put('fig', 'new', version='v2')
+    assert cache.get('fig', version='v2') == 'new'
+
+
+# requests still holding the store from before a refresh neither clear nor flip back the new version
+def test_old_and_new_versions_interleaved():
+    cache = FigureCache(version='v1')
+    cache.put('a', 'a1', version='v1')
+    cache.set_version('v2')
+    cache.put('a', 'a2', version='v2')
+    cache.put('b', 'b2', version='v2')
+    for _ in range(3):
+        assert cache.get('a', version='v1') is None
+        cache.put('a', 'a1', version='v1')
+        assert cache.build_once('b', lambda: 'b1', version='v1') == 'b1'
+        assert cache.get('a', version='v2') == 'a2'
+        assert cache.get('b', version='v2') == 'b2'
+    assert cache.version == 'v2'
+    assert cache.stats()['entries'] == 2
+
+
+def test_cache_without_version_takes_the_first():
+    cache = FigureCache()
+    assert cache.get('fig', version='v1') is None
+    cache.put('fig', 'one', version='v1')
+    assert cache.get('fig', version='v1') == 'one'
+    assert cache.version == 'v1'
+
+
+def test_disk_hit_for_an_older_version_is_not_cached_in_memory(tmp_path):
+    cache = FigureCache(cache_dir=str(tmp_path), version='v1')
+    cache.put('fig', 'old', version='v1')
+    cache.clear()
+    # the version moves on between the unlocked disk read and the insert
+    read_disk = cache._read_disk
+
+    def read_then_refresh(key, version):
+        cache._read_disk = read_disk
+        value = read_disk(key, version)
+        cache.set_version('v2')
+        return value
+    cache._read_disk = read_then_refresh
+    assert cache.get('fig', version='v1') == 'old'
+    assert cache.version == 'v2'
+    assert cache.stats()['entries'] == 0
+
+
+# n concurrent callers of one key; the build is held until all but the leader joined its flight
+def _build_concurrently(cache, build, n=8):
+    release = threading.Event()
+    results = [None] * n
+
+    def held_build():
+        release.wait(30)
+        return build()
+
+    def call(i):
+        try:
+            results[i] = cache.build_once('key', held_build, 1)
+        except Exception as e:
+            results[i] = e
+
+    threads = [threading.Thread(target=call, args=(i,)) for i in range(n)]
+    for thread in threads:
+        thread.start()
+    deadline = time.monotonic() + 30
+    while cache.stats()['coalesced'] < n - 1 and time.monotonic() < deadline:
+        time.sleep(0.001)
+    release.set()
+    for thread in threads:
+        thread.join(30)
+    return results
+
+
+def test_concurrent_misses_build_once():
+    cache = FigureCache(version=1)
+    builds = []
+    results = _build_concurrently(cache, lambda: builds.append(1) or 'figure')
+    assert builds == [1]
+    assert results == ['figure'] * len(results)
+    assert cache.stats()['coalesced'] == len(results) - 1
+    assert cache.get('key', 1) == 'figure'
+
+
+def test_failed_build_raises_in_every_waiter():
+    cache = FigureCache(version=1)
+    error = ValueError('no data')
+    builds = []
+
+    def build():
+        builds.append(1)
+        raise error
+    results = _build_concurrently(cache, build)
+    assert builds == [1]
+    assert all(result is error for result in results)
+    assert cache.stats()['coalesced'] == len(results) - 1
+    assert cache.get('key', 1) is None
+    # the failed flight is over, the next call builds again
+    assert cache.build_once('key', lambda: 'figure', 1) == 'figure'
@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+
+from tech_analysis_lib import RSIState, SMAState, calculate_rsi_batch, calculate_sma_batch
+
+
+# fractional cumulative counts for a few regions, then a flat run where every change is 0
+def _fractional_then_flat(regions: int = 4, days: int = 90, flat_days: int = 40) -> np.ndarray:
+    rng = np.random.default_rng(7)
+    values = np.cumsum(rng.random((regions, days)) * 10.3 + 0.1, axis=-1)
+    return np.concatenate((values, np.repeat(values[:, -1:], flat_days, axis=-1)), axis=-1)
+
+
+@pytest.mark.parametrize('window', [3, 14])
+def test_sma_state_matches_batch_after_flat_run(window):
+    changes = np.diff(_fractional_then_flat(), axis=-1)
+    changes[:, -20:] = 0.0
+    state = SMAState(window).update_batch(changes)
+    batch = calculate_sma_batch(changes, window)
+    np.testing.assert_allclose(state, batch, rtol=1e-12, atol=1e-12)
+    assert (state[:, -1] == 0.0).all()
+
+
+@pytest.mark.parametrize('smoothing', ['sma', 'wilder'])
+@pytest.mark.parametrize('rsi_length', [6, 14])
+def test_rsi_state_matches_batch_after_flat_run(rsi_length, smoothing):
+    values = _fractional_then_flat()
+    state = RSIState(rsi_length, smoothing).update_batch(values)
+    batch = calculate_rsi_batch(values, rsi_length, smoothing)
+    np.testing.assert_allclose(state, batch, rtol=1e-9, atol=1e-9)
+    if smoothing == 'sma':
+        assert (state[:, -1] == 50.0).all()
+
+
+def test_rsi_state_round_trips_through_dict():
+    values = _fractional_then_flat()
+    state = RSIState(14)
+    state.update_batch(values[:, :60])
+    resumed = RSIState.from_dict(state.to_dict())
+    np.testing.assert_array_equal(resumed.update_batch(values[:, 60:]), state.update_batch(values[:, 60:]))
+
+
+# the O(1) state does the batch's cumulative sum arithmetic, so long series stay bit-identical
+@pytest.mark.parametrize('window', [1, 7, 30, 365])
+def test_sma_state_is_bit_identical_to_batch_over_long_series(window):
+    rng = np.random.default_rng(11)
+    values = rng.random((3, 5000)) * 1e4
+    values[:, 2000:2600] = 0.0
+    state = SMAState(window)
+    np.testing.assert_array_equal(state.update_batch(values[:, :3000]), calculate_sma_batch(values, window)[:, :3000])
+    resumed = SMAState.from_dict(state.to_dict())
+    np.testing.assert_array_equal(resumed.update_batch(values[:, 3000:]), calculate_sma_batch(values, window)[:, 3000:])
+
+
+def test_rsi_state_is_bit_identical_to_batch_over_long_series():
+    rng = np.random.default_rng(12)
+    values = np.cumsum(rng.random((3, 4000)) * 50.7, axis=-1)
+    values[:, 1500:1800] = values[:, 1499:1500]
+    for rsi_length in (6, 12, 14):
+        np.testing.assert_array_equal(RSIState(rsi_length).update_batch(values), calculate_rsi_batch(values, rsi_length))
@@ -0,0 +1,67 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from lod import SCALAR_ROWS, lttb_indices, window_from_relayout
+
+
+@pytest.fixture
+def values() -> np.ndarray:
+    rng = np.random.default_rng(7)
+    values = rng.poisson(50, (SCALAR_ROWS * 3, 400)).astype(np.float64)
+    values[:, 100:130] *= 8  # a wave
+    values[1, 200] = np.nan
+    values[2, -1] = 1e6  # a dump on the last day
+    return values
+
+
+# batches up to SCALAR_ROWS rows take the python loop, larger ones the numpy path
+@pytest.mark.parametrize('points', [3, 50, 300])
+def test_scalar_and_batched_lttb_agree(values, points):
+    batched = lttb_indices(values, points)
+    assert batched.shape == (len(values), points)
+    for start in range(0, len(values), SCALAR_ROWS):
+        np.testing.assert_array_equal(lttb_indices(values[start:start + SCALAR_ROWS], points), batched[start:start + SCALAR_ROWS])
+    np.testing.assert_array_equal(lttb_indices(values[0], points)[0], batched[0])
+
+
+def test_lttb_keeps_first_and_last_day(values):
+    picks = lttb_indices(values, 50)
+    assert (picks[:, 0] == 0).all()
+    assert (picks[:, -1] == values.shape[1] - 1).all()
+    assert (np.diff(picks, axis=1) > 0).all()
+    # the peak of the wave is kept
+    assert np.argmax(values[0, :200]) in picks[0]
+    # no reduction when the points cover every day
+    np.testing.assert_array_equal(lttb_indices(values[:2], 400), np.tile(np.arange(400), (2, 1)))
+
+
+DATES = pd.date_range('2020-01-22', periods=100)
+
+
+@pytest.mark.parametrize('relayout_data, expected', [
+    (None, None),
+    ({}, None),
+    ({'xaxis.autorange': True}, None),
+    ({'autosize': True}, None),
+    # one day of margin on both sides
+    ({'xaxis.range[0]': '2020-02-01', 'xaxis.range[1]': '2020-02-10'}, (9, 21)),
+    ({'xaxis.range': ['2020-02-01', '2020-02-10']}, (9, 21)),
+    # plotly's date strings with a time of day, the partly shown days are included
+    ({'xaxis.range[0]': '2020-02-01 12:00:00.5', 'xaxis.range[1]': '2020-02-10 06:00'}, (10, 21)),
+    # clipped to the data
+    ({'xaxis.range[0]': '2019-12-01', 'xaxis.range[1]': '2020-01-25'}, (0, 5)),
+    ({'xaxis.range[0]': '2020-04-01', 'xaxis.range[1]': '2021-01-01'}, (69, 100)),
+    # partial or unreadable ranges
+    ({'xaxis.range[0]': '2020-02-01'}, None),
+    ({'xaxis.range[1]': '2020-02-10'}, None),
+    ({'xaxis.range': ['2020-02-01']}, None),
+    ({'xaxis.range': ['soon', 'later']}, None),
+    ({'xaxis.range[0]': '2020-02-10', 'xaxis.range[1]': '2020-02-01'}, None),
+])
+def test_window_from_relayout(relayout_data, expected):
+    assert window_from_relayout(relayout_data, DATES) == expected
+
+
+def test_window_without_dates():
+    assert window_from_relayout({'xaxis.range': ['2020-02-01', '2020-02-10']}, DATES[:0]) is None
@@ -0,0 +1,55 @@
+import pytest
+
+from region_index import RegionIndex, normalize_region_name
+
+REGIONS = ['Korea, South', 'Korea, North', 'Taiwan*', 'Australia', 'Austria', 'Canada, Ontario', 'Canada, Quebec',
+           'Germany', 'Guinea', 'Guinea-Bissau', 'Equatorial Guinea', 'Papua New Guinea', "Cote d'Ivoire"]
+
+
+@pytest.fixture
+def index() -> RegionIndex:
+    return RegionIndex(REGIONS)
+
+
+def test_normalized_names():
+    assert normalize_region_name('Taiwan*') == 'taiwan'
+    assert normalize_region_name("Côte d'Ivoire") == 'cote d ivoire'
+    assert normalize_region_name('  Canada,  Ontario ') == 'canada ontario'
+
+
+def test_lookup_exact_normalized_and_alias(index):
+    assert index.lookup('Korea, South') == 'Korea, South'
+    assert index.lookup('taiwan') == 'Taiwan*'
+    assert index.lookup('korea') == 'Korea, South'
+    assert index.lookup('ivory coast') == "Cote d'Ivoire"
+    # aliases of regions missing from the dataset resolve to nothing
+    assert index.lookup('usa') is None
+    assert index.lookup(None) is None
+
+
+def test_search_ranks_exact_then_prefix_then_word_prefix(index):
+    # the alias is exact, the other Korea is a name prefix
+    assert index.search('korea') == ['Korea, South', 'Korea, North']
+    # 'Austria' is not an exact name, both names start with 'austr', sorted by name
+    assert index.search('austr') == ['Australia', 'Austria']
+    # exact, then names starting with 'guinea', then names with a word starting with it
+    assert index.search('guinea') == ['Guinea', 'Guinea-Bissau', 'Equatorial Guinea', 'Papua New Guinea']
+    # every query word starts a word of the name, in any order
+    assert index.search('ont can') == ['Canada, Ontario']
+
+
+def test_search_fuzzy_matches_typos_last(index):
+    assert index.search('germny') == ['Germany']
+    assert index.search('austrlia')[0] == 'Australia'
+    assert index.search('zzzz') == []
+
+
+def test_search_limit(index):
+    assert index.search('guinea', limit=2) == ['Guinea', 'Guinea-Bissau']
+    assert index.search('guinea', limit=0) == []
+    assert index.search('c', limit=2) == ['Canada, Ontario', 'Canada, Quebec']
+
+
+@pytest.mark.parametrize('query', ['', '   ', '***', None])
+def test_empty_query(index, query):
+    assert index.search(query) == []
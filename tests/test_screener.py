@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+
+import Covid19DataHandler as handler
+from screener import LatestSnapshot
+
+
+def _snapshot(values, base_regions=3):
+    values = np.asarray(values, dtype=np.float64)
+    regions = [f'region {row}' for row in range(len(values))]
+    return LatestSnapshot(regions, None, base_regions, {'cases_7d': np.arange(len(values), dtype=np.float64) * 10, 'growth_7d': values})
+
+
+@pytest.mark.parametrize('descending, expected', [(True, [3, 0, 4, 1, 2]), (False, [4, 0, 3, 1, 2])])
+def test_rank_puts_nan_last(descending, expected):
+    snapshot = _snapshot([5.0, np.nan, np.nan, 20.0, -1.0])
+    assert snapshot.rank('growth_7d', descending).tolist() == expected
+
+
+def test_rank_scope_and_min_cases():
+    snapshot = _snapshot([5.0, np.nan, 7.0, 20.0, -1.0])
+    assert snapshot.rank('growth_7d', scope='regions').tolist() == [2, 0, 1]
+    assert snapshot.rank('growth_7d', scope='aggregates').tolist() == [3, 4]
+    # cases_7d is 10 * row
+    assert snapshot.rank('growth_7d', min_cases_7d=20).tolist() == [3, 2, 4]
+    with pytest.raises(ValueError):
+        snapshot.rank('growth_7d', scope='continents')
+    with pytest.raises(ValueError):
+        snapshot.rank('unknown')
+
+
+def _build(store, days):
+    indicators = {name: np.asarray(values)[:, :days] for name, values in store.indicators.items()}
+    return LatestSnapshot.build(store.regions, store.dates[:days], store.base_regions, np.asarray(store.accu_cases)[:, :days],
+                                np.asarray(store.daily_cases)[:, :days], indicators)
+
+
+# appended days, one at a time or several at once, give the snapshot of a full build
+@pytest.mark.parametrize('step', [1, 6, 30])
+def test_append_matches_build(fixture_source, step):
+    store = handler.buildCovidDataStore(fixture_source, fixture_source.fingerprint())
+    snapshot = _build(store, 150)
+    for days in range(150 + step, 181, step):
+        indicators = {name: np.asarray(values)[:, :days] for name, values in store.indicators.items()}
+        snapshot = snapshot.append(store.dates[:days], np.asarray(store.accu_cases)[:, :days],
+                                   np.asarray(store.daily_cases)[:, :days], indicators, step)
+    expected = _build(store, 180)
+    assert snapshot.date == expected.date
+    assert snapshot.columns.keys() == expected.columns.keys()
+    for name, values in expected.columns.items():
+        np.testing.assert_array_equal(snapshot.columns[name], values, err_msg=name)
+    assert snapshot.rank('growth_7d').tolist() == expected.rank('growth_7d').tolist()
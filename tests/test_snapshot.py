@@ -0,0 +1,74 @@
+import os
+
+import numpy as np
+
+import Covid19DataHandler as handler
+
+
+def _generations(snapshot_dir):
+    return sorted(name for name in os.listdir(snapshot_dir) if name.startswith('generation-'))
+
+
+def test_snapshot_round_trip(fixture_source, tmp_path):
+    store = handler.buildCovidDataStore(fixture_source, fixture_source.fingerprint())
+    handler.saveCovidDataSnapshot(store, str(tmp_path))
+    snapshot = handler.loadCovidDataSnapshot(str(tmp_path))
+    assert snapshot.fingerprint == store.fingerprint
+    assert snapshot.regions == store.regions
+    np.testing.assert_array_equal(snapshot.daily_cases, store.daily_cases)
+    for name, values in store.indicators.items():
+        np.testing.assert_array_equal(snapshot.indicators[name], values)
+
+
+# a reader sees exactly one complete generation, never the arrays of one save with the index of another
+def test_snapshot_reads_one_generation(fixture_source, truncated_source, tmp_path):
+    old = handler.buildCovidDataStore(truncated_source(150))
+    new = handler.buildCovidDataStore(fixture_source)
+    handler.saveCovidDataSnapshot(old, str(tmp_path))
+    # a save that has not swapped the pointer yet is invisible
+    partial = tmp_path / 'generation-partial'
+    partial.mkdir()
+    np.save(partial / 'daily_cases.npy', np.asarray(new.daily_cases))
+    assert handler.loadCovidDataSnapshot(str(tmp_path)).fingerprint == old.fingerprint
+
+    handler.saveCovidDataSnapshot(new, str(tmp_path))
+    snapshot = handler.loadCovidDataSnapshot(str(tmp_path))
+    assert snapshot.fingerprint == new.fingerprint
+    np.testing.assert_array_equal(snapshot.daily_cases, new.daily_cases)
+
+
+def test_old_generations_are_pruned(fixture_source, tmp_path):
+    store = handler.buildCovidDataStore(fixture_source)
+    for _ in range(5):
+        handler.saveCovidDataSnapshot(store, str(tmp_path))
+    generations = _generations(str(tmp_path))
+    assert len(generations) == handler.SNAPSHOT_KEEP_GENERATIONS + 1
+    assert handler._currentSnapshotGeneration(str(tmp_path)) in generations
+
+
+def test_missing_snapshot(tmp_path):
+    assert handler.loadCovidDataSnapshot(str(tmp_path / 'none')) is None
+
+
+# workers share the pages of one snapshot, a worker publishing data already saved by another writes nothing
+def test_shared_store_is_memory_mapped(fixture_source, tmp_path):
+    store = handler.buildCovidDataStore(fixture_source, fixture_source.fingerprint())
+    shared = handler.shareCovidDataStore(store, str(tmp_path))
+    assert shared is not store
+    assert shared.fingerprint == store.fingerprint
+    assert isinstance(shared.daily_cases, np.memmap)
+    np.testing.assert_array_equal(shared.daily_cases, store.daily_cases)
+    generations = _generations(str(tmp_path))
+
+    other_worker = handler.buildCovidDataStore(fixture_source, fixture_source.fingerprint())
+    assert isinstance(handler.shareCovidDataStore(other_worker, str(tmp_path)).daily_cases, np.memmap)
+    assert _generations(str(tmp_path)) == generations
+
+
+# a start that leaves the source check to the refresher does not ask the source while a snapshot exists
+def test_load_without_revalidation(fixture_source, tmp_path, monkeypatch):
+    store = handler.loadCovidDataStore(fixture_source, str(tmp_path))
+    monkeypatch.setattr(fixture_source, 'fingerprint', lambda: 1 / 0)
+    snapshot = handler.loadCovidDataStore(fixture_source, str(tmp_path), revalidate=False)
+    assert snapshot.fingerprint == store.fingerprint
+    assert isinstance(snapshot.daily_cases, np.memmap)